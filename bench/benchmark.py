@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Benchmarks for conWeather
+#
+# Everything runs against the local stub server (stubServer.py) and the
+# payloads in fixtures/, so results don't depend on the real services or
+# the network. Measured:
+#   start.*   : whole weather.py / weatherPrompt.py processes (launch.py),
+#               refreshing from the server or using the saved data
+#   extract.* : parsing a received payload into an observation or forecast
+#   format.*  : each output format
+#   multi.*   : multi-location sweeps, with server latency and errors, and
+#               with the daily call limit
+#
+# Results (milliseconds per run) can be saved as a baseline, and later runs
+# compared with it; a slower median than the threshold allows is reported
+# as a regression.
+#
+#   benchmark.py [--runs N] [--only PREFIX] [--latency SECONDS] [--errors RATE]
+#                [--save] [--compare] [--baseline FILE] [--threshold PCT]
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import getopt
+import platform
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from stubServer import StubServer, FIXTURE_DIR
+from launch import BASE_PATHS, redirect
+
+###############################################################################
+
+# Runs per benchmark (whole processes are slower, so they get fewer)
+RUNS = 50
+PROCESS_RUNS = 10
+
+# Shortest run of the in-process benchmarks, in seconds. Fast calls are
+# repeated within a run until it's about this long.
+MIN_RUN_TIME = 0.005
+
+# Server latency for the multi-location sweeps, in seconds, and the share
+# of failed requests in the sweep with errors
+LATENCY = 0.05
+ERROR_RATE = 0.25
+
+# Locations in the multi-location sweeps
+SWEEP_SIZES = (8, 32)
+
+# Locations in the sweep made with a service's daily call limit, from a
+# new day's quota
+QUOTA_SWEEP_SIZE = 60
+
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+
+# Allowed slowdown of a median before it's a regression, in percent
+THRESHOLD = 25.0
+
+###############################################################################
+# Timing helpers. Each returns the run times in milliseconds.
+
+def calibrate(function):
+    """Return how many calls of a function make a run of MIN_RUN_TIME"""
+
+    inner = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(inner):
+            function()
+        if time.perf_counter() - start >= MIN_RUN_TIME:
+            return inner
+        inner *= 2
+
+def timeRuns(function, runs, inner=1):
+    """Time a function: runs runs of inner calls each (None: calibrate)"""
+
+    if inner is None:
+        inner = calibrate(function)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(inner):
+            function()
+        times.append((time.perf_counter() - start) * 1000.0 / inner)
+    return times
+
+def summarize(times, **extra):
+    """Return statistics for a list of run times"""
+
+    ordered = sorted(times)
+    result = {
+        "runs": len(ordered),
+        "median_ms": round(statistics.median(ordered), 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "min_ms": round(ordered[0], 4),
+    }
+    result.update(extra)
+    return result
+
+def loadFixture(name):
+    """Return a fixture's JSON data"""
+    with open(os.path.join(FIXTURE_DIR, name)) as fixture_file:
+        return json.load(fixture_file)
+
+###############################################################################
+# Whole processes, started with launch.py.
+
+def runProcess(url, directory, script, args):
+    """Run a launched script once, returning its run time (ms)"""
+
+    command = [sys.executable, os.path.join(BENCH_DIR, "launch.py"), url, directory, script] + args
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000.0
+
+def benchStart(results, url, runs, selected):
+    """Time weather.py and weatherPrompt.py processes"""
+
+    directory = tempfile.mkdtemp(prefix="conweather-bench-")
+    try:
+        cases = [
+            ("start.owm.refresh", "weather.py", ["-f", "-p", "owm"]),
+            ("start.owm.saved", "weather.py", ["-o", "-p", "owm"]),
+            ("start.wapi.refresh", "weather.py", ["-f", "-p", "wapi"]),
+            ("start.wapi.saved", "weather.py", ["-o", "-p", "wapi"]),
+            ("start.owm.forecast", "weather.py", ["-F", "-f", "-p", "owm"]),
+            ("start.prompt", "weatherPrompt.py", ["-1", "-p", "owm"]),
+        ]
+        # Saved data (and rendered output) for the runs that use it
+        runProcess(url, directory, "weather.py", ["-f", "-p", "owm"])
+        runProcess(url, directory, "weather.py", ["-f", "-p", "wapi"])
+
+        for name, script, args in cases:
+            if selected(name):
+                times = [runProcess(url, directory, script, args) for _ in range(runs)]
+                results[name] = summarize(times)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+###############################################################################
+# In-process benchmarks.
+
+def benchExtract(results, runs, selected):
+    """Time parsing of each payload"""
+
+    import weatherOWM
+    import weatherAPI
+
+    cases = [
+        ("extract.owm.current", lambda: weatherOWM.ParseWeatherData(owmCurrent)),
+        ("extract.wapi.current", lambda: weatherAPI.ParseWeatherData(wapiCurrent, wapiAstro)),
+        ("extract.owm.forecast", lambda: weatherOWM.ParseForecast(owmForecast)),
+        ("extract.wapi.forecast", lambda: weatherAPI.ParseForecast(wapiForecast)),
+        ("extract.owm.json", lambda: json.loads(owmForecastText)),
+    ]
+    owmCurrent = loadFixture("owm_onecall.json")
+    wapiCurrent = loadFixture("wapi_current.json")
+    wapiAstro = loadFixture("wapi_astronomy.json")
+    owmForecast = loadFixture("owm_forecast.json")
+    wapiForecast = loadFixture("wapi_forecast.json")
+    owmForecastText = json.dumps(owmForecast)
+
+    for name, function in cases:
+        if selected(name):
+            results[name] = summarize(timeRuns(function, runs, None))
+
+def benchFormat(results, runs, selected):
+    """Time each output format"""
+
+    import weather
+    import weatherOWM
+
+    obs = weatherOWM.ParseWeatherData(loadFixture("owm_onecall.json"))
+    obs.city = "Burlington"
+    fc = weatherOWM.ParseForecast(loadFixture("owm_forecast.json"))
+    fc.city = "Burlington"
+
+    cases = [
+        ("format.full", weather.FormatFull, obs),
+        ("format.short", weather.FormatShort, obs),
+        ("format.tiny", weather.FormatTiny, obs),
+        ("format.oneline", weather.FormatOneLine, obs),
+        ("format.forecast.full", weather.FormatForecastFull, fc),
+        ("format.forecast.short", weather.FormatForecastShort, fc),
+        ("format.forecast.tiny", weather.FormatForecastTiny, fc),
+        ("format.forecast.oneline", weather.FormatForecastOneLine, fc),
+    ]
+    for name, formatter, data in cases:
+        if not selected(name):
+            continue
+
+        def run():
+            weather.weatherInfo = []
+            formatter(data)
+
+        results[name] = summarize(timeRuns(run, runs, None))
+    weather.weatherInfo = []
+
+def sweepLocations(size):
+    """Return size locations for a sweep"""
+    return [{"name": "Site " + str(i), "lat": "{:.4f}".format(40.0 + i * 0.01),
+             "lon": "-71.0000", "zip": "", "alt": "0"} for i in range(size)]
+
+def benchMulti(results, server, runs, selected):
+    """Time multi-location sweeps, without and with server errors, and
+    with the quota"""
+
+    import weatherOWM
+    import weatherOpenMeteo
+    import weatherQuota
+    import weatherBreaker
+    from weatherMulti import FetchAllLocations
+
+    # Every request goes to the server, even while it's failing
+    weatherBreaker.ENABLED = False
+    errorRate = server.errorRate
+    # A request per location (OWM), or a batch request (Open-Meteo)
+    for module, batch in ((weatherOWM, None), (weatherOpenMeteo, weatherOpenMeteo.FetchLocationsWeather)):
+        for size in SWEEP_SIZES:
+            locations = sweepLocations(size)
+            sweepName = "multi." + module.PROVIDER + "." + str(size)
+            for name, rate in ((sweepName, 0.0), (sweepName + ".errors", errorRate)):
+                if not selected(name):
+                    continue
+                server.errorRate = rate
+                failed = []
+
+                def run():
+                    sweep = FetchAllLocations(module.FetchLocationWeather, module.ExtractLocationWeather,
+                                              locations, False, False, batch=batch)
+                    failed.append(sum(1 for result in sweep if result["error"] is not None))
+
+                times = timeRuns(run, max(1, runs // 5))
+                results[name] = summarize(times, locations=size, latency_s=server.latency,
+                                          errors=round(statistics.mean(failed), 2))
+    server.errorRate = errorRate
+    weatherBreaker.ENABLED = True
+
+    # No request of a sweep should be refused by the quota (errors: 0)
+    name = "multi.owm." + str(QUOTA_SWEEP_SIZE) + ".quota"
+    if selected(name):
+        locations = sweepLocations(QUOTA_SWEEP_SIZE)
+        weatherQuota.SetDailyLimit(weatherOWM.PROVIDER, weatherOWM.DAILY_CALL_LIMIT, len(locations))
+        failed = []
+
+        def run():
+            # A new day's quota, every run
+            try:
+                os.unlink(weatherQuota.QUOTA_FILE)
+            except OSError:
+                pass
+            sweep = FetchAllLocations(weatherOWM.FetchLocationWeather, weatherOWM.ExtractLocationWeather,
+                                      locations, False, False)
+            failed.append(sum(1 for result in sweep if result["error"] is not None))
+
+        server.errorRate = 0.0
+        times = timeRuns(run, max(1, runs // 5))
+        server.errorRate = errorRate
+        weatherQuota.limits.pop(weatherOWM.PROVIDER, None)
+        results[name] = summarize(times, locations=QUOTA_SWEEP_SIZE, latency_s=server.latency,
+                                  daily_call_limit=weatherOWM.DAILY_CALL_LIMIT,
+                                  errors=round(statistics.mean(failed), 2))
+
+###############################################################################
+# Baseline files.
+
+def environment(settings):
+    """Describe where the results came from"""
+
+    import weatherConversions
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": weatherConversions.loadNumpy() is not None,
+        "settings": settings,
+    }
+
+def saveBaseline(path, report):
+    """Save results as the baseline"""
+    with open(path, "w") as baseline_file:
+        json.dump(report, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+def compareBaseline(path, results, threshold):
+    """Compare results with the baseline. Returns the names that regressed."""
+
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+
+    regressions = []
+    print("{:<28} {:>12} {:>12} {:>8}".format("benchmark", "baseline ms", "median ms", "change"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_ms"]
+        after = results[name]["median_ms"]
+        change = (after - before) * 100.0 / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{:<28} {:>12.3f} {:>12.3f} {:>+7.1f}%{}".format(name, before, after, change, flag))
+    return regressions
+
+def printResults(results):
+    """Print a table of results"""
+
+    print("{:<28} {:>6} {:>12} {:>12} {:>12}".format("benchmark", "runs", "median ms", "p95 ms", "min ms"))
+    for name in sorted(results):
+        result = results[name]
+        print("{:<28} {:>6} {:>12.3f} {:>12.3f} {:>12.3f}".format(
+            name, result["runs"], result["median_ms"], result["p95_ms"], result["min_ms"]))
+
+###############################################################################
+
+def usage():
+    print("Usage: {:s} [--runs N] [--only PREFIX] [--latency SECONDS] [--errors RATE]".format(os.path.basename(sys.argv[0])))
+    print("       [--save] [--compare] [--baseline FILE] [--threshold PCT]")
+    print()
+    print("  --runs N          Runs per in-process benchmark (default {:d}; processes get {:d})".format(RUNS, PROCESS_RUNS))
+    print("  --only PREFIX     Only run benchmarks whose names start with PREFIX (e.g. format.)")
+    print("  --latency SECONDS Server latency for the multi-location sweeps (default {:g})".format(LATENCY))
+    print("  --errors RATE     Share of failed requests in the sweeps with errors (default {:g})".format(ERROR_RATE))
+    print("  --save            Save the results as the baseline")
+    print("  --compare         Compare the results with the baseline; exit 1 on a regression")
+    print("  --baseline FILE   Baseline file (default bench/baseline.json)")
+    print("  --threshold PCT   Allowed slowdown of a median (default {:g}%)".format(THRESHOLD))
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "runs=", "only=", "latency=", "errors=",
+                                                      "save", "compare", "baseline=", "threshold="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+
+    runs = RUNS
+    processRuns = PROCESS_RUNS
+    prefixes = []
+    latency = LATENCY
+    errorRate = ERROR_RATE
+    save = False
+    compare = False
+    baselineFile = BASELINE_FILE
+    threshold = THRESHOLD
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o == "--runs":
+            runs = int(a)
+            processRuns = max(1, min(runs, PROCESS_RUNS))
+        elif o == "--only":
+            prefixes.append(a)
+        elif o == "--latency":
+            latency = float(a)
+        elif o == "--errors":
+            errorRate = float(a)
+        elif o == "--save":
+            save = True
+        elif o == "--compare":
+            compare = True
+        elif o == "--baseline":
+            baselineFile = a
+        elif o == "--threshold":
+            threshold = float(a)
+
+    def selected(name):
+        return not prefixes or any(name.startswith(prefix) for prefix in prefixes)
+
+    # In-process benchmarks use their own cache too, and the stub server
+    directory = tempfile.mkdtemp(prefix="conweather-bench-")
+    import weatherCache
+    weatherCache.CACHE_DIR = directory
+    redirect(directory)
+    import weatherOWM
+    import weatherAPI
+    import weatherOpenMeteo
+
+    server = StubServer(errorRate=0.0).start()
+    url = server.url()
+    for module in (weatherOWM, weatherAPI, weatherOpenMeteo):
+        module.API_KEY = "bench"
+        module.BASE_URL = url + BASE_PATHS[module.PROVIDER]
+
+    results = {}
+    try:
+        benchStart(results, url, processRuns, selected)
+        benchExtract(results, runs, selected)
+        benchFormat(results, runs, selected)
+        server.latency = latency
+        server.errorRate = errorRate
+        benchMulti(results, server, runs, selected)
+    finally:
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    printResults(results)
+
+    report = environment({"runs": runs, "process_runs": processRuns, "min_run_s": MIN_RUN_TIME,
+                          "latency_s": latency, "error_rate": errorRate})
+    report["results"] = results
+
+    if save:
+        saveBaseline(baselineFile, report)
+        print("Saved baseline to " + baselineFile)
+
+    if compare:
+        print()
+        if compareBaseline(baselineFile, results, threshold):
+            sys.exit(1)
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Run weather.py or weatherPrompt.py against the stub server
+#
+# The weather service is pointed at the stub server (see stubServer.py) and
+# the cache and rendered output go to their own directory, so benchmark runs
+# neither use nor disturb the real saved data. benchmark.py times whole
+# processes started with this script.
+#
+#   launch.py URL DIR weather.py|weatherPrompt.py [ARGS...]
+###############################################################################
+
+import os
+import sys
+import runpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+###############################################################################
+
+def configure(url, directory, argv):
+    """Point the selected service at the stub server, and the saved data at directory"""
+
+    import weatherCache
+    import weatherPrompt
+    import weatherProviders
+
+    # Before the service module is imported: it names its files on import
+    weatherCache.CACHE_DIR = directory
+    redirect(directory)
+
+    name = None
+    if "-p" in argv[:-1]:
+        name = argv[argv.index("-p") + 1]
+    module = weatherProviders.LoadProvider(name)
+    module.API_KEY = "bench"
+    module.BASE_URL = url + BASE_PATHS[module.PROVIDER]
+    # Requests are counted, but never run out
+    module.DAILY_CALL_LIMIT = None
+
+def redirect(directory):
+    """Keep rendered output, metrics events, the quota and circuit breaker
+    state and response times in directory"""
+
+    import weatherPrompt
+    import weatherMetrics
+    import weatherQuota
+    import weatherHedge
+    import weatherBreaker
+
+    weatherPrompt.RENDER_DIR = directory
+    weatherMetrics.EXPORTER_FILE = os.path.join(directory, "metrics.port")
+    weatherMetrics.SPOOL_FILE = os.path.join(directory, "metrics.spool")
+    weatherQuota.QUOTA_DIR = directory
+    weatherQuota.QUOTA_FILE = os.path.join(directory, "quota.json")
+    weatherQuota.QUOTA_LOCK = os.path.join(directory, "quota.lock")
+    weatherHedge.LATENCY_DIR = directory
+    weatherHedge.LATENCY_FILE = os.path.join(directory, "latency.json")
+    weatherHedge.LATENCY_LOCK = os.path.join(directory, "latency.lock")
+    weatherBreaker.BREAKER_DIR = directory
+    weatherBreaker.BREAKER_FILE = os.path.join(directory, "breaker.json")
+    weatherBreaker.BREAKER_LOCK = os.path.join(directory, "breaker.lock")
+
+# Path of each service's API on the stub server
+BASE_PATHS = {"owm": "/data/3.0/", "wapi": "/v1/", "meteo": "/v1/"}
+
+###############################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print("Usage: {:s} URL DIR weather.py|weatherPrompt.py [ARGS...]".format(os.path.basename(sys.argv[0])))
+        sys.exit(2)
+
+    url, directory, script = sys.argv[1:4]
+    argv = sys.argv[4:]
+
+    if script == "weatherPrompt.py":
+        # The fast path never loads the service; only redirect its files
+        import weatherPrompt
+        redirect(directory)
+        weatherPrompt.main(argv)
+    else:
+        configure(url, directory, argv)
+        sys.argv = [os.path.join(ROOT, script)] + argv
+        runpy.run_path(sys.argv[0], run_name="__main__")
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Local stand-in for the weather services, for benchmarks
+#
+# Serves the saved payloads in fixtures/ at the same paths as the real
+# servers (OneCall under /data/3.0/, WeatherAPI and Open-Meteo under /v1/),
+# so a provider only needs its BASE_URL pointed here. Open-Meteo requests
+# for several locations get the fixture once per location. Each response can be delayed and a
+# share of them can fail, to measure slow or unreliable servers. Replies
+# have an ETag and Last-Modified time, and conditional requests for an
+# unchanged fixture get "304 Not Modified".
+#
+#   stubServer.py [--port N] [--latency SECONDS] [--jitter SECONDS] [--errors RATE]
+###############################################################################
+
+import os
+import sys
+import gzip
+import time
+import hashlib
+import random
+import getopt
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from email.utils import formatdate
+
+###############################################################################
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Fixture served for each request path. OneCall serves the forecast when
+# the current conditions are excluded.
+ROUTES = {
+    "/data/3.0/onecall": "owm_onecall.json",
+    "/v1/current.json": "wapi_current.json",
+    "/v1/astronomy.json": "wapi_astronomy.json",
+    "/v1/forecast.json": "wapi_forecast.json",
+    "/v1/forecast": "meteo_current.json",
+}
+OWM_FORECAST = "owm_forecast.json"
+METEO_FORECAST = "meteo_forecast.json"
+
+# Error responses, in each service's format
+OWM_ERROR = b'{"cod":429,"message":"Your account is temporary blocked due to exceeding of requests limitation of your subscription type."}'
+WAPI_ERROR = b'{"error":{"code":2007,"message":"API key has exceeded calls per month quota."}}'
+METEO_ERROR = b'{"error":true,"reason":"Minutely API request limit exceeded. Please try again in one minute."}'
+
+###############################################################################
+# Request handler. The server object holds the settings and counters.
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve fixtures with optional latency and errors"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+
+        name = ROUTES.get(url.path)
+        if name is None:
+            self.reply(404, b'{"message":"not found"}')
+            return
+        query = parse_qs(url.query)
+        if url.path.endswith("onecall") and "current" in query.get("exclude", [""])[0]:
+            name = OWM_FORECAST
+        if name.startswith("meteo") and "current" not in query:
+            name = METEO_FORECAST
+        count = len(query.get("latitude", [""])[0].split(","))
+
+        delay = server.latency
+        if server.jitter:
+            delay += server.random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        with server.lock:
+            server.requests += 1
+            failed = server.random.random() < server.errorRate
+            if failed:
+                server.errors += 1
+
+        if failed:
+            if url.path.startswith("/data"):
+                self.reply(429, OWM_ERROR)
+            elif name.startswith("meteo"):
+                self.reply(429, METEO_ERROR)
+            else:
+                self.reply(403, WAPI_ERROR)
+        else:
+            validators = {"ETag": server.etag(name), "Last-Modified": server.modified}
+            if count > 1:
+                # One entry per location: not a fixture to revalidate
+                self.reply(200, b"[" + b",".join([server.fixture(name)] * count) + b"]")
+            elif self.headers.get("If-None-Match") == validators["ETag"] \
+                    or (self.headers.get("If-None-Match") is None
+                        and self.headers.get("If-Modified-Since") == server.modified):
+                self.reply(304, b"", validators)
+            else:
+                self.reply(200, server.fixture(name), validators)
+
+    def reply(self, status, body, headers=None):
+        encoding = None
+        if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, 6)
+            encoding = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+###############################################################################
+# The server, run on a background thread.
+#   latency   : seconds to wait before each response
+#   jitter    : up to this many more seconds, chosen at random
+#   errorRate : share of requests (0-1) answered with a service error
+
+class StubServer(ThreadingHTTPServer):
+    """Local weather service stub"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, errorRate=0.0, seed=0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.fixtures = {}
+        self.modified = formatdate(time.time(), usegmt=True)
+        self.thread = None
+
+    def fixture(self, name):
+        """Return a fixture file's contents (read once)"""
+        if name not in self.fixtures:
+            with open(os.path.join(FIXTURE_DIR, name), "rb") as fixture_file:
+                self.fixtures[name] = fixture_file.read()
+        return self.fixtures[name]
+
+    def etag(self, name):
+        """Entity tag of a fixture"""
+        return '"' + hashlib.sha1(self.fixture(name)).hexdigest()[:16] + '"'
+
+    def url(self):
+        """Base address of the server"""
+        return "http://127.0.0.1:" + str(self.server_address[1])
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests"""
+        self.shutdown()
+        self.server_close()
+
+###############################################################################
+
+def usage():
+    print("Usage: {:s} [--port N] [--latency SECONDS] [--jitter SECONDS] [--errors RATE]".format(os.path.basename(sys.argv[0])))
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "port=", "latency=", "jitter=", "errors="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+
+    settings = {"port": 8080}
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o == "--port":
+            settings["port"] = int(a)
+        elif o == "--latency":
+            settings["latency"] = float(a)
+        elif o == "--jitter":
+            settings["jitter"] = float(a)
+        elif o == "--errors":
+            settings["errorRate"] = float(a)
+
+    server = StubServer(**settings)
+    print("Serving " + FIXTURE_DIR + " at " + server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -28,16 +28,28 @@
 #   server and extract weather info into a common data module (weatherData).
 #   Weather icons can be customized in weatherIcons.
 #
-#   Usage: weather.py [-h|--help] [-d] [-f | -o] [-s | -t | -1]
+#   Usage: weather.py [-h|--help] [-d] [-p NAME] [-a NAME] [-f | -o | -b MS | -r] [-m] [-F] [-s | -t | -1] [-D] [-E PORT] [-H] [-T | --timings=FMT]
 #   optional arguments:
 #     -h, --help Show this help message and exit
 #     -d         DEBUG: Show received JSON data
 #     -i         DEBUG: Show weather icons
+#     -p NAME    Weather service to use: owm (default), wapi, meteo
+#     -a NAME    Hedge: also ask service NAME if -p's is slower than usual
 #     -o         Use 'old' data if it's less than 15 minutes old (default)
 #     -f         Force refresh of data from server
+#     -b MS      Latency budget: if saved data is old, show it (marked stale)
+#                unless a background refresh finishes within MS milliseconds
+#     -r         Refresh saved data if it's old, without output
+#     -m         Multi-location: show weather for every entry in LOCATIONS
+#     -F         Forecast: 48 hours hourly and 8 days daily
 #     -s         Short output
 #     -t         Tiny output
 #     -1         One-liner ANSI colored
+#     -D         Run the background refresh daemon
+#     -E PORT    Run the refresh daemon, serving OpenMetrics on PORT (weatherMetrics)
+#     -H         Record refreshed observations in the history (weatherHistory)
+#     -T         Print how long each phase took (to stderr)
+#     --timings=FMT  Same as -T, as text or json (one JSON object per line)
 #
 # J. Parziale
 # 2022-02-20 Original version, using OpenWeather to get XML
@@ -47,24 +59,54 @@
 # Services:
 # 1) Weather API: https://www.weatherapi.com/
 # 2) OpenWeatherMap: https://openweathermap.org/api/
-# 3) Open Meteo: https://open-meteo.com/ (not implemented)
+# 3) Open Meteo: https://open-meteo.com/
+#
+# The service is chosen at run time (-p NAME, or see weatherProviders.py),
+# and only the chosen service's module is imported.
 ###############################################################################
 
-# @TODO Choose which weather service module to use.
-# Import service-specific API
-# from weatherAPI import *    # @NOTE
-from weatherOWM import *    # @NOTE
+# Phase timings (-T); imported first so the other imports are timed
+import weatherTimings
+from weatherTimings import Phase
 
 import os
 import sys
 import time
+import re
 import getopt
+import atexit
+import subprocess
 import datetime
 
 # Import weather icons
 from weatherIcons import *
+# Import location info
+from weatherLocation import *
+# Weather service registry
+import weatherProviders
+from weatherProviders import LoadProvider
+# Saved rendered output for the prompt fast path
+from weatherPrompt import RenderFile, RenderHeader, RenderedVersion, RenewFile, RENDER_DIR
+from weatherCache import WriteCacheFile, SaveObservation, LoadObservation, EntryVersion
+# Observation history
+import weatherHistory
 # Import extracted weather data
 import weatherData
+# Concurrent fetching for multi-location mode
+from weatherMulti import FetchAllLocations
+# Hourly and daily forecasts
+from weatherForecast import ForecastStats, every, compass
+from weatherConversions import seconds_to_time_batch, seconds_to_weekday_batch
+# Background refresh daemon
+from weatherDaemon import RunDaemon, DaemonIsRunning, DAEMON_MAX_AGE
+# OpenMetrics exporter
+import weatherMetrics
+# Shared API call quota
+from weatherQuota import SetDailyLimit, Stretch
+# Hedged requests
+from weatherHedge import HedgedFetch, EnableRecording, SaveLatencies
+# Circuit breaker of each service
+import weatherBreaker
 
 from colorama import Fore, Back, Style
 # Fore: BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE, RESET.
@@ -77,6 +119,15 @@ from colorama import Fore, Back, Style
 DEBUG = False
 SHOW_ICONS = False
 
+# Selected weather service name (None for the configured default), and
+# its module once loaded
+PROVIDER_NAME = None
+provider = None
+
+# Alternate service for hedged requests (-a), and its module once loaded
+HEDGE_PROVIDER_NAME = None
+alternate = None
+
 # Output text
 weatherInfo = []
 max_width = 0
@@ -89,9 +140,57 @@ OUTPUT_DATA = 0
 # Only query remote if data is not recent
 USE_SAVED = True
 
+# Show every location in LOCATIONS instead of just the current one
+MULTI_LOCATION = False
+
+# Run the background refresh daemon instead of showing the weather
+RUN_DAEMON = False
+
+# Port to serve metrics on while running the daemon (-E), or None
+METRICS_PORT = None
+
+# Show the forecast instead of the current conditions
+FORECAST = False
+
+# Hours between rows of the full hourly forecast
+FORECAST_HOUR_STEP = 3
+
 # Weather data minimum refresh time, in seconds
 RECENT_CHECK_SECONDS = (15.0 * 60.0)
 
+# Latency budget for prompt use (-b), in milliseconds. None waits for the
+# server whenever the saved data is old.
+LATENCY_BUDGET_MS = None
+
+# Oldest saved data (seconds) that may be shown as stale within the
+# latency budget. Older data is always refreshed first.
+MAX_STALE_SECONDS = (24.0 * 60.0 * 60.0)
+
+# Seconds to wait after a background refresh failed (e.g. the daily quota
+# is used up) before starting another
+REFRESH_RETRY_SECONDS = RECENT_CHECK_SECONDS
+
+# Markers shown on stale data
+STALE_TEXT = " (stale)"
+STALE_MARKER = "*"
+
+# Markers shown on saved data used because the weather service is failing
+DEGRADED_TEXT = " (service unavailable)"
+DEGRADED_MARKER = "!"
+
+# Only refresh saved data, don't show it (-r)
+REFRESH_ONLY = False
+
+# Output formats saved for the fast path (weatherPrompt.py), and the
+# terminal capabilities they're rendered for
+RENDER_CAPS = ["ansi", "plain"]
+
+# Report phase timings (-T, --timings): None, "text" or "json"
+TIMINGS = None
+
+# When the imports above were done, for the timings
+IMPORTS_DONE = time.monotonic()
+
 ###############################################################################
 
 # Check if there's a saved file, and if so - was it created within the last 15 minutes.
@@ -101,7 +200,7 @@ def WeatherIsRecent():
     global USE_SAVED
 
     # Check if the weather file exists
-    if not os.path.exists(OUT_DATA_FILE):
+    if not os.path.exists(provider.OUT_DATA_FILE):
         # No file, therefore it's not recent.
         USE_SAVED = False # Cannot use a non-existing saved file. Force refresh.
         return False
@@ -109,7 +208,7 @@ def WeatherIsRecent():
     # File exists: check if it's recent.
     now = datetime.datetime.now()
 
-    modTime = os.path.getmtime(OUT_DATA_FILE)
+    modTime = os.path.getmtime(provider.OUT_DATA_FILE)
     convert_time = time.localtime(modTime)
     format_time = time.strftime('%d%m%Y %H:%M:%S', convert_time)
     mod = datetime.datetime.strptime(format_time, '%d%m%Y %H:%M:%S')
@@ -117,11 +216,87 @@ def WeatherIsRecent():
     # Get difference in seconds
     diff = (now - mod).total_seconds()
 
-    if diff > RECENT_CHECK_SECONDS:
+    # Fresh enough whatever the quota or daemon say: skip reading their state
+    if diff <= RECENT_CHECK_SECONDS:
+        return True
+
+    # Refresh less often while the service's daily quota runs low
+    limit = RECENT_CHECK_SECONDS * Stretch(provider.PROVIDER)
+    # The refresh daemon keeps the file up to date; don't compete with it
+    # unless it has fallen far behind.
+    if DaemonIsRunning():
+        limit = DAEMON_MAX_AGE
+
+    if diff > limit:
         return False
     else:
         return True
 
+###############################################################################
+# Stale-while-revalidate: with a latency budget, old saved data is shown
+# right away while a detached process refreshes it for the next invocation.
+
+def SavedDataAge():
+    """Return the age of the saved JSON file in seconds, or None if there's none"""
+
+    if not os.path.exists(provider.OUT_DATA_FILE):
+        return None
+    return time.time() - os.path.getmtime(provider.OUT_DATA_FILE)
+
+def StartBackgroundRefresh():
+    """Refresh the saved data in a detached process"""
+
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "-r", "-p", provider.PROVIDER],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True)
+
+def failedRefreshFile():
+    """Return the file recording when a background refresh last failed"""
+    return os.path.splitext(provider.OUT_DATA_FILE)[0] + ".failed"
+
+def RecordFailedRefresh():
+    """Record that a background refresh failed (the saved data is unchanged)"""
+    try:
+        WriteCacheFile(failedRefreshFile(), str(int(time.time())) + "\n", sync=False)
+    except OSError:
+        pass
+
+def RefreshFailedRecently():
+    """Return True if a background refresh failed within REFRESH_RETRY_SECONDS"""
+    try:
+        return time.time() - os.path.getmtime(failedRefreshFile()) < REFRESH_RETRY_SECONDS
+    except OSError:
+        return False
+
+def RevalidateWithinBudget():
+    """Start a background refresh and wait for it up to the latency budget.
+    Returns True if the saved data was refreshed in time."""
+
+    # The last one failed: don't start one on every prompt until it's time
+    if RefreshFailedRecently():
+        return False
+
+    modTime = os.path.getmtime(provider.OUT_DATA_FILE)
+    StartBackgroundRefresh()
+
+    deadline = time.monotonic() + LATENCY_BUDGET_MS / 1000.0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(remaining, 0.005))
+        try:
+            if os.path.getmtime(provider.OUT_DATA_FILE) != modTime:
+                return True
+        except OSError:
+            pass
+
+def staleMark(obs, marker, degradedMarker):
+    """Return the marker if showing stale (or degraded) data, or nothing"""
+    if obs.degraded:
+        return degradedMarker
+    return marker if obs.stale else ""
+
 ###############################################################################
 
 def addLine(line):
@@ -136,34 +311,34 @@ def addLine(line):
 ###############################################################################
 # Parse the weather data and format it to a string in a nice readable format.
 
-def FormatFull():
+def FormatFull(obs):
     """Print weather info in a nicely-readable format."""
 
     addLine(f"{Style.BRIGHT}{Fore.CYAN}----------------------------------------{Style.RESET_ALL}")
 
-    addLine(Fore.MAGENTA + LOCN + " | " + weatherData.lastupdate + Style.RESET_ALL)
-    addLine(Style.BRIGHT + Fore.RED + "Temperature: " + Style.RESET_ALL + str(weatherData.temp) + u"\u00b0" + 'F')
-    addLine(Fore.BLUE + "Humidity: " + Style.RESET_ALL + str(weatherData.humidity) + "%")
-    addLine(Style.BRIGHT + Fore.CYAN + "Pressure: " + Style.RESET_ALL + str(weatherData.hpa) + " hPa")
-    addLine("          {p:.3f} inHg".format(p=weatherData.inHg))
-    addLine("          {p:.3f} mmHg".format(p=weatherData.mmHg))
-    addLine(Style.BRIGHT + "Weather: " + Style.RESET_ALL + weatherData.weather + " " + weatherData.icon)
-    addLine(Style.BRIGHT + "Clouds : " + Style.RESET_ALL + str(weatherData.clouds) + "%")
+    addLine(Fore.MAGENTA + obs.city + " | " + obs.lastupdate + staleMark(obs, STALE_TEXT, DEGRADED_TEXT) + Style.RESET_ALL)
+    addLine(Style.BRIGHT + Fore.RED + "Temperature: " + Style.RESET_ALL + str(obs.temp) + u"\u00b0" + 'F')
+    addLine(Fore.BLUE + "Humidity: " + Style.RESET_ALL + str(obs.humidity) + "%")
+    addLine(Style.BRIGHT + Fore.CYAN + "Pressure: " + Style.RESET_ALL + str(obs.hpa) + " hPa")
+    addLine("          {p:.3f} inHg".format(p=obs.inHg))
+    addLine("          {p:.3f} mmHg".format(p=obs.mmHg))
+    addLine(Style.BRIGHT + "Weather: " + Style.RESET_ALL + obs.weather + " " + obs.icon)
+    addLine(Style.BRIGHT + "Clouds : " + Style.RESET_ALL + str(obs.clouds) + "%")
     addLine(Style.BRIGHT + Fore.GREEN + "Wind: " + Style.RESET_ALL \
-            + str(weatherData.speed) + " mph " \
-            + weatherData.direction)
-    if weatherData.precip != None:
-        addLine(Fore.BLUE + "Precipitation: " + Style.RESET_ALL + str(weatherData.precip) + " in")
+            + str(obs.speed) + " mph " \
+            + obs.direction)
+    if obs.precip != None:
+        addLine(Fore.BLUE + "Precipitation: " + Style.RESET_ALL + str(obs.precip) + " in")
 
     # Output astronomical data
-    addLine(Style.BRIGHT + Fore.YELLOW + "Sun rise: " + Style.RESET_ALL + weatherData.sunrise)
-    addLine(Style.BRIGHT + Fore.YELLOW + "Sun set : " + Style.RESET_ALL + weatherData.sunset)
-    if weatherData.moonrise != None:
-        addLine(Style.DIM + Fore.WHITE + "Moon rise: " + Style.RESET_ALL + weatherData.moonrise)
-    if weatherData.moonset != None:
-        addLine(Style.DIM + Fore.WHITE + "Moon set : " + Style.RESET_ALL + weatherData.moonset)
-    if weatherData.phase != None:
-        addLine(Fore.WHITE + "Phase : " + weatherData.phase + Style.RESET_ALL)
+    addLine(Style.BRIGHT + Fore.YELLOW + "Sun rise: " + Style.RESET_ALL + obs.sunrise)
+    addLine(Style.BRIGHT + Fore.YELLOW + "Sun set : " + Style.RESET_ALL + obs.sunset)
+    if obs.moonrise != None:
+        addLine(Style.DIM + Fore.WHITE + "Moon rise: " + Style.RESET_ALL + obs.moonrise)
+    if obs.moonset != None:
+        addLine(Style.DIM + Fore.WHITE + "Moon set : " + Style.RESET_ALL + obs.moonset)
+    if obs.phase != None:
+        addLine(Fore.WHITE + "Phase : " + obs.phase + Style.RESET_ALL)
 
     addLine(f"{Style.BRIGHT}{Fore.CYAN}----------------------------------------{Style.RESET_ALL}")
 
@@ -178,14 +353,14 @@ def FormatFull():
 #| X mph DDD   |
 #|clear sky    |
 #|+++++++++++++|
-def FormatShort():
+def FormatShort(obs):
     """Print weather info in a short format."""
 
-    addLine("Temp: " + str(weatherData.temp) + "°F")
-    addLine("  rH: " + str(weatherData.humidity) + "%")
-    addLine(" {p:.2f} inHg".format(p=weatherData.inHg))
-    addLine(" " + str(weatherData.speed) + " mph " + weatherData.direction)
-    addLine(weatherData.weather)
+    addLine("Temp: " + str(obs.temp) + "°F" + staleMark(obs, STALE_MARKER, DEGRADED_MARKER))
+    addLine("  rH: " + str(obs.humidity) + "%")
+    addLine(" {p:.2f} inHg".format(p=obs.inHg))
+    addLine(" " + str(obs.speed) + " mph " + obs.direction)
+    addLine(obs.weather)
 
 ###############################################################################
 # Parse the weather data and format it to a string in a tiny format.
@@ -194,43 +369,312 @@ def FormatShort():
 #|T:50.6°F  rH:52%|
 #|P:29.8 inHg     |
 #|++++++++++++++++|
-def FormatTiny():
+def FormatTiny(obs):
     """Print weather info in a tiny format."""
 
-    addLine("T:" + str(weatherData.temp) + "°F rH:" + str(weatherData.humidity) + "%")
-    addLine("P:{p:.2f}inHg".format(p=weatherData.inHg))
+    addLine("T:" + str(obs.temp) + "°F" + staleMark(obs, STALE_MARKER, DEGRADED_MARKER) + " rH:" + str(obs.humidity) + "%")
+    addLine("P:{p:.2f}inHg".format(p=obs.inHg))
 
 ###############################################################################
 # Parse the weather data and format it to a string in a single-line format.
 
-def FormatOneLine():
+def FormatOneLine(obs):
     """Print weather info in a single-line format."""
 
     addLine(Style.BRIGHT + Back.BLUE
-            + Fore.CYAN + weatherData.city + ": "
-            + Fore.YELLOW + str(weatherData.temp) + u"\u00b0" + "F "
-            + weatherData.icon + " "
-            + Fore.CYAN + "Wind: "      + Fore.YELLOW + str(weatherData.speed) + " mph " + weatherData.direction + " "
-            + Fore.CYAN + "Humidity: "  + Fore.YELLOW + str(weatherData.humidity) + "% "
-            + Fore.CYAN + "Pressure: "  + Fore.YELLOW + "{p:.2f} inHg".format(p=weatherData.inHg) + " / "
-            + "{p:.3f} mmHg".format(p=weatherData.mmHg)
+            + Fore.CYAN + obs.city + ": "
+            + Fore.YELLOW + str(obs.temp) + u"\u00b0" + "F" + staleMark(obs, STALE_MARKER, DEGRADED_MARKER) + " "
+            + obs.icon + " "
+            + Fore.CYAN + "Wind: "      + Fore.YELLOW + str(obs.speed) + " mph " + obs.direction + " "
+            + Fore.CYAN + "Humidity: "  + Fore.YELLOW + str(obs.humidity) + "% "
+            + Fore.CYAN + "Pressure: "  + Fore.YELLOW + "{p:.2f} inHg".format(p=obs.inHg) + " / "
+            + "{p:.3f} mmHg".format(p=obs.mmHg)
             + Style.RESET_ALL)
 
+###############################################################################
+# Format the extracted weather data using the selected output format.
+
+def FormatOutput(obs):
+    """Format weather info using the selected output format."""
+
+    if OUTPUT_DATA == 0:
+        FormatFull(obs)
+    elif OUTPUT_DATA == 1:
+        FormatTiny(obs)
+    elif OUTPUT_DATA == 2:
+        FormatShort(obs)
+    elif OUTPUT_DATA == 3:
+        FormatOneLine(obs)
+    else:
+        print("Unhandled format: %d" % OUTPUT_DATA)
+
+###############################################################################
+# Format a forecast. Each formatter converts whole columns at once, then
+# joins them into lines.
+
+def FormatForecastFull(fc):
+    """Print the forecast in a nicely-readable format."""
+
+    hourly = fc.hourly
+    daily = fc.daily
+
+    addLine(f"{Style.BRIGHT}{Fore.CYAN}----------------------------------------{Style.RESET_ALL}")
+    addLine(Fore.MAGENTA + fc.city + " | " + str(fc.hours()) + " hour forecast" + Style.RESET_ALL)
+
+    dt = every(hourly["dt"], FORECAST_HOUR_STEP)
+    rows = zip(seconds_to_weekday_batch(dt), seconds_to_time_batch(dt),
+               every(hourly["temp"], FORECAST_HOUR_STEP), every(hourly["pop"], FORECAST_HOUR_STEP),
+               every(hourly["speed"], FORECAST_HOUR_STEP), compass(every(hourly["dir"], FORECAST_HOUR_STEP)),
+               every(hourly["icon"], FORECAST_HOUR_STEP))
+    for day, hour, temp, pop, speed, direction, icon in rows:
+        addLine("{d} {h} {t:5.1f}\u00b0F {p:3.0f}% {s:4.1f} mph {w:<3} {i}".format(
+            d=day, h=hour, t=temp, p=pop, s=speed, w=direction, i=icon))
+
+    addLine(Style.BRIGHT + Fore.YELLOW + str(fc.days()) + " day forecast" + Style.RESET_ALL)
+    rows = zip(seconds_to_weekday_batch(daily["dt"]), daily["tempMin"], daily["tempMax"],
+               daily["pop"], daily["precip"], daily["icon"], daily["weather"])
+    for day, low, high, pop, precip, icon, weather in rows:
+        addLine("{d} {l:3.0f}/{h:3.0f}\u00b0F {p:3.0f}% {r:4.2f} in {i} {w}".format(
+            d=day, l=low, h=high, p=pop, r=precip, i=icon, w=weather))
+
+    stats = ForecastStats(fc)
+    if stats is not None:
+        # Items missing from every hour are left out
+        if stats["tempMin"] is not None:
+            addLine(Style.BRIGHT + Fore.RED + "Range: " + Style.RESET_ALL
+                    + "{l:.1f} - {h:.1f}\u00b0F, mean {m:.1f}\u00b0F".format(
+                        l=stats["tempMin"], h=stats["tempMax"], m=stats["tempMean"]))
+        precip = "{r:.2f} in".format(r=stats["precipTotal"])
+        if stats["popMax"] is not None:
+            precip += ", up to {p:.0f}% {d} {h}".format(
+                p=stats["popMax"], d=seconds_to_weekday_batch([stats["popMaxTime"]])[0],
+                h=seconds_to_time_batch([stats["popMaxTime"]])[0])
+        addLine(Fore.BLUE + "Precipitation: " + Style.RESET_ALL + precip)
+        if stats["speedMax"] is not None:
+            addLine(Style.BRIGHT + Fore.GREEN + "Wind: " + Style.RESET_ALL
+                    + "up to {s:.1f} mph {d}".format(s=stats["speedMax"], d=stats["speedMaxDir"]))
+        addLine(Style.BRIGHT + Fore.CYAN + "Pressure: " + Style.RESET_ALL
+                + "{p:+.2f} inHg".format(p=stats["pressureTrend"]))
+
+    addLine(f"{Style.BRIGHT}{Fore.CYAN}----------------------------------------{Style.RESET_ALL}")
+
+#|++++++++++++++++++|
+#|Mon  41/ 63°F  40%|
+#|Tue  38/ 55°F  10%|
+#|...               |
+#|++++++++++++++++++|
+def FormatForecastShort(fc):
+    """Print the daily forecast in a short format."""
+
+    daily = fc.daily
+    rows = zip(seconds_to_weekday_batch(daily["dt"]), daily["tempMin"], daily["tempMax"], daily["pop"])
+    for day, low, high, pop in rows:
+        addLine("{d} {l:3.0f}/{h:3.0f}°F {p:3.0f}%".format(d=day, l=low, h=high, p=pop))
+
+#|++++++++++++++++|
+#|48h:41/63°F     |
+#|P:80% Tue 03 PM |
+#|++++++++++++++++|
+def FormatForecastTiny(fc):
+    """Print the forecast in a tiny format."""
+
+    stats = ForecastStats(fc)
+    if stats is None:
+        return
+    if stats["tempMin"] is not None:
+        addLine("{n}h:{l:.0f}/{h:.0f}°F".format(n=fc.hours(), l=stats["tempMin"], h=stats["tempMax"]))
+    if stats["popMax"] is not None:
+        addLine("P:{p:.0f}% {d} {h}".format(p=stats["popMax"],
+                                            d=seconds_to_weekday_batch([stats["popMaxTime"]])[0],
+                                            h=seconds_to_time_batch([stats["popMaxTime"]])[0]))
+
+def FormatForecastOneLine(fc):
+    """Print the forecast in a single-line format."""
+
+    stats = ForecastStats(fc)
+    if stats is None:
+        return
+    daily = fc.daily
+    days = " ".join("{d}{i}{h:.0f}".format(d=day, i=icon, h=high)
+                    for day, icon, high in zip(seconds_to_weekday_batch(daily["dt"]), daily["icon"], daily["tempMax"]))
+    # Items missing from every hour are left out
+    line = Style.BRIGHT + Back.BLUE + Fore.CYAN + fc.city + ": "
+    if stats["tempMin"] is not None:
+        line += Fore.YELLOW + "{l:.0f}-{h:.0f}".format(l=stats["tempMin"], h=stats["tempMax"]) + u"\u00b0" + "F "
+    if stats["popMax"] is not None:
+        line += Fore.CYAN + "Rain: " + Fore.YELLOW + "{p:.0f}% ".format(p=stats["popMax"])
+    if stats["speedMax"] is not None:
+        line += Fore.CYAN + "Wind: " + Fore.YELLOW + "{s:.0f} mph {d} ".format(s=stats["speedMax"], d=stats["speedMaxDir"])
+    addLine(line + Fore.CYAN + "| " + Fore.YELLOW + days + Style.RESET_ALL)
+
+def FormatForecast(fc):
+    """Format the forecast using the selected output format."""
+
+    if OUTPUT_DATA == 0:
+        FormatForecastFull(fc)
+    elif OUTPUT_DATA == 1:
+        FormatForecastTiny(fc)
+    elif OUTPUT_DATA == 2:
+        FormatForecastShort(fc)
+    elif OUTPUT_DATA == 3:
+        FormatForecastOneLine(fc)
+    else:
+        print("Unhandled format: %d" % OUTPUT_DATA)
+
+###############################################################################
+# Get and format the forecast for the current location, or for every
+# location in LOCATIONS (-m).
+
+def FormatForecasts():
+    """Format the forecast for the selected locations."""
+
+    locations = LOCATIONS
+    if not MULTI_LOCATION:
+        locations = [{"name": LOCN, "lat": LAT, "lon": LON, "zip": ZIP, "alt": ALT}]
+
+    results = FetchAllLocations(provider.FetchForecast, provider.ParseForecast, locations, DEBUG, USE_SAVED,
+                                batch=getattr(provider, "FetchForecasts", None))
+    for result in results:
+        if result["error"] is not None:
+            addLine(Fore.RED + result["location"]["name"] + ": " + result["error"] + Style.RESET_ALL)
+            continue
+        FormatForecast(result["data"])
+
+###############################################################################
+# Get and format weather data for every location in LOCATIONS.
+
+def FormatAllLocations():
+    """Format weather info for all locations."""
+
+    results = FetchAllLocations(provider.FetchLocationWeather, provider.ExtractLocationWeather,
+                                LOCATIONS, DEBUG, USE_SAVED, batch=getattr(provider, "FetchLocationsWeather", None))
+    for result in results:
+        if result["error"] is not None:
+            addLine(Fore.RED + result["location"]["name"] + ": " + result["error"] + Style.RESET_ALL)
+            continue
+        # Degraded data is saved data: it's in the history already
+        if weatherHistory.HISTORY_ENABLED and not result["data"].degraded:
+            weatherHistory.AppendObservation(result["data"], result["location"]["lat"], result["location"]["lon"])
+        FormatOutput(result["data"])
+
+###############################################################################
+# Requests a service makes for a sweep of every location (-m), so that its
+# quota's bucket can hold them.
+
+def SweepCalls(module):
+    """Return the number of requests a multi-location sweep makes"""
+    return len(LOCATIONS) * getattr(module, "CALLS_PER_LOCATION", weatherProviders.CALLS_PER_LOCATION)
+
+###############################################################################
+# Get the current location's observation saved with its saved data, if
+# the saved data hasn't changed since (see weatherCache.SaveObservation).
+#   fresh : False if the saved data is shown as stale or degraded
+
+def LoadSavedObservation(fresh):
+    """Load the saved observation, without parsing or extracting the saved data."""
+
+    values = LoadObservation(provider.OUT_DATA_KEY, weatherData.FIELDS, fresh)
+    if values is None:
+        return None
+    obs = weatherData.WeatherObservation.fromTuple(values)
+    # Keep the module-level weatherData items up to date
+    weatherData.publish(obs)
+    return obs
+
+###############################################################################
+# Save every output format, rendered, for the fast path (weatherPrompt.py).
+# They expire when the saved data is no longer recent.
+#   savedAt : when the observation's data was saved (default: the service's
+#             saved data file's modification time)
+
+def SaveRenderedOutput(obs, savedAt=None):
+    """Save the rendered output of every format."""
+
+    global weatherInfo
+    global max_width
+
+    if savedAt is None:
+        savedAt = os.path.getmtime(provider.OUT_DATA_FILE)
+    expires = savedAt + RECENT_CHECK_SECONDS
+    version = renderVersion(obs)
+    formats = [("full", FormatFull), ("tiny", FormatTiny), ("short", FormatShort), ("oneline", FormatOneLine)]
+
+    saved = (weatherInfo, max_width)
+    os.makedirs(RENDER_DIR, exist_ok=True)
+    for fmt, formatter in formats:
+        weatherInfo = []
+        formatter(obs)
+        text = "\n".join(weatherInfo) + "\n"
+        for caps in RENDER_CAPS:
+            if caps == "plain":
+                text = re.sub(r"\033\[[0-9;]*m", "", text)
+            WriteCacheFile(RenderFile(provider.PROVIDER, fmt, caps), RenderHeader(version, expires) + text)
+    weatherInfo, max_width = saved
+
+def renderVersion(obs):
+    """Return the data version of an observation's rendered output"""
+    return provider.PROVIDER + ":" + str(obs.dt or obs.lastupdate)
+
+###############################################################################
+# Keep the rendered output after a refresh found the data unchanged: only
+# the renew file is written (see weatherPrompt.ReadRendered), unless the
+# rendered output is missing or of other data.
+
+def RenewRenderedOutput(obs):
+    """Extend the rendered output of an unchanged observation."""
+
+    version = renderVersion(obs)
+    if RenderedVersion(RenderFile(provider.PROVIDER, "oneline", "ansi")) != version.replace(" ", "_"):
+        SaveRenderedOutput(obs)
+    else:
+        expires = os.path.getmtime(provider.OUT_DATA_FILE) + RECENT_CHECK_SECONDS
+        WriteCacheFile(RenewFile(provider.PROVIDER), RenderHeader(version, expires))
+    # The daemon runs for a long time: hand over its events now
+    weatherMetrics.Flush()
+
+###############################################################################
+# Save what's needed after the current location's data was refreshed.
+
+def OnRefresh(obs, savedAt=None):
+    """Save the rendered output and history for a new observation."""
+
+    SaveRenderedOutput(obs, savedAt)
+    if savedAt is None:
+        # The saved data was refreshed: save the observation extracted from it
+        SaveObservation(provider.OUT_DATA_KEY, weatherData.FIELDS, obs.toTuple())
+    if weatherHistory.HISTORY_ENABLED:
+        weatherHistory.AppendObservation(obs, LAT, LON)
+    weatherMetrics.SetObservation(provider.PROVIDER, LOCN, obs)
+    # The daemon runs for a long time: hand over its events now
+    weatherMetrics.Flush()
+
 ###############################################################################
 
 def usage():
     print("-" * 40)
-    print("Usage: {:s} [-h|--help] [-d] [-f | -o] [-s | -t | -1]".format(os.path.basename(sys.argv[0])))
+    print("Usage: {:s} [-h|--help] [-d] [-p NAME] [-a NAME] [-f | -o | -b MS | -r] [-m] [-F] [-s | -t | -1] [-D] [-E PORT] [-H] [-T | --timings=FMT]".format(os.path.basename(sys.argv[0])))
     print("\nPrint current weather conditions\n")
     print("optional arguments:")
     print("  -h, --help Show this help message and exit")
     print("  -d         DEBUG: Show received JSON data")
     print("  -i         DEBUG: Show weather icons")
+    print("  -p NAME    Weather service to use: owm (default), wapi, meteo")
+    print("  -a NAME    Hedge: also ask service NAME if -p's is slower than usual")
     print("  -o         Use 'old' data if it's less than 15 minutes old (default)")
     print("  -f         Force refresh of data from server")
+    print("  -b MS      Latency budget: if saved data is old, show it (marked stale)")
+    print("             unless a background refresh finishes within MS milliseconds")
+    print("  -r         Refresh saved data if it's old, without output")
+    print("  -m         Multi-location: show weather for every entry in LOCATIONS")
+    print("  -F         Forecast: 48 hours hourly and 8 days daily")
     print("  -s         Short output")
     print("  -t         Tiny output")
     print("  -1         One-liner ANSI colored")
+    print("  -D         Run the background refresh daemon")
+    print("  -E PORT    Run the refresh daemon, serving OpenMetrics on PORT (weatherMetrics)")
+    print("  -H         Record refreshed observations in the history (weatherHistory)")
+    print("  -T         Print how long each phase took (to stderr)")
+    print("  --timings=FMT  Same as -T, as text or json (one JSON object per line)")
     print("-" * 40)
     print()
 
@@ -239,7 +683,7 @@ def usage():
 # main entry point
 if __name__ == '__main__':
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hdfiost1", ["help"])
+        opts, args = getopt.getopt(sys.argv[1:], "hdfimost1Db:rp:a:HFTE:", ["help", "timings="])
     except getopt.GetoptError as err:
         # print(help information and exit:
         print(str(err)) # will print(something like "option -a not recognized"
@@ -256,49 +700,212 @@ if __name__ == '__main__':
             USE_SAVED = True
         elif o == "-f":
             USE_SAVED = False
+        elif o == "-b":
+            try:
+                LATENCY_BUDGET_MS = float(a)
+            except ValueError:
+                print("Invalid latency budget: " + a)
+                usage()
+                sys.exit(2)
+        elif o == "-r":
+            REFRESH_ONLY = True
+        elif o == "-m":
+            MULTI_LOCATION = True
+        elif o == "-F":
+            FORECAST = True
         elif o == "-d":
             DEBUG = True
             OUTPUT_DATA = 0 # Full format
         elif o == "-i":
             SHOW_ICONS = True
+        elif o == "-p":
+            PROVIDER_NAME = a
+        elif o == "-a":
+            HEDGE_PROVIDER_NAME = a
         elif o == "-t":
             OUTPUT_DATA = 1 # Tiny
         elif o == "-s":
             OUTPUT_DATA = 2 # Short
         elif o == "-1":
             OUTPUT_DATA = 3 # One-line
+        elif o == "-D":
+            RUN_DAEMON = True
+        elif o == "-E":
+            RUN_DAEMON = True
+            try:
+                METRICS_PORT = int(a)
+            except ValueError:
+                print("Invalid metrics port: " + a)
+                usage()
+                sys.exit(2)
+        elif o == "-H":
+            weatherHistory.HISTORY_ENABLED = True
+        elif o == "-T":
+            TIMINGS = "text"
+        elif o == "--timings":
+            if a not in ("text", "json"):
+                print("Unknown timings format: " + a)
+                usage()
+                sys.exit(2)
+            TIMINGS = a
         else:
             print("Unhandled option: %s" % o)
 
     # -------------------------------------------------------------------------
 
-    if SHOW_ICONS: # @DEBUG
-        displayIcons()
-        displayConditions()
-
-    # Check if data is recent enough to re-use
-    isRecent = WeatherIsRecent()
+    # Hand over cache and fetch events to a running metrics exporter
+    atexit.register(weatherMetrics.Flush)
 
-    # Get weather data from server
-    GetWeatherInfo((isRecent and USE_SAVED), DEBUG)
-    ExtractWeatherData()
+    if TIMINGS:
+        # Reported on exit, however the run ends
+        weatherTimings.Enable()
+        weatherTimings.Record("imports", weatherTimings.START, IMPORTS_DONE)
+        atexit.register(weatherTimings.Report, TIMINGS)
 
-    # -------------------------------------------------------------------------
+    # Load the selected weather service
+    try:
+        with Phase("provider"):
+            provider = LoadProvider(PROVIDER_NAME)
+            if HEDGE_PROVIDER_NAME:
+                alternate = LoadProvider(HEDGE_PROVIDER_NAME)
+    except ValueError as err:
+        print(str(err))
+        sys.exit(2)
+    SetDailyLimit(provider.PROVIDER, provider.DAILY_CALL_LIMIT, SweepCalls(provider))
+    if alternate is not None:
+        SetDailyLimit(alternate.PROVIDER, alternate.DAILY_CALL_LIMIT, SweepCalls(alternate))
+        # The response times set the hedge delay: saved once, on exit
+        EnableRecording()
+        atexit.register(SaveLatencies)
 
-    # Decide on output format
-    if OUTPUT_DATA == 0:
-        FormatFull()
-    elif OUTPUT_DATA == 1:
-        FormatTiny()
-    elif OUTPUT_DATA == 2:
-        FormatShort()
-    elif OUTPUT_DATA == 3:
-        FormatOneLine()
+    if SHOW_ICONS: # @DEBUG
+        displayIcons()
+        provider.displayConditions()
+
+    if RUN_DAEMON:
+        if METRICS_PORT is not None:
+            exporter = weatherMetrics.StartExporter(METRICS_PORT)
+            atexit.register(weatherMetrics.stopExporter, exporter)
+            weatherMetrics.SetCallLimit(provider.PROVIDER, provider.DAILY_CALL_LIMIT)
+        # Keep the saved data fresh until stopped
+        RunDaemon(provider.GetWeatherInfo, provider.ExtractWeatherData, provider.DAILY_CALL_LIMIT, DEBUG,
+                  OnRefresh, provider.PROVIDER, RenewRenderedOutput)
+        sys.exit()
+
+    if FORECAST:
+        # Hourly and daily forecast, for every location with -m
+        with Phase("forecast"):
+            FormatForecasts()
+    elif MULTI_LOCATION:
+        # Every location is fetched concurrently, unless its saved data is recent
+        with Phase("locations"):
+            FormatAllLocations()
     else:
-        print("Unhandled format: %d" % OUTPUT_DATA)
+        with Phase("recent"):
+            # Check if data is recent enough to re-use
+            isRecent = WeatherIsRecent()
+
+            # Don't wait on a service that keeps failing: use the saved data
+            # (when hedging, HedgedFetch() asks the alternate instead)
+            degraded = False
+            if not isRecent and not REFRESH_ONLY and weatherBreaker.IsOpen(provider.PROVIDER) \
+                    and (alternate is None or weatherBreaker.IsOpen(alternate.PROVIDER)) \
+                    and SavedDataAge() is not None:
+                degraded = True
+                isRecent = True
+                USE_SAVED = True
+
+            # Within a latency budget, old (but not too old) data is good enough
+            stale = False
+            if not isRecent and USE_SAVED and LATENCY_BUDGET_MS is not None and not REFRESH_ONLY:
+                age = SavedDataAge()
+                if age is not None and age <= MAX_STALE_SECONDS:
+                    stale = not RevalidateWithinBudget()
+                    isRecent = True
+
+        # Get weather data from server
+        refreshed = not (isRecent and USE_SAVED)
+        answered = provider
+        observation = None
+        loaded = False
+        revalidated = False
+        dataVersion = None
+        with Phase("fetch"):
+            try:
+                if refreshed and alternate is not None and not REFRESH_ONLY:
+                    # The first service to answer is used
+                    location = {"name": LOCN, "lat": LAT, "lon": LON, "zip": ZIP, "alt": ALT}
+                    answered, observation = HedgedFetch(provider, alternate, location, DEBUG, USE_SAVED)
+                    weatherData.publish(observation)
+                elif refreshed or DEBUG:
+                    if provider.GetWeatherInfo(not refreshed, DEBUG):
+                        # Same data as saved: use the observation already extracted from it
+                        observation = LoadSavedObservation(True)
+                        revalidated = observation is not None
+                else:
+                    # Saved data: use the observation already extracted from it
+                    observation = LoadSavedObservation(not stale and not degraded)
+                    loaded = observation is not None
+                    if not loaded:
+                        dataVersion = EntryVersion(provider.OUT_DATA_KEY)
+                        provider.GetWeatherInfo(True, DEBUG)
+            except Exception as err:
+                # Show the saved data instead, if there is any
+                if REFRESH_ONLY or SavedDataAge() is None:
+                    if REFRESH_ONLY:
+                        RecordFailedRefresh()
+                    print("Weather service failed: " + str(err))
+                    sys.exit(1)
+                if DEBUG: # @DEBUG
+                    print("Weather service failed, using saved data: " + str(err))
+                answered = provider
+                observation = LoadSavedObservation(False)
+                loaded = observation is not None
+                if not loaded:
+                    dataVersion = EntryVersion(provider.OUT_DATA_KEY)
+                    provider.GetWeatherInfo(True, DEBUG)
+                refreshed = False
+                degraded = True
+        if REFRESH_ONLY and not refreshed:
+            sys.exit()
+        if observation is None:
+            with Phase("extract"):
+                observation = provider.ExtractWeatherData()
+        observation.stale = stale
+        observation.degraded = degraded
+
+        # Save the rendered output for the fast path, and the history
+        with Phase("save"):
+            if answered is not provider:
+                # This service's saved data wasn't refreshed: keep the
+                # rendered output for as long as the data shown is recent
+                OnRefresh(observation, time.time())
+            elif revalidated:
+                RenewRenderedOutput(observation)
+            elif refreshed:
+                OnRefresh(observation)
+            else:
+                if not loaded:
+                    SaveObservation(provider.OUT_DATA_KEY, weatherData.FIELDS, observation.toTuple(), dataVersion)
+                if not stale and not degraded and not os.path.exists(RenderFile(provider.PROVIDER, "oneline", "ansi")):
+                    SaveRenderedOutput(observation)
+        if REFRESH_ONLY:
+            sys.exit()
+
+        # ---------------------------------------------------------------------
+
+        # Decide on output format
+        with Phase("format"):
+            FormatOutput(observation)
 
     # Output text
-    for l in weatherInfo:
-        print(l)
+    with Phase("output"):
+        for l in weatherInfo:
+            print(l)
+
+    if DEBUG: # @DEBUG
+        from weatherHTTP import printStats
+        print(80 * "-")
+        printStats()
 
 ###############################################################################
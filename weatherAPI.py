@@ -25,12 +25,15 @@
 # Use WeatherAPI to get weather for current location
 ###############################################################################
 
-import os
-import json
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 import weatherData
 
+from weatherCache import CacheKey, CachePath, CacheGet, RefreshEntry, RevalidateEntry, SavedDataUsed, CacheIsFresh, DEFAULT_TTL, DAILY
+# weatherHTTP (with requests, slow to import) is only imported to make a request
+from weatherAstro import GetAstroStrings
+from weatherForecast import Forecast, MapCodes, HOURS, DAYS, FORECAST_TTL
+
 from weatherLocation import *
 from weatherIcons import *
 from weatherConversions import *
@@ -40,13 +43,38 @@ from weatherConversions import *
 # @TODO WeatherAPI API Token
 API_KEY=None
 
+# Server address; the benchmarks (bench/) point this at a local stub server
+BASE_URL="https://api.weatherapi.com/v1/"
+
 # Query code, either ZIP
 #QUERY="&q=" + ZIP
 # or GPS coords
 QUERY="&q=" + LAT + "," + LON
 
-OUT_DATA_FILE="/tmp/wapi_weather.json"
-OUT_ASTRO_FILE="/tmp/wapi_astro.json"
+# Name of this service, used in cache keys
+PROVIDER="wapi"
+
+# Saved data for the current location. Responses hold both imperial and
+# metric values, so they don't depend on units.
+OUT_DATA_KEY=CacheKey(PROVIDER, LAT, LON, None, "current")
+OUT_DATA_FILE=CachePath(OUT_DATA_KEY)
+OUT_ASTRO_KEY=CacheKey(PROVIDER, LAT, LON, None, "astronomy")
+OUT_ASTRO_FILE=CachePath(OUT_ASTRO_KEY)
+
+# How long each kind of saved data stays fresh. Sunrise, sunset, moonrise,
+# moonset and moon phase only change once per day.
+FRESHNESS = {"current": DEFAULT_TTL, "astronomy": DAILY, "forecast": FORECAST_TTL}
+
+# Compute astronomy data locally (weatherAstro) instead of requesting
+# astronomy.json from the server
+LOCAL_ASTRONOMY = True
+
+# Requests made for each location in multi-location mode
+CALLS_PER_LOCATION = 1 if LOCAL_ASTRONOMY else 2
+
+# API calls allowed per day (free plan is about 1 million calls per month),
+# used by the refresh daemon
+DAILY_CALL_LIMIT=30000
 
 # JSON objects to hold server responses
 jsonWeather = None
@@ -123,13 +151,42 @@ def displayConditions():
         else:
             print("Day:(" + info["day"] + ") Night:(" + info["night"] + ")")
 
-def get_icon_from_code(code):
+def get_icon_from_code(code, isDay=None):
+    if isDay is None:
+        isDay = weatherData.isDay
     condition = conditions[code]
     group = condition["group"]
-    return get_icon(group, weatherData.isDay)
+    return get_icon(group, isDay)
+
+###############################################################################
+# Build the request lines for the given query code.
+
+def BuildWeatherRequest(query):
+    """Build the current conditions request line"""
+    # https://api.weatherapi.com/v1/current.json?key=[API_KEY]&q=[ZIP]&aqi=yes
+    return BASE_URL + "current.json?" \
+        + "key=" + API_KEY \
+        + query + "&aqi=yes"
+
+def BuildAstroRequest(query):
+    """Build the astronomy request line"""
+    # https://api.weatherapi.com/v1/astronomy.json?key=[API_KEY]&q=[ZIP]
+    return BASE_URL + "astronomy.json?" \
+        + "key=" + API_KEY \
+        + query
+
+def BuildForecastRequest(query):
+    """Build the forecast request line"""
+    # https://api.weatherapi.com/v1/forecast.json?key=[API_KEY]&q=[ZIP]&days=8
+    # (The free plan only returns 3 days.)
+    return BASE_URL + "forecast.json?" \
+        + "key=" + API_KEY \
+        + query + "&days=" + str(DAYS) + "&aqi=no&alerts=no"
 
 ###############################################################################
 # Get the current location's current weather data from the server.
+# Returns True if the server's data was the saved data (which is then only
+# read when needed, see savedWeather()).
 
 def GetWeatherInfo(isRecent, DEBUG):
     """Get weather info from server"""
@@ -142,41 +199,123 @@ def GetWeatherInfo(isRecent, DEBUG):
     # Check if data is recent enough to re-use
     if isRecent:
         # Use saved data
-        with open(OUT_DATA_FILE) as text_file:
-            jsonWeather = json.load(text_file)
+        jsonWeather = CacheGet(OUT_DATA_KEY, -1)
         if DEBUG: # @DEBUG
             print(80 * "-")
             print(jsonWeather)
-        GetAstroInfo(isRecent, DEBUG)
-        return
+        if not LOCAL_ASTRONOMY:
+            GetAstroInfo(isRecent, DEBUG)
+        return False
+
+    if LOCAL_ASTRONOMY:
+        # Only the current conditions are needed from the server
+        try:
+            return GetCurrentInfo(DEBUG)
+        except SavedDataUsed:
+            # The caller shows the saved data as degraded
+            raise
+        except Exception as err:
+            UseSavedWeatherInfo(err, DEBUG)
+        return False
+
+    # This server has another API call to get more data, which is only
+    # needed once a day. The two requests don't depend on each other, so
+    # issue them at the same time.
+    astroIsRecent = CacheIsFresh(OUT_ASTRO_KEY, FRESHNESS["astronomy"])
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        astroFuture = pool.submit(GetAstroInfo, astroIsRecent, DEBUG)
+
+        weatherError = None
+        unchanged = False
+        try:
+            unchanged = GetCurrentInfo(DEBUG)
+        except Exception as err:
+            weatherError = err
+
+        try:
+            astroFuture.result()
+        except Exception as err:
+            # Fall back to saved astronomy data, or show none
+            UseSavedAstroInfo(err, DEBUG)
+
+    if isinstance(weatherError, SavedDataUsed):
+        # The caller shows the saved data as degraded
+        raise weatherError
+    if weatherError is not None:
+        # Fall back to saved weather data, if there is any
+        UseSavedWeatherInfo(weatherError, DEBUG)
+    # New astronomy data changes the observation too
+    return unchanged and astroIsRecent
+
+###############################################################################
+# Time of the observation in a reply, to tell if it changed since the
+# saved one (see weatherCache.RefreshEntry).
+
+def currentStamp(payload):
+    return payload.get("current", {}).get("last_updated_epoch")
+
+###############################################################################
+# Get the current location's current conditions from the server.
+# Returns True if the server's data was the saved data.
+
+def GetCurrentInfo(DEBUG):
+    """Get current conditions from server"""
+
+    global jsonWeather
 
     # Build command line
-    # https://api.weatherapi.com/v1/current.json?key=[API_KEY]&q=[ZIP]&aqi=yes
-    REQ_LINE = "https://api.weatherapi.com/v1/current.json?" \
-        + "key=" + API_KEY \
-        + QUERY + "&aqi=yes"
+    REQ_LINE = BuildWeatherRequest(QUERY)
 
     if DEBUG: # @DEBUG
         print(80 * "-")
         print("> " + REQ_LINE)
 
-    response = requests.get(REQ_LINE)
-    jsonWeather = json.loads(response.text)
-
-    # Write JSON response to file to format it for reading
-    with open(OUT_DATA_FILE + ".raw", "w") as text_file:
-        text_file.write(response.text)
-    os.system("jq < " + OUT_DATA_FILE + ".raw > " + OUT_DATA_FILE)
-    # Remove the unformatted output file
-    os.system("rm -f " + OUT_DATA_FILE + ".raw")
+    # Save JSON response to file, formatted for reading. If another process
+    # is already refreshing it, use its data instead.
+    from weatherHTTP import HttpGetJSON
+    jsonWeather, unchanged = RevalidateEntry(OUT_DATA_KEY,
+                                             lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, "current"), validators=validators),
+                                             FRESHNESS["current"], currentStamp)
 
     if DEBUG: # @DEBUG
         print(80 * "-")
-        print(jsonWeather)
+        print(savedWeather())
+    return unchanged
+
+def savedWeather():
+    """Return the received data, reading the saved data if it wasn't read"""
+
+    global jsonWeather
+
+    if jsonWeather is None:
+        jsonWeather = CacheGet(OUT_DATA_KEY, -1)
+    return jsonWeather
+
+###############################################################################
+# Recover from a failed request using the last saved data.
+
+def UseSavedWeatherInfo(err, DEBUG):
+    """Use saved weather data after a failed request"""
 
-    # This server has another API call to get more data
-    GetAstroInfo(isRecent, DEBUG)
+    global jsonWeather
+
+    if DEBUG: # @DEBUG
+        print("Weather request failed: " + str(err))
+
+    # Without any weather data there's nothing to show
+    jsonWeather = CacheGet(OUT_DATA_KEY, -1)
+    if jsonWeather is None:
+        raise err
+
+def UseSavedAstroInfo(err, DEBUG):
+    """Use saved astronomy data after a failed request"""
+
+    global jsonAstro
+
+    if DEBUG: # @DEBUG
+        print("Astronomy request failed: " + str(err))
 
+    jsonAstro = CacheGet(OUT_ASTRO_KEY, -1)
 
 ###############################################################################
 # Get the current location's astronomical data from the server.
@@ -192,94 +331,241 @@ def GetAstroInfo(isRecent, DEBUG):
     # Check if data is recent enough to re-use
     if isRecent:
         # Use saved data
-        with open(OUT_ASTRO_FILE) as text_file:
-            jsonAstro = json.load(text_file)
+        jsonAstro = CacheGet(OUT_ASTRO_KEY, -1)
         if DEBUG: # @DEBUG
             print(80 * "-")
             print(jsonAstro)
-        return
+        if jsonAstro is not None:
+            return
 
     # Build command line
-    # https://api.weatherapi.com/v1/astronomy.json?key=[API_KEY]&q=[ZIP]
-    REQ_LINE = "https://api.weatherapi.com/v1/astronomy.json?" \
-        + "key=" + API_KEY \
-        + "&q=" + ZIP
+    REQ_LINE = BuildAstroRequest("&q=" + ZIP)
 
     # @DEBUG
     if (DEBUG == 1):
         print(80 * "-")
         print("> " + REQ_LINE)
 
-    response = requests.get(REQ_LINE)
-    jsonAstro = json.loads(response.text)
-
-    # Write JSON response to file to format it for reading
-    with open(OUT_ASTRO_FILE + ".raw", "w") as text_file:
-        text_file.write(response.text)
-    os.system("jq < " + OUT_ASTRO_FILE + ".raw > " + OUT_ASTRO_FILE)
-    # Remove the unformatted output file
-    os.system("rm -f " + OUT_ASTRO_FILE + ".raw")
+    # Save JSON response to file, formatted for reading
+    from weatherHTTP import HttpGetJSON
+    jsonAstro = RefreshEntry(OUT_ASTRO_KEY,
+                             lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, "astronomy"), validators=validators),
+                             FRESHNESS["astronomy"])
 
     if DEBUG: # @DEBUG
         print(80 * "-")
         print(jsonAstro)
 
+###############################################################################
+# Get weather and astronomy data for one entry of LOCATIONS (multi-location
+# mode). This does not touch the module's globals, so it is safe to call from
+# several threads at once.
+
+def FetchLocationWeather(location, DEBUG=False, useSaved=True):
+    """Get weather and astronomy info for one location from the cache or server"""
+
+    query = "&q=" + location["lat"] + "," + location["lon"]
+    endpoints = [
+        ("current", BuildWeatherRequest(query)),
+        ("astronomy", BuildAstroRequest(query)),
+    ]
+    if LOCAL_ASTRONOMY:
+        endpoints = endpoints[:1]
+
+    payload = []
+    skipped = None
+    for endpoint, REQ_LINE in endpoints:
+        key = CacheKey(PROVIDER, location["lat"], location["lon"], None, endpoint)
+        data = None
+        # Astronomy data is good for the whole day, even when forcing a refresh
+        if useSaved or FRESHNESS[endpoint] == DAILY:
+            data = CacheGet(key, FRESHNESS[endpoint])
+        if data is None:
+            if DEBUG: # @DEBUG
+                print("> " + REQ_LINE)
+            from weatherHTTP import HttpGetJSON
+            try:
+                data = RefreshEntry(key,
+                                    lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, endpoint), validators=validators),
+                                    FRESHNESS[endpoint], currentStamp if endpoint == "current" else None, fallback=False)
+            except SavedDataUsed as err:
+                # Reported once the whole payload is there
+                skipped = err
+                data = err.data
+        payload.append(data)
+
+    if LOCAL_ASTRONOMY:
+        payload.append(None)
+    if skipped is not None:
+        raise SavedDataUsed(skipped.error, payload)
+    return payload
+
+def ExtractLocationWeather(payload, location):
+    """Extract weather data received by FetchLocationWeather()"""
+
+    return ParseWeatherData(payload[0], payload[1], location.get("alt", ALT))
+
 ###############################################################################
 # Extract current weather data from the received data file.
 
 def ExtractWeatherData():
+    """Extract the saved/received data for the current location"""
+
+    obs = ParseWeatherData(savedWeather(), jsonAstro)
+    # Keep the module-level weatherData items up to date
+    weatherData.publish(obs)
+    return obs
+
+###############################################################################
+# Parse received data into a new observation.
+
+def ParseWeatherData(payload, astroPayload=None, alt=ALT):
+    """Parse current (and astronomy) data into a WeatherObservation"""
+
     # ---------------------------------
     # Parse data for weather items
 
+    obs = weatherData.WeatherObservation()
+    current = payload["current"]
+
     # City & Date & time
-    weatherData.city = jsonWeather["location"]["name"]
-    weatherData.localtime = jsonWeather["location"]["localtime"]
-    weatherData.lastupdate = jsonWeather["current"]["last_updated"]
+    obs.city = payload["location"]["name"]
+    obs.localtime = payload["location"]["localtime"]
+    obs.lastupdate = current["last_updated"]
+    obs.dt = current.get("last_updated_epoch", 0)
 
-    # Sunrise & sunset - see GetAstroInfo below
+    # Sunrise & sunset - see ExtractAstroData below
 
     # Temperature
-    weatherData.temp = jsonWeather["current"]["temp_f"]
+    obs.temp = current["temp_f"]
     # Pressure
-    weatherData.inHg = jsonWeather["current"]["pressure_in"]
-    weatherData.hpa = jsonWeather["current"]["pressure_mb"]
-    weatherData.mmHg = inHg_to_mmHg(weatherData.inHg)
+    obs.inHg = current["pressure_in"]
+    obs.hpa = current["pressure_mb"]
+    obs.mmHg = inHg_to_mmHg(obs.inHg)
     # Humidity
-    weatherData.humidity = jsonWeather["current"]["humidity"]
+    obs.humidity = current["humidity"]
     # Ultraviolet index
-    weatherData.uvi = jsonWeather["current"]["uv"]
+    obs.uvi = current["uv"]
     # Cloud cover (percentage)
-    weatherData.clouds = jsonWeather["current"]["cloud"]
+    obs.clouds = current["cloud"]
     # Wind speed and direction
-    weatherData.speed = jsonWeather["current"]["wind_mph"]
-    weatherData.direction = jsonWeather["current"]["wind_dir"]
+    obs.speed = current["wind_mph"]
+    obs.dir = current.get("wind_degree")
+    obs.direction = current["wind_dir"]
     # Current conditions
-    weatherData.weather = jsonWeather["current"]["condition"]["text"]
-    weatherData.weatherCode = jsonWeather["current"]["condition"]["code"]
+    obs.weather = current["condition"]["text"]
+    obs.weatherCode = current["condition"]["code"]
     # Precipitation
-    weatherData.precip = jsonWeather["current"]["precip_in"]
-    if weatherData.precip == "no":
-        weatherData.precip = "None"
+    obs.precip = current["precip_in"]
+    if obs.precip == "no":
+        obs.precip = "None"
 
     # Day/night indicator
-    weatherData.isDay = jsonWeather["current"]["is_day"]
+    obs.isDay = current["is_day"]
 
     # icon = get_icon(weather)
-    weatherData.icon = get_icon_from_code(weatherData.weatherCode)
+    obs.icon = get_icon_from_code(obs.weatherCode, obs.isDay)
 
     # Also extract astronomical data
-    ExtractAstroData()
+    ExtractAstroData(obs, payload, astroPayload, alt)
 
+    return obs
 
 ###############################################################################
 # Extract current astronomical data from the received data file.
 
-def ExtractAstroData():
-    weatherData.sunrise = jsonAstro["astronomy"]["astro"]["sunrise"]
-    weatherData.sunset = jsonAstro["astronomy"]["astro"]["sunset"]
-    weatherData.moonrise = jsonAstro["astronomy"]["astro"]["moonrise"]
-    weatherData.moonset = jsonAstro["astronomy"]["astro"]["moonset"]
-    weatherData.phase = jsonAstro["astronomy"]["astro"]["moon_phase"]
+def ExtractAstroData(obs, payload, astroPayload, alt=ALT):
+    if LOCAL_ASTRONOMY:
+        location = payload["location"]
+        astro = GetAstroStrings(location["lat"], location["lon"], alt, location.get("localtime_epoch"))
+        obs.sunrise = astro["sunrise"]
+        obs.sunset = astro["sunset"]
+        obs.moonrise = astro["moonrise"]
+        obs.moonset = astro["moonset"]
+        obs.phase = astro["phase"]
+        return
+
+    # The astronomy request may have failed with no saved data to fall back on
+    if astroPayload is None:
+        return
+
+    obs.sunrise = astroPayload["astronomy"]["astro"]["sunrise"]
+    obs.sunset = astroPayload["astronomy"]["astro"]["sunset"]
+    obs.moonrise = astroPayload["astronomy"]["astro"]["moonrise"]
+    obs.moonset = astroPayload["astronomy"]["astro"]["moonset"]
+    obs.phase = astroPayload["astronomy"]["astro"]["moon_phase"]
+
+###############################################################################
+# Get the hourly and daily forecast for a location (an entry like those of
+# LOCATIONS). Like FetchLocationWeather(), this doesn't touch the globals.
+
+def FetchForecast(location, DEBUG=False, useSaved=True):
+    """Get forecast info for one location from the cache or server"""
+
+    key = CacheKey(PROVIDER, location["lat"], location["lon"], None, "forecast")
+    if useSaved:
+        payload = CacheGet(key, FRESHNESS["forecast"])
+        if payload is not None:
+            return payload
+
+    REQ_LINE = BuildForecastRequest("&q=" + location["lat"] + "," + location["lon"])
+
+    if DEBUG: # @DEBUG
+        print("> " + REQ_LINE)
+
+    from weatherHTTP import HttpGetJSON
+    return RefreshEntry(key, lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, "forecast"), validators=validators),
+                        FRESHNESS["forecast"])
+
+###############################################################################
+# Parse received forecast data into columns.
+
+def ParseForecast(payload):
+    """Parse forecast data into a Forecast"""
+
+    fc = Forecast(payload["location"]["name"])
+    forecastDays = payload["forecast"]["forecastday"]
+
+    # Hours are listed per day from midnight: start at the current hour
+    now = payload["location"].get("localtime_epoch", 0)
+    hours = [h for d in forecastDays for h in d["hour"] if h["time_epoch"] > now - 3600][:HOURS]
+    codes = [h["condition"]["code"] for h in hours]
+    isDay = [h["is_day"] for h in hours]
+    fc.setHourly(
+        dt=[h["time_epoch"] for h in hours],
+        temp=[h["temp_f"] for h in hours],
+        humidity=[h["humidity"] for h in hours],
+        hpa=[h["pressure_mb"] for h in hours],
+        speed=[h["wind_mph"] for h in hours],
+        dir=[h.get("wind_degree") for h in hours],
+        pop=[max(h.get("chance_of_rain", 0), h.get("chance_of_snow", 0)) for h in hours],
+        precip=[h["precip_in"] for h in hours],
+        weatherCode=codes,
+        isDay=isDay,
+        weather=[h["condition"]["text"] for h in hours],
+        icon=MapCodes(codes, isDay, get_icon_from_code),
+    )
+
+    # Days have no pressure or wind direction
+    days = [d["day"] for d in forecastDays[:DAYS]]
+    codes = [d["condition"]["code"] for d in days]
+    fc.setDaily(
+        # Midday, like OneCall (date_epoch is midnight UTC)
+        dt=[d["date_epoch"] + 12 * 60 * 60 for d in forecastDays[:DAYS]],
+        tempMin=[d["mintemp_f"] for d in days],
+        tempMax=[d["maxtemp_f"] for d in days],
+        humidity=[d["avghumidity"] for d in days],
+        hpa=[None] * len(days),
+        speed=[d["maxwind_mph"] for d in days],
+        dir=[None] * len(days),
+        pop=[max(d.get("daily_chance_of_rain", 0), d.get("daily_chance_of_snow", 0)) for d in days],
+        precip=[d["totalprecip_in"] for d in days],
+        weatherCode=codes,
+        weather=[d["condition"]["text"] for d in days],
+        icon=MapCodes(codes, [True] * len(codes), get_icon_from_code),
+    )
+
+    return fc
 
 ###############################################################################
 
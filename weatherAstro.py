@@ -0,0 +1,407 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Offline astronomy: sun and moon rise/set times and moon phase
+#
+# These only depend on the location (LAT/LON/ALT) and the date, so they can
+# be computed locally instead of being requested from a server. Positions
+# use the low-precision series from Jean Meeus, "Astronomical Algorithms"
+# (chapters 12, 25 and 47), good to about a minute for rise/set times at
+# moderate latitudes.
+#
+# Rise/set times for a whole year can be precomputed per location and kept
+# in the cache directory (see BuildYearTable()), one fixed-width record per
+# day; a lookup then reads a single record at its offset. Year tables are
+# not cache entries: they aren't evicted or counted as cache hits/misses.
+###############################################################################
+
+import os
+import math
+import time
+import struct
+import datetime
+
+import weatherCache
+from weatherCache import WriteCacheFile
+
+###############################################################################
+
+# Use precomputed per-year tables when they exist
+USE_YEAR_TABLES = True
+
+# Directory (in the cache directory) holding the year tables
+YEAR_TABLE_DIR = "astro"
+
+# Year table record layout (little-endian, 36 bytes), one per day:
+#   sunrise, sunset, moonrise, moonset  int64  Unix time, -1 if none
+#   phase                               uint8  index in PHASES
+#   illumination                        uint8  percent
+DAY_RECORD = struct.Struct("<qqqqBBxx")
+
+# Correct rise/set times for the observer's height above the horizon
+USE_ALTITUDE = True
+
+# Search step when looking for rise/set times, in seconds
+SEARCH_STEP = (30.0 * 60.0)
+
+# Text used (like WeatherAPI) when there's no rise or set on a day
+NO_MOONRISE = "No moonrise"
+NO_MOONSET = "No moonset"
+NO_SUNRISE = "No sunrise"
+NO_SUNSET = "No sunset"
+
+# Moon phase names (same as WeatherAPI), starting at new moon
+PHASES = ["New Moon", "Waxing Crescent", "First Quarter", "Waxing Gibbous",
+          "Full Moon", "Waning Gibbous", "Last Quarter", "Waning Crescent"]
+
+###############################################################################
+# Moon periodic terms (Meeus table 47.A/47.B), largest terms only.
+# Multiples of D, M, M', F, then longitude (1e-6 deg) and distance (1e-3 km).
+
+MOON_LR = [
+    (0, 0, 1, 0, 6288774, -20905355),
+    (2, 0, -1, 0, 1274027, -3699111),
+    (2, 0, 0, 0, 658314, -2955968),
+    (0, 0, 2, 0, 213618, -569925),
+    (0, 1, 0, 0, -185116, 48888),
+    (0, 0, 0, 2, -114332, -3149),
+    (2, 0, -2, 0, 58793, 246158),
+    (2, -1, -1, 0, 57066, -152138),
+    (2, 0, 1, 0, 53322, -170733),
+    (2, -1, 0, 0, 45758, -204586),
+    (0, 1, -1, 0, -40923, -129620),
+    (1, 0, 0, 0, -34720, 108743),
+    (0, 1, 1, 0, -30383, 104755),
+    (2, 0, 0, -2, 15327, 10321),
+    (0, 0, 1, 2, -12528, 0),
+    (0, 0, 1, -2, 10980, 79661),
+    (4, 0, -1, 0, 10675, -34782),
+    (0, 0, 3, 0, 10034, -23210),
+    (4, 0, -2, 0, 8548, -21636),
+    (2, 1, -1, 0, -7888, 24208),
+    (2, 1, 0, 0, -6766, 30824),
+    (1, 0, -1, 0, -5163, -8379),
+    (1, 1, 0, 0, 4987, -16675),
+    (2, -1, 1, 0, 4036, -12831),
+    (2, 0, 2, 0, 3994, -10445),
+]
+
+# Multiples of D, M, M', F, then latitude (1e-6 deg)
+MOON_B = [
+    (0, 0, 0, 1, 5128122),
+    (0, 0, 1, 1, 280602),
+    (0, 0, 1, -1, 277693),
+    (2, 0, 0, -1, 173237),
+    (2, 0, -1, 1, 55413),
+    (2, 0, -1, -1, 46271),
+    (2, 0, 0, 1, 32573),
+    (0, 0, 2, 1, 17198),
+    (2, 0, 1, -1, 9266),
+    (0, 0, 2, -1, 8822),
+    (2, -1, 0, -1, 8216),
+    (2, 0, -2, -1, 4324),
+    (2, 0, 1, 1, 4200),
+]
+
+###############################################################################
+# Basic helpers. Angles are in degrees unless noted.
+
+def julianDay(epoch):
+    """Julian day for a Unix time"""
+    return epoch / 86400.0 + 2440587.5
+
+def sind(a):
+    return math.sin(math.radians(a))
+
+def cosd(a):
+    return math.cos(math.radians(a))
+
+def obliquity(T):
+    """Mean obliquity of the ecliptic"""
+    return 23.0 + (26.0 + (21.448 - T * (46.815 + T * (0.00059 - T * 0.001813))) / 60.0) / 60.0
+
+def eclipticToEquatorial(lam, beta, eps):
+    """Convert ecliptic longitude/latitude to right ascension/declination"""
+    ra = math.degrees(math.atan2(sind(lam) * cosd(eps) - math.tan(math.radians(beta)) * sind(eps), cosd(lam)))
+    dec = math.degrees(math.asin(sind(beta) * cosd(eps) + cosd(beta) * sind(eps) * sind(lam)))
+    return ra % 360.0, dec
+
+def siderealTime(jd):
+    """Greenwich mean sidereal time"""
+    T = (jd - 2451545.0) / 36525.0
+    return (280.46061837 + 360.98564736629 * (jd - 2451545.0)
+            + T * T * (0.000387933 - T / 38710000.0)) % 360.0
+
+###############################################################################
+# Sun and moon positions at a Julian day.
+
+def sunLongitude(T):
+    """Apparent ecliptic longitude of the sun"""
+
+    L0 = 280.46646 + T * (36000.76983 + T * 0.0003032)
+    M = 357.52911 + T * (35999.05029 - T * 0.0001537)
+    C = (1.914602 - T * (0.004817 + T * 0.000014)) * sind(M) \
+        + (0.019993 - T * 0.000101) * sind(2.0 * M) \
+        + 0.000289 * sind(3.0 * M)
+    omega = 125.04 - 1934.136 * T
+    return (L0 + C - 0.00569 - 0.00478 * sind(omega)) % 360.0
+
+def sunPosition(jd):
+    """Right ascension and declination of the sun"""
+
+    T = (jd - 2451545.0) / 36525.0
+    omega = 125.04 - 1934.136 * T
+    eps = obliquity(T) + 0.00256 * cosd(omega)
+    ra, dec = eclipticToEquatorial(sunLongitude(T), 0.0, eps)
+    return ra, dec
+
+def moonEcliptic(T):
+    """Ecliptic longitude, latitude and distance (km) of the moon"""
+
+    Lp = 218.3164477 + 481267.88123421 * T
+    D = 297.8501921 + 445267.1114034 * T
+    M = 357.5291092 + 35999.0502909 * T
+    Mp = 134.9633964 + 477198.8675055 * T
+    F = 93.2720950 + 483202.0175233 * T
+    E = 1.0 - 0.002516 * T
+
+    sumL = 0.0
+    sumR = 0.0
+    for d, m, mp, f, l, r in MOON_LR:
+        arg = d * D + m * M + mp * Mp + f * F
+        e = E ** abs(m)
+        sumL += l * e * sind(arg)
+        sumR += r * e * cosd(arg)
+
+    sumB = 0.0
+    for d, m, mp, f, b in MOON_B:
+        e = E ** abs(m)
+        sumB += b * e * sind(d * D + m * M + mp * Mp + f * F)
+
+    # Main additive terms (Venus, Jupiter, flattening)
+    A1 = 119.75 + 131.849 * T
+    A2 = 53.09 + 479264.290 * T
+    A3 = 313.45 + 481266.484 * T
+    sumL += 3958 * sind(A1) + 1962 * sind(Lp - F) + 318 * sind(A2)
+    sumB += -2235 * sind(Lp) + 382 * sind(A3) + 175 * sind(A1 - F) \
+        + 175 * sind(A1 + F) + 127 * sind(Lp - Mp) - 115 * sind(Lp + Mp)
+
+    omega = 125.04452 - 1934.136261 * T
+    lam = (Lp + sumL / 1e6 - 0.00478 * sind(omega)) % 360.0
+    return lam, sumB / 1e6, 385000.56 + sumR / 1000.0
+
+def moonPosition(jd):
+    """Right ascension, declination and distance (km) of the moon"""
+
+    T = (jd - 2451545.0) / 36525.0
+    lam, beta, dist = moonEcliptic(T)
+    omega = 125.04452 - 1934.136261 * T
+    eps = obliquity(T) + 0.00256 * cosd(omega)
+    ra, dec = eclipticToEquatorial(lam, beta, eps)
+    return ra, dec, dist
+
+###############################################################################
+# Altitude above the horizon, relative to the altitude at which the body
+# rises or sets (so rise/set happen where this crosses zero).
+
+def sunAltitude(epoch, lat, lon, h0):
+    jd = julianDay(epoch)
+    ra, dec = sunPosition(jd)
+    H = siderealTime(jd) + lon - ra
+    return math.degrees(math.asin(sind(lat) * sind(dec) + cosd(lat) * cosd(dec) * cosd(H))) - h0
+
+def moonAltitude(epoch, lat, lon, h0):
+    jd = julianDay(epoch)
+    ra, dec, dist = moonPosition(jd)
+    # The moon is close enough that parallax moves its rise/set noticeably
+    parallax = math.degrees(math.asin(6378.14 / dist))
+    H = siderealTime(jd) + lon - ra
+    alt = math.degrees(math.asin(sind(lat) * sind(dec) + cosd(lat) * cosd(dec) * cosd(H)))
+    return alt - (h0 + 0.7275 * parallax)
+
+###############################################################################
+# Find rise and set times between two Unix times.
+# Returns (rise, set), either of which is None if it doesn't happen.
+
+def findRiseSet(altitude, start, end, lat, lon, h0):
+    """Find when a body rises and sets"""
+
+    rise = None
+    setting = None
+    t0 = start
+    a0 = altitude(t0, lat, lon, h0)
+    while t0 < end and (rise is None or setting is None):
+        t1 = min(t0 + SEARCH_STEP, end)
+        a1 = altitude(t1, lat, lon, h0)
+        if (a0 < 0.0) != (a1 < 0.0):
+            # Refine by bisection to within a few seconds
+            lo, hi, alo = t0, t1, a0
+            while hi - lo > 5.0:
+                mid = (lo + hi) / 2.0
+                amid = altitude(mid, lat, lon, h0)
+                if (amid < 0.0) == (alo < 0.0):
+                    lo, alo = mid, amid
+                else:
+                    hi = mid
+            t = round((lo + hi) / 2.0)
+            if a0 < 0.0:
+                rise = rise if rise is not None else t
+            else:
+                setting = setting if setting is not None else t
+        t0, a0 = t1, a1
+    return rise, setting
+
+###############################################################################
+# Moon phase at a Unix time.
+# Returns (phase name, illumination in percent).
+
+def MoonPhase(epoch):
+    """Compute the moon phase"""
+
+    T = (julianDay(epoch) - 2451545.0) / 36525.0
+    lam, beta, dist = moonEcliptic(T)
+    elongation = (lam - sunLongitude(T)) % 360.0
+    illumination = (1.0 - cosd(elongation)) / 2.0 * 100.0
+    return PHASES[int((elongation + 22.5) / 45.0) % 8], round(illumination)
+
+###############################################################################
+# Compute the astronomical data for the local day containing a Unix time.
+# Returns a dictionary with sunrise, sunset, moonrise and moonset (Unix time,
+# or None), and the moon phase name and illumination at local noon.
+
+def ComputeDay(lat, lon, alt=0, when=None):
+    """Compute sun/moon rise and set times and moon phase for a day"""
+
+    if when is None:
+        when = time.time()
+    lat = float(lat)
+    lon = float(lon)
+
+    day = datetime.date.fromtimestamp(when)
+    start = time.mktime(day.timetuple())
+    end = time.mktime((day + datetime.timedelta(days=1)).timetuple())
+
+    # Standard altitudes at rise/set (refraction and semi-diameter), plus the
+    # dip of the horizon seen from above sea level
+    dip = 0.0
+    if USE_ALTITUDE:
+        dip = 1.76 * math.sqrt(max(float(alt), 0.0)) / 60.0
+    sunrise, sunset = findRiseSet(sunAltitude, start, end, lat, lon, -0.8333 - dip)
+    moonrise, moonset = findRiseSet(moonAltitude, start, end, lat, lon, -0.5667 - dip)
+    phase, illumination = MoonPhase((start + end) / 2.0)
+
+    return {"sunrise": sunrise, "sunset": sunset, "moonrise": moonrise, "moonset": moonset,
+            "phase": phase, "illumination": illumination}
+
+###############################################################################
+# Precomputed year tables, saved in the cache directory.
+
+def yearTablePath(lat, lon, alt, year):
+    """Return the year table file of a location"""
+    name = "{lat:.4f}_{lon:.4f}_{alt}_{year}.bin".format(lat=float(lat), lon=float(lon), alt=alt, year=year)
+    return os.path.join(weatherCache.CACHE_DIR, YEAR_TABLE_DIR, name)
+
+def packDay(data):
+    """Pack a day's astronomical data (see ComputeDay()) into a record"""
+    times = [-1 if data[name] is None else int(data[name])
+             for name in ("sunrise", "sunset", "moonrise", "moonset")]
+    return DAY_RECORD.pack(*times, PHASES.index(data["phase"]), int(data["illumination"]))
+
+def unpackDay(record):
+    """Unpack a year table record"""
+    sunrise, sunset, moonrise, moonset, phase, illumination = DAY_RECORD.unpack(record)
+    data = {name: None if value == -1 else value for name, value in
+            (("sunrise", sunrise), ("sunset", sunset), ("moonrise", moonrise), ("moonset", moonset))}
+    data["phase"] = PHASES[phase]
+    data["illumination"] = illumination
+    return data
+
+def BuildYearTable(lat, lon, alt, year):
+    """Compute and save the astronomical data for every day of a year"""
+
+    records = []
+    day = datetime.date(year, 1, 1)
+    while day.year == year:
+        noon = time.mktime(day.timetuple()) + 12 * 60 * 60
+        records.append(packDay(ComputeDay(lat, lon, alt, noon)))
+        day += datetime.timedelta(days=1)
+
+    path = yearTablePath(lat, lon, alt, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    WriteCacheFile(path, b"".join(records))
+
+def EnsureYearTable(lat, lon, alt, year):
+    """Build the year table for a location unless it's already saved"""
+
+    if not os.path.exists(yearTablePath(lat, lon, alt, year)):
+        BuildYearTable(lat, lon, alt, year)
+
+def GetDay(lat, lon, alt=0, when=None):
+    """Get the astronomical data for a day, from a year table if there is one"""
+
+    if when is None:
+        when = time.time()
+
+    if USE_YEAR_TABLES:
+        day = datetime.date.fromtimestamp(when)
+        try:
+            with open(yearTablePath(lat, lon, alt, day.year), "rb") as table_file:
+                table_file.seek((day.timetuple().tm_yday - 1) * DAY_RECORD.size)
+                record = table_file.read(DAY_RECORD.size)
+            if len(record) == DAY_RECORD.size:
+                return unpackDay(record)
+        except OSError:
+            pass
+
+    return ComputeDay(lat, lon, alt, when)
+
+###############################################################################
+# Get the astronomical data formatted like the weather services' data.
+# Times are HH:MM AM/PM local time (see seconds_to_time()).
+
+def FormatTime(epoch, missing):
+    if epoch is None:
+        return missing
+    return time.strftime("%I:%M %p", time.localtime(epoch))
+
+def GetAstroStrings(lat, lon, alt=0, when=None):
+    """Get the astronomical data for a day, as displayed by weather.py"""
+
+    data = GetDay(lat, lon, alt, when)
+    return {
+        "sunr": data["sunrise"] or 0,
+        "sunrise": FormatTime(data["sunrise"], NO_SUNRISE),
+        "suns": data["sunset"] or 0,
+        "sunset": FormatTime(data["sunset"], NO_SUNSET),
+        "moonrise": FormatTime(data["moonrise"], NO_MOONRISE),
+        "moonset": FormatTime(data["moonset"], NO_MOONSET),
+        "phase": data["phase"],
+    }
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
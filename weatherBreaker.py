@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Circuit breaker for each weather service
+#
+# When a service is down, or refuses requests (bad API key, rate limited),
+# every invocation would wait on it and fail the same way. Failures are
+# counted per service in a state file shared by all processes. After
+# FAILURE_THRESHOLD failures in a row (or at once, for OPEN_STATUS
+# replies) the breaker opens: no requests are made to the service for a
+# backoff time, and the saved data is used instead, marked as degraded.
+# When the time is up, the next request is a trial, claimed by one process
+# only: if it succeeds the breaker closes, otherwise it opens again for
+# twice as long. Failures of requests that were already under way when the
+# breaker opened don't count.
+###############################################################################
+
+import os
+import time
+import threading
+
+import weatherCache
+
+###############################################################################
+
+# Set to False to always make requests
+ENABLED = True
+
+# State file, and its lock file
+BREAKER_DIR = "/tmp/conweather"
+BREAKER_FILE = os.path.join(BREAKER_DIR, "breaker.json")
+BREAKER_LOCK = os.path.join(BREAKER_DIR, "breaker.lock")
+
+# Failures in a row that open the breaker
+FAILURE_THRESHOLD = 3
+
+# HTTP statuses that open it at once: bad API key, not allowed, rate limited
+OPEN_STATUS = (401, 403, 429)
+
+# Time (seconds) the breaker stays open the first time, doubling each time
+# it opens again without a success in between, up to MAX_BACKOFF
+BACKOFF = 60.0
+MAX_BACKOFF = (30.0 * 60.0)
+
+# Seconds a trial request has to finish before another process may make one
+TRIAL_WAIT = 15.0
+
+# The trials claimed by the current thread: provider -> claim
+current = threading.local()
+
+###############################################################################
+
+class CircuitOpen(Exception):
+    """A service's breaker is open: no request was made"""
+
+###############################################################################
+# State file handling. The file holds, per provider:
+#   {"failures": <in a row>, "opens": <times opened in a row>,
+#    "openUntil": <Unix time>, "error": <last error>,
+#    "trial": <claim of the trial request, while one is under way>}
+# (see weatherCache.UpdateStateFile)
+
+def readState():
+    """Read the shared breaker state"""
+    return weatherCache.ReadStateFile(BREAKER_FILE)
+
+def update(provider, change):
+    """Change a provider's entry with the state locked"""
+
+    def changeEntry(state):
+        entry = change(state.get(provider))
+        if entry is None:
+            state.pop(provider, None)
+        else:
+            state[provider] = entry
+
+    weatherCache.UpdateStateFile(BREAKER_FILE, BREAKER_LOCK, changeEntry)
+
+###############################################################################
+# Check the breaker before a request.
+
+def IsOpen(provider):
+    """Check if a service's breaker is open"""
+
+    if not ENABLED:
+        return False
+    entry = readState().get(provider)
+    return entry is not None and entry.get("openUntil", 0) > time.time()
+
+def circuitOpen(provider, entry):
+    return CircuitOpen("{p}: not used for {s:.0f}s after failing ({e})".format(
+        p=provider, s=max(entry.get("openUntil", 0) - time.time(), 0), e=entry.get("error", "")))
+
+def Allow(provider):
+    """Raise CircuitOpen if no request should be made to a service"""
+
+    if not ENABLED:
+        return
+    entry = readState().get(provider)
+    if entry is None:
+        return
+    if entry.get("openUntil", 0) > time.time():
+        raise circuitOpen(provider, entry)
+    if entry.get("opens", 0) == 0:
+        # Closed, counting failures
+        return
+
+    # The backoff time is up: only the process claiming the trial (keeping
+    # the breaker open for the others meanwhile) makes a request
+    claimed = []
+
+    def claim(entry):
+        if entry is not None and entry.get("opens", 0) > 0 and entry.get("openUntil", 0) <= time.time():
+            trial = "{p}:{t}:{s}".format(p=os.getpid(), t=threading.get_ident(), s=time.time())
+            entry = dict(entry, openUntil=time.time() + TRIAL_WAIT, trial=trial)
+            claimed.append(trial)
+        return entry
+
+    update(provider, claim)
+    if claimed:
+        trials()[provider] = claimed[0]
+    else:
+        # Another process claimed the trial, unless it already succeeded
+        entry = readState().get(provider)
+        if entry is not None and entry.get("openUntil", 0) > time.time():
+            raise circuitOpen(provider, entry)
+
+def trials():
+    """Return the current thread's claimed trials"""
+
+    if not hasattr(current, "trials"):
+        current.trials = {}
+    return current.trials
+
+###############################################################################
+# Record the result of a request.
+
+def RecordSuccess(provider):
+    """Close a service's breaker"""
+
+    trials().pop(provider, None)
+    # Nothing to write in the usual case
+    if ENABLED and provider in readState():
+        update(provider, lambda entry: None)
+
+def RecordFailure(provider, error, status=None):
+    """Count a failed request, opening the breaker if needed
+      status : HTTP status, or None (e.g. no connection)"""
+
+    trial = trials().pop(provider, None)
+    if not ENABLED:
+        return
+
+    def fail(entry):
+        entry = dict(entry or {"failures": 0, "opens": 0, "openUntil": 0})
+        isTrial = trial is not None and entry.get("trial") == trial
+        if entry["openUntil"] > time.time() and not isTrial:
+            # Under way when the breaker opened: already accounted for
+            return entry
+        entry["failures"] += 1
+        entry["error"] = str(error)
+        entry.pop("trial", None)
+        # A failed trial (opened before, no success since) opens it again
+        if entry["opens"] > 0 or entry["failures"] >= FAILURE_THRESHOLD or status in OPEN_STATUS:
+            entry["opens"] += 1
+            entry["failures"] = 0
+            entry["openUntil"] = time.time() + min(BACKOFF * 2 ** (entry["opens"] - 1), MAX_BACKOFF)
+        return entry
+
+    update(provider, fail)
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
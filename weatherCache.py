@@ -0,0 +1,578 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Saved-data (cache) file handling
+#
+# Files are written to a temporary file in the same directory, flushed to
+# disk and then renamed over the old file. A reader sees either the old
+# data or the new data, never an empty or partially written file.
+#
+# Saved responses live in one cache directory, one file per key. A key is
+# made from the provider, coordinates, units and endpoint, so different
+# locations and configurations don't overwrite each other. Each entry has
+# its own time-to-live (TTL), kept in an index file. When there are too
+# many entries (or bytes), the least recently used ones are removed. Last
+# use is recorded in the file's access time, so a cache hit costs no extra
+# write.
+#
+# When saved data gets old, every prompt and pane using it would refresh it
+# at the same time. RefreshEntry() lets only one process (or thread) fetch
+# an entry; the others wait for its data, or use the old data. The old
+# data is also used when the service's quota doesn't allow a request
+# (weatherQuota) or its circuit breaker is open (weatherBreaker), and
+# entries stay fresh longer while the quota runs low.
+#
+# Refreshing an entry revalidates it when possible: the reply's ETag and
+# Last-Modified headers are kept in the index and sent with the next
+# request, and a "not modified" reply only marks the saved data as new.
+# The provider's observation time is kept too, so data that hasn't changed
+# since the last request isn't written again.
+#
+# The observation extracted from an entry can be saved next to it, packed
+# with marshal (<key>.obs). Showing saved data then takes one small read,
+# without parsing the JSON or the index, or extracting it again. The JSON
+# file stays the saved data used for refreshing and debugging (-d). Saving
+# new data removes the observation; a revalidation that finds the data
+# unchanged keeps it.
+###############################################################################
+
+import os
+import re
+import json
+import time
+import fcntl
+import marshal
+import tempfile
+
+from weatherTimings import Phase, AddBytes
+from weatherMetrics import CountCache, CountRefreshLock
+# Imported as modules: they use the state files below
+import weatherQuota
+import weatherBreaker
+
+###############################################################################
+
+# Pretty-print saved JSON files so they are easy to read (like jq does).
+# Set to False to write compact JSON.
+PRETTY_JSON = True
+
+# Directory holding all saved responses
+CACHE_DIR = "/tmp/conweather"
+
+# Index of cache entries (TTL etc.), and its lock file
+CACHE_INDEX = "index.json"
+CACHE_LOCK = "index.lock"
+
+# Default time-to-live of an entry, in seconds
+DEFAULT_TTL = (15.0 * 60.0)
+
+# TTL for data that only changes once per local day (e.g. astronomy): the
+# entry stays fresh until midnight
+DAILY = "daily"
+
+# Limits on the cache size; least recently used entries are removed first
+MAX_ENTRIES = 256
+MAX_BYTES = (16 * 1024 * 1024)
+
+# Longest time (seconds) to wait for another process refreshing the same
+# entry before using the old data, and how often to check on it
+REFRESH_WAIT = 3.0
+REFRESH_POLL = 0.01
+
+# Validators kept in the index with an entry:
+#   etag, modified : the reply's ETag and Last-Modified headers
+#   stamp          : the provider's observation time in the data
+VALIDATORS = ("etag", "modified", "stamp")
+
+###############################################################################
+
+class NotModified(Exception):
+    """The saved data is still current (e.g. HTTP 304)"""
+
+class SavedDataUsed(Exception):
+    """No request was allowed (quota or circuit breaker): the saved data
+    (data) is all there is"""
+
+    def __init__(self, error, data):
+        Exception.__init__(self, str(error))
+        self.error = error
+        self.data = data
+
+###############################################################################
+# Atomically replace a file with the given text.
+#   sync : False if the file isn't worth flushing to disk (e.g. statistics)
+
+def WriteCacheFile(path, text, sync=True):
+    """Atomically write text (or bytes) to a file"""
+
+    directory = os.path.dirname(path) or "."
+    fd, tmpPath = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as tmpFile:
+            tmpFile.write(text)
+            if sync:
+                tmpFile.flush()
+                os.fsync(tmpFile.fileno())
+        os.replace(tmpPath, path)
+    except BaseException:
+        # Don't leave temporary files behind
+        try:
+            os.unlink(tmpPath)
+        except OSError:
+            pass
+        raise
+
+###############################################################################
+# Small JSON state files shared by all processes (weatherQuota,
+# weatherBreaker). They're changed with their lock file held, and replaced
+# atomically, so they can be read without the lock.
+#   change : function(state) changing the state in place; if it raises,
+#            the file is left as it was
+
+def ReadStateFile(path):
+    """Read a shared state file"""
+
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+def UpdateStateFile(path, lockPath, change):
+    """Change a shared state file with its lock held"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(lockPath, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        state = ReadStateFile(path)
+        change(state)
+        WriteCacheFile(path, json.dumps(state))
+
+###############################################################################
+# Save a decoded JSON response.
+
+def WriteJSONFile(path, data, pretty=None):
+    """Atomically write JSON data to a file"""
+
+    if pretty is None:
+        pretty = PRETTY_JSON
+    if pretty:
+        text = json.dumps(data, indent=2, ensure_ascii=False) + "\n"
+    else:
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    WriteCacheFile(path, text)
+
+###############################################################################
+# Build a cache key. Coordinates are rounded (about 10m) so that different
+# spellings of the same location share an entry.
+
+def CacheKey(provider, lat, lon, units, endpoint):
+    """Build the cache key for a request"""
+
+    key = "{p}_{lat:.4f}_{lon:.4f}_{u}_{e}".format(
+        p=provider, lat=float(lat), lon=float(lon), u=units or "any", e=endpoint)
+    # Keep it safe to use as a file name
+    return re.sub(r"[^A-Za-z0-9_.+-]", "-", key)
+
+def CachePath(key):
+    """Return the file holding a cache entry"""
+    return os.path.join(CACHE_DIR, key + ".json")
+
+def ObservationPath(key):
+    """Return the file holding the observation extracted from an entry"""
+    return os.path.join(CACHE_DIR, key + ".obs")
+
+###############################################################################
+# Cache index handling. The index is only written when entries are stored
+# or removed, with a lock held so concurrent writers don't lose entries.
+
+def ReadIndex():
+    """Read the cache index"""
+
+    try:
+        with open(os.path.join(CACHE_DIR, CACHE_INDEX)) as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+def LockIndex():
+    """Lock the cache index; close the returned file to unlock it"""
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(CACHE_DIR, CACHE_LOCK), "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+###############################################################################
+# Get the age of an entry in seconds, or None if there's no such entry.
+
+def CacheAge(key):
+    """Return the age of a cache entry"""
+
+    try:
+        return time.time() - os.path.getmtime(CachePath(key))
+    except OSError:
+        return None
+
+def CacheIsFresh(key, maxAge=None):
+    """Check if a cache entry is younger than maxAge (default: its TTL),
+    stretched while its service's quota runs low"""
+
+    age = CacheAge(key)
+    if age is None:
+        return False
+    if maxAge is None:
+        maxAge = ReadIndex().get(key, {}).get("ttl", DEFAULT_TTL)
+    if maxAge == DAILY:
+        # Fresh if saved today (local time)
+        saved = time.localtime(time.time() - age)
+        today = time.localtime()
+        return (saved.tm_year, saved.tm_yday) == (today.tm_year, today.tm_yday)
+    # Keys start with the provider
+    return age <= maxAge * weatherQuota.Stretch(key.split("_", 1)[0])
+
+###############################################################################
+# Get the validators of an entry (see VALIDATORS), to revalidate it.
+
+def CacheValidators(key):
+    """Return the validators saved with a cache entry"""
+
+    entry = ReadIndex().get(key, {})
+    return {name: entry[name] for name in VALIDATORS if name in entry}
+
+###############################################################################
+# Mark an entry as just saved, without writing it. Returns False if the
+# entry is gone.
+
+def CacheTouch(key):
+    """Renew a cache entry whose data hasn't changed"""
+
+    try:
+        os.utime(CachePath(key))
+    except OSError:
+        return False
+    return True
+
+###############################################################################
+# Get a cache entry.
+#   maxAge : None to use the entry's TTL, a maximum age in seconds, DAILY,
+#            or -1 to accept any age (e.g. to fall back on stale data)
+# Returns the saved data, or None if it's missing or too old.
+
+def CacheGet(key, maxAge=None):
+    """Read a cache entry"""
+
+    if maxAge != -1:
+        if not CacheIsFresh(key, maxAge):
+            CountCache(key, "miss")
+            return None
+        result = "hit"
+    else:
+        result = "hit" if CacheIsFresh(key) else "stale"
+
+    path = CachePath(key)
+    with Phase("cache read", key):
+        try:
+            with open(path) as text_file:
+                text = text_file.read()
+            AddBytes(len(text))
+            data = json.loads(text)
+            # Record the use for LRU eviction, keeping the modification time
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except (OSError, ValueError):
+            CountCache(key, "miss")
+            return None
+    CountCache(key, result)
+    return data
+
+###############################################################################
+# Store a cache entry, then evict least recently used entries if needed.
+#   ttl        : seconds, or DAILY (default DEFAULT_TTL)
+#   validators : dict of VALIDATORS to revalidate the entry with later
+
+def CachePut(key, data, ttl=None, validators=None):
+    """Save a cache entry"""
+
+    if ttl is None:
+        ttl = DEFAULT_TTL
+
+    with Phase("cache write", key):
+        lock_file = LockIndex()
+        try:
+            # The observation saved with the old data no longer applies
+            try:
+                os.unlink(ObservationPath(key))
+            except OSError:
+                pass
+            WriteJSONFile(CachePath(key), data)
+
+            index = ReadIndex()
+            index[key] = {"ttl": ttl}
+            if validators:
+                index[key].update((name, validators[name]) for name in VALIDATORS
+                                  if validators.get(name) is not None)
+            EvictEntries(index, key)
+            WriteCacheFile(os.path.join(CACHE_DIR, CACHE_INDEX), json.dumps(index, indent=2) + "\n")
+        finally:
+            lock_file.close()
+
+###############################################################################
+# Identify the data of an entry: by its validators, which stay the same
+# when it's revalidated, or by its modification time if it has none.
+# Returns None if there's no such entry.
+
+def EntryVersion(key):
+    """Return a value that changes when an entry's data changes"""
+
+    modTime = entryModTime(key)
+    if modTime is None:
+        return None
+    validators = [(name, value) for name, value in sorted(CacheValidators(key).items()) if value is not None]
+    if validators:
+        return tuple(validators)
+    return modTime
+
+###############################################################################
+# Save the observation extracted from an entry, packed with marshal.
+#   fields  : names of the values (weatherData.FIELDS)
+#   values  : the observation's values (WeatherObservation.toTuple())
+#   version : EntryVersion() of the entry when its data was read
+#             (default: now)
+# It isn't saved if the entry changed since its data was read. CachePut()
+# removes it (under the same lock), so a saved observation is always the
+# current data's, and reading it needs no check against the index.
+
+def SaveObservation(key, fields, values, version=None):
+    """Save an observation extracted from a cache entry"""
+
+    with Phase("cache write", key):
+        lock_file = LockIndex()
+        try:
+            current = EntryVersion(key)
+            if current is None or version not in (None, current):
+                return
+            WriteCacheFile(ObservationPath(key), marshal.dumps((fields, current, values)))
+        except (OSError, ValueError):
+            # ValueError: a value marshal can't store
+            pass
+        finally:
+            lock_file.close()
+
+###############################################################################
+# Load the observation saved with SaveObservation().
+#   fresh : False if the entry is known to be old (counted as stale)
+# Returns its values, or None if there's none (or it has other fields).
+
+def LoadObservation(key, fields, fresh=True):
+    """Read the observation extracted from a cache entry"""
+
+    with Phase("cache read", key):
+        try:
+            with open(ObservationPath(key), "rb") as obs_file:
+                data = obs_file.read()
+            AddBytes(len(data))
+            savedFields, version, values = marshal.loads(data)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        if savedFields != fields:
+            return None
+    CountCache(key, "hit" if fresh else "stale")
+    return values
+
+###############################################################################
+# Store new data for an entry, unless it's the same observation as the
+# saved data (same validators, with an observation time): then the saved
+# file is only marked as new, without writing or re-encoding it.
+#   saved : the entry's validators, if already read
+# Returns False if the data hadn't changed.
+
+def CacheRenew(key, data, ttl=None, validators=None, saved=None):
+    """Save a cache entry if its data changed"""
+
+    if validators and validators.get("stamp") is not None:
+        if saved is None:
+            saved = CacheValidators(key)
+        if validators == saved and CacheTouch(key):
+            return False
+    CachePut(key, data, ttl, validators)
+    return True
+
+###############################################################################
+# Refresh an entry, once for all processes.
+# Each entry has a lock file (<key>.lock) held by the process refreshing
+# it. Lock files are never removed: a process waiting on a removed file
+# wouldn't see the next holder.
+
+def entryModTime(key):
+    """Return the modification time of an entry's file, or None"""
+    try:
+        return os.path.getmtime(CachePath(key))
+    except OSError:
+        return None
+
+def AcquireRefresh(key, seen):
+    """Become the process refreshing an entry.
+      seen : the entry's modification time when it was found old (None if
+             it was missing)
+    Returns (lock file, result). Close the lock file after saving the new
+    data. The lock file is None if another process refreshed the entry
+    meanwhile ("coalesced"), or is still refreshing it after REFRESH_WAIT
+    ("timeout"). Otherwise result is "acquired", or "takeover" when the
+    process that had it gave up without new data."""
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(CACHE_DIR, key + ".lock"), "a")
+
+    start = time.monotonic()
+    contended = False
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            contended = True
+            if time.monotonic() - start >= REFRESH_WAIT:
+                lock_file.close()
+                CountRefreshLock(key, "timeout", time.monotonic() - start)
+                return None, "timeout"
+            time.sleep(REFRESH_POLL)
+
+    # The previous holder may have just saved new data
+    if entryModTime(key) != seen:
+        lock_file.close()
+        CountRefreshLock(key, "coalesced", time.monotonic() - start)
+        return None, "coalesced"
+
+    result = "takeover" if contended else "acquired"
+    CountRefreshLock(key, result, time.monotonic() - start)
+    return lock_file, result
+
+###############################################################################
+# Get new data for an entry and save it.
+#   fetch : function(validators) returning the new data. validators holds
+#           the saved entry's VALIDATORS, to make a conditional request
+#           with; fetch() updates it from the reply, or raises NotModified.
+#   stamp : function(data) returning the observation time in the data, or
+#           None if the data has none
+
+def RevalidateEntry(key, fetch, ttl=None, stamp=None):
+    """Get new data for an entry with fetch() and save it, unless another
+    process is doing the same: then its data (or the old data, if it takes
+    longer than REFRESH_WAIT) is used. If the quota or circuit breaker
+    doesn't allow a request, SavedDataUsed is raised with the old data.
+    Returns (data, unchanged): unchanged is True if the server's data was
+    the saved data, which was only marked as new; data is then None if
+    it wasn't read (use CacheGet(key, -1) if needed)."""
+
+    seen = entryModTime(key)
+    with Phase("refresh lock", key):
+        lock_file, result = AcquireRefresh(key, seen)
+
+    if lock_file is None:
+        data = CacheGet(key, -1)
+        if data is not None:
+            return data, False
+        # Nothing saved to fall back on
+
+    saved = CacheValidators(key) if seen is not None else {}
+    validators = dict(saved)
+    try:
+        try:
+            data = fetch(validators)
+        except NotModified:
+            if CacheTouch(key):
+                return None, True
+            # The saved data is gone: get it all again
+            validators = {}
+            data = fetch(validators)
+        except (weatherQuota.QuotaExceeded, weatherBreaker.CircuitOpen) as err:
+            data = CacheGet(key, -1)
+            if data is None:
+                raise
+            raise SavedDataUsed(err, data)
+
+        validators["stamp"] = stamp(data) if stamp is not None else None
+        changed = CacheRenew(key, data, ttl, validators, saved)
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+    return data, not changed
+
+def RefreshEntry(key, fetch, ttl=None, stamp=None, fallback=True):
+    """Like RevalidateEntry(), returning the data only. With fallback, the
+    old data is returned instead of raising SavedDataUsed."""
+
+    try:
+        data, unchanged = RevalidateEntry(key, fetch, ttl, stamp)
+    except SavedDataUsed as err:
+        if not fallback:
+            raise
+        return err.data
+    if data is None:
+        data = CacheGet(key, -1)
+    return data
+
+def EvictEntries(index, keep):
+    """Remove least recently used entries beyond MAX_ENTRIES/MAX_BYTES"""
+
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".json") or name == CACHE_INDEX:
+            continue
+        try:
+            st = os.stat(os.path.join(CACHE_DIR, name))
+        except OSError:
+            continue
+        entries.append((max(st.st_atime, st.st_mtime), st.st_size, name[:-len(".json")]))
+        total += st.st_size
+
+    # Oldest use first
+    entries.sort()
+    count = len(entries)
+    for used, size, key in entries:
+        if count <= MAX_ENTRIES and total <= MAX_BYTES:
+            break
+        if key == keep:
+            continue
+        for path in (CachePath(key), ObservationPath(key)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        index.pop(key, None)
+        count -= 1
+        total -= size
+
+    # Forget entries whose files are gone
+    for key in list(index):
+        if not os.path.exists(CachePath(key)):
+            del index[key]
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -23,9 +23,25 @@
 # SOFTWARE.
 ###############################################################################
 # Conversions for weather data
+#
+# Each conversion has a scalar form and a *_batch form for sequences
+# (forecasts, history). The batch forms use NumPy when it's installed and
+# return NumPy arrays; otherwise they return lists. Either way, every
+# element equals what the scalar form returns for it. NumPy is imported the
+# first time a batch form is used (see loadNumpy()), so runs that only show
+# current conditions don't pay for importing it.
 
+import time
 import datetime
 
+# NumPy, once loadNumpy() has imported it (None if it isn't installed)
+numpy = None
+numpyLoaded = False
+
+###############################################################################
+
+COMPASS_POINTS = ["N","NNE","NE","ENE","E","ESE", "SE", "SSE","S","SSW","SW","WSW","W","WNW","NW","NNW"]
+
 def hPa_to_inHg(hPa):
     """Convert from hectoPascals to inches of mercury"""
     return (float(hPa) * 0.02953)
@@ -34,6 +50,26 @@ def inHg_to_mmHg(inHg):
     """Convert from inches of mercury to millimeters of mercury"""
     return (float(inHg) * 25.4)
 
+def F_to_C(f):
+    """Convert from degrees Fahrenheit to degrees Celsius"""
+    return ((float(f) - 32.0) * 5.0 / 9.0)
+
+def C_to_F(c):
+    """Convert from degrees Celsius to degrees Fahrenheit"""
+    return (float(c) * 9.0 / 5.0 + 32.0)
+
+def mph_to_kph(mph):
+    """Convert from miles per hour to kilometers per hour"""
+    return (float(mph) * 1.609344)
+
+def mph_to_mps(mph):
+    """Convert from miles per hour to meters per second"""
+    return (float(mph) * 0.44704)
+
+def mm_to_in(mm):
+    """Convert from millimeters to inches"""
+    return (float(mm) / 25.4)
+
 def seconds_to_local(utc_time):
     """Convert time from UTC to local"""
     # Output YYYY-mm-dd HH:MM
@@ -46,9 +82,154 @@ def seconds_to_time(utc_time):
     dateTime = datetime.datetime.fromtimestamp(utc_time)
     return dateTime.strftime("%I:%M %p")
 
+def seconds_to_weekday(utc_time):
+    """Convert time from UTC to the local day of the week"""
+    # Output Mon
+    dateTime = datetime.datetime.fromtimestamp(utc_time)
+    return dateTime.strftime("%a")
+
 def degToCompass(num):
     val=int((num/22.5)+.5)
-    arr=["N","NNE","NE","ENE","E","ESE", "SE", "SSE","S","SSW","SW","WSW","W","WNW","NW","NNW"]
-    return arr[(val % 16)]
+    return COMPASS_POINTS[(val % 16)]
+
+###############################################################################
+# Import NumPy on first use. Modules using it outside this one call
+# loadNumpy() too, rather than importing the name.
+
+def loadNumpy():
+    """Return the numpy module, or None if it isn't installed"""
+
+    global numpy
+    global numpyLoaded
+
+    if not numpyLoaded:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+        numpyLoaded = True
+    return numpy
+
+###############################################################################
+# Batch conversions. "values" is any sequence of numbers (or a NumPy array).
+
+def asArray(values):
+    """Return values as a float64 NumPy array"""
+    return numpy.asarray(values, dtype=numpy.float64)
+
+def hPa_to_inHg_batch(values):
+    """Convert a sequence from hectoPascals to inches of mercury"""
+    if loadNumpy() is None:
+        return [hPa_to_inHg(v) for v in values]
+    return asArray(values) * 0.02953
+
+def inHg_to_mmHg_batch(values):
+    """Convert a sequence from inches of mercury to millimeters of mercury"""
+    if loadNumpy() is None:
+        return [inHg_to_mmHg(v) for v in values]
+    return asArray(values) * 25.4
+
+def F_to_C_batch(values):
+    """Convert a sequence from degrees Fahrenheit to degrees Celsius"""
+    if loadNumpy() is None:
+        return [F_to_C(v) for v in values]
+    return (asArray(values) - 32.0) * 5.0 / 9.0
+
+def C_to_F_batch(values):
+    """Convert a sequence from degrees Celsius to degrees Fahrenheit"""
+    if loadNumpy() is None:
+        return [C_to_F(v) for v in values]
+    return asArray(values) * 9.0 / 5.0 + 32.0
+
+def mph_to_kph_batch(values):
+    """Convert a sequence from miles per hour to kilometers per hour"""
+    if loadNumpy() is None:
+        return [mph_to_kph(v) for v in values]
+    return asArray(values) * 1.609344
+
+def mph_to_mps_batch(values):
+    """Convert a sequence from miles per hour to meters per second"""
+    if loadNumpy() is None:
+        return [mph_to_mps(v) for v in values]
+    return asArray(values) * 0.44704
+
+def mm_to_in_batch(values):
+    """Convert a sequence from millimeters to inches"""
+    if loadNumpy() is None:
+        return [mm_to_in(v) for v in values]
+    return asArray(values) / 25.4
+
+def degToCompass_batch(values):
+    """Convert a sequence of wind directions (degrees) to compass points"""
+    if loadNumpy() is None:
+        return [degToCompass(v) for v in values]
+    val = numpy.trunc(asArray(values) / 22.5 + .5).astype(numpy.int64)
+    return numpy.array(COMPASS_POINTS)[val % 16]
+
+###############################################################################
+# Batch time formatting, for integer Unix times.
+# Local time is found from the UTC offset, which is looked up once per UTC
+# day (and per element only on days when it changes, e.g. DST switches).
+# The "HH:MM AM" text is looked up in a table of every minute of the day.
+
+minuteTable = None
+weekdayTable = None
+
+def minutesOfDay():
+    """Table of "HH:MM AM/PM" text for every minute of the day"""
+
+    global minuteTable
+
+    if minuteTable is None:
+        minuteTable = numpy.array([time.strftime("%I:%M %p", (2000, 1, 1, m // 60, m % 60, 0, 5, 1, -1))
+                                   for m in range(24 * 60)])
+    return minuteTable
+
+def weekdays():
+    """Table of day-of-week names, Monday first"""
+
+    global weekdayTable
+
+    if weekdayTable is None:
+        weekdayTable = numpy.array([time.strftime("%a", (2024, 1, 1 + d, 0, 0, 0, d, 1 + d, -1))
+                                    for d in range(7)])
+    return weekdayTable
+
+def localSeconds(values):
+    """Return integer Unix times shifted to local time"""
+
+    utc = numpy.asarray(values).astype(numpy.int64)
+    days, index = numpy.unique(utc // 86400, return_inverse=True)
+    start = numpy.array([time.localtime(int(d) * 86400).tm_gmtoff for d in days], dtype=numpy.int64)
+    end = numpy.array([time.localtime(int(d) * 86400 + 86399).tm_gmtoff for d in days], dtype=numpy.int64)
+
+    offset = start[index]
+    for i in numpy.nonzero((start != end)[index])[0]:
+        offset[i] = time.localtime(int(utc[i])).tm_gmtoff
+    return utc + offset
+
+def seconds_to_time_batch(values):
+    """Convert a sequence of UTC Unix times to local HH:MM AM/PM text"""
+    if loadNumpy() is None:
+        return [seconds_to_time(v) for v in values]
+    local = localSeconds(values)
+    return minutesOfDay()[(local % 86400) // 60]
+
+def seconds_to_local_batch(values):
+    """Convert a sequence of UTC Unix times to local YYYY-mm-dd HH:MM AM/PM text"""
+    if loadNumpy() is None:
+        return [seconds_to_local(v) for v in values]
+    local = localSeconds(values)
+    dates = numpy.datetime_as_string((local // 86400).astype("datetime64[D]"))
+    return numpy.char.add(numpy.char.add(dates, " "), minutesOfDay()[(local % 86400) // 60])
+
+def seconds_to_weekday_batch(values):
+    """Convert a sequence of UTC Unix times to the local day of the week"""
+    if loadNumpy() is None:
+        return [seconds_to_weekday(v) for v in values]
+    local = localSeconds(values)
+    # 1970-01-01 was a Thursday
+    return weekdays()[(local // 86400 + 3) % 7]
 
 ###############################################################################
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Background refresh daemon (weather.py -D)
+#
+# Keeps the saved data file warm so that foreground invocations can always
+# use saved data instead of waiting on the network. The time between
+# refreshes adapts to:
+#   - how fast conditions are changing (temperature, pressure, condition)
+#   - the time of day (refresh less often overnight)
+#   - the remaining daily API call quota (shared with every other process,
+#     see weatherQuota)
+###############################################################################
+
+import os
+import sys
+import time
+import signal
+import datetime
+
+import weatherAstro
+import weatherQuota
+
+from weatherLocation import LAT, LON, ALT
+
+###############################################################################
+
+# PID file, used by foreground invocations to tell that the daemon is running
+DAEMON_PID_FILE = "/tmp/conweather_daemon.pid"
+
+# Limits on the time between refreshes, in seconds
+MIN_INTERVAL = (5.0 * 60.0)
+MAX_INTERVAL = (60.0 * 60.0)
+START_INTERVAL = (15.0 * 60.0)
+
+# Rates of change (per hour) considered significant
+TEMP_STEP = 2.0         # degrees
+PRESSURE_STEP = 1.0     # hPa
+
+# Refresh less often between these local hours
+NIGHT_START = 23
+NIGHT_END = 6
+NIGHT_FACTOR = 2.0
+
+# While the daemon runs, foreground invocations use saved data up to this
+# old (seconds) instead of refreshing it themselves.
+DAEMON_MAX_AGE = (MAX_INTERVAL * NIGHT_FACTOR * 2.0)
+
+###############################################################################
+# Check for a running daemon.
+
+def DaemonIsRunning():
+    """Check if the refresh daemon is running"""
+
+    try:
+        with open(DAEMON_PID_FILE) as pid_file:
+            pid = int(pid_file.read().strip())
+        # Signal 0 only checks that the process exists
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+###############################################################################
+# Score how fast conditions changed between two observations.
+# About 1.0 means a significant change per hour.
+
+def ChangeRate(prev, cur, elapsed):
+    """Rate of change of the weather between two refreshes"""
+
+    if prev is None:
+        return 0.0
+
+    hours = max(elapsed / 3600.0, 1.0 / 60.0)
+    rate = abs(float(cur.temp) - float(prev.temp)) / TEMP_STEP / hours
+    rate += abs(float(cur.hpa) - float(prev.hpa)) / PRESSURE_STEP / hours
+    if cur.weatherCode != prev.weatherCode:
+        rate += 1.0
+    return rate
+
+###############################################################################
+# Pick the time until the next refresh.
+#   interval  : previous adapted interval
+#   rate      : result of ChangeRate()
+#   now       : local datetime
+#   callsLeft : API calls left in today's quota (None if unlimited)
+#   perRefresh: API calls used by one refresh
+# Returns (adapted interval, seconds to sleep).
+
+def NextInterval(interval, rate, now, callsLeft=None, perRefresh=1):
+    """Compute the time until the next refresh"""
+
+    # Follow fast changes closely, back off while conditions are stable
+    if rate >= 1.0:
+        interval *= 0.5
+    elif rate < 0.25:
+        interval *= 1.5
+    interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+    delay = interval
+    if now.hour >= NIGHT_START or now.hour < NIGHT_END:
+        delay = min(delay * NIGHT_FACTOR, MAX_INTERVAL * NIGHT_FACTOR)
+
+    # Spread the remaining quota over the rest of the day
+    if callsLeft is not None:
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        secondsLeft = (midnight - now).total_seconds()
+        refreshesLeft = callsLeft // max(perRefresh, 1)
+        if refreshesLeft <= 0:
+            delay = max(delay, secondsLeft)
+        else:
+            delay = max(delay, secondsLeft / refreshesLeft)
+
+    return interval, delay
+
+###############################################################################
+# Refresh the saved data forever.
+#   refresh    : provider GetWeatherInfo
+#   extract    : provider ExtractWeatherData
+#   dailyLimit : provider daily API call limit (None if unlimited)
+#   onRefresh  : called with the new observation after each refresh
+#   provider   : provider name; if its limit is registered in weatherQuota,
+#                the calls made by every process count against the limit
+#   onRenew    : called with the previous observation instead, when a
+#                refresh finds the data unchanged
+
+def RunDaemon(refresh, extract, dailyLimit=None, DEBUG=False, onRefresh=None, provider=None, onRenew=None):
+    """Keep the saved weather data fresh"""
+
+    # Only the daemon needs HTTP; weather.py imports this module on every run
+    import weatherHTTP
+
+    if DaemonIsRunning():
+        print("Refresh daemon is already running (see " + DAEMON_PID_FILE + ")")
+        return
+
+    with open(DAEMON_PID_FILE, "w") as pid_file:
+        pid_file.write(str(os.getpid()) + "\n")
+
+    # Make sure the PID file is removed when stopped with kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    interval = START_INTERVAL
+    prev = None
+    prevTime = 0.0
+    day = None
+    callsToday = 0
+    try:
+        while True:
+            now = datetime.datetime.now()
+            if now.date() != day:
+                day = now.date()
+                callsToday = 0
+                # Precompute this year's sun/moon times (takes about a second)
+                if weatherAstro.USE_YEAR_TABLES:
+                    weatherAstro.EnsureYearTable(LAT, LON, ALT, day.year)
+
+            rate = 0.0
+            perRefresh = 1
+            callsBefore = weatherHTTP.GetStats()["requests"]
+            try:
+                if refresh(False, DEBUG) and prev is not None:
+                    # Same data: the previous observation still holds
+                    cur = prev
+                    if onRenew is not None:
+                        onRenew(cur)
+                else:
+                    cur = extract()
+                    if onRefresh is not None:
+                        onRefresh(cur)
+                rate = ChangeRate(prev, cur, time.monotonic() - prevTime)
+                prev = cur
+                prevTime = time.monotonic()
+            except Exception as err:
+                # Try again soon, but don't hammer a failing server
+                print(str(now) + " Refresh failed: " + str(err), file=sys.stderr)
+                interval = MIN_INTERVAL
+                rate = 1.0
+            finally:
+                perRefresh = max(weatherHTTP.GetStats()["requests"] - callsBefore, 1)
+                callsToday += perRefresh
+
+            callsLeft = None
+            if dailyLimit is not None:
+                if provider in weatherQuota.limits:
+                    callsLeft = weatherQuota.CallsLeft(provider)
+                    callsToday = weatherQuota.CallsToday(provider)
+                else:
+                    callsLeft = max(dailyLimit - callsToday, 0)
+            interval, delay = NextInterval(interval, rate, now, callsLeft, perRefresh)
+
+            if DEBUG: # @DEBUG
+                print("{t} rate={r:.2f} calls={c} next refresh in {d:.0f}s".format(
+                    t=now.strftime("%F %T"), r=rate, c=callsToday, d=delay))
+
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            os.unlink(DAEMON_PID_FILE)
+        except OSError:
+            pass
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
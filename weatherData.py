@@ -23,6 +23,10 @@
 # SOFTWARE.
 ###############################################################################
 # Module defining common weather data to extract from a weather source
+#
+# Extraction produces a WeatherObservation. The module-level items below
+# are kept as a compatibility shim: they hold the most recently extracted
+# observation for the current location (see publish()).
 
 from weatherLocation import *
 
@@ -43,6 +47,7 @@ humidity = 0
 uvi = 0.0
 clouds = 0
 speed = 0.0
+dir = None      # Wind direction, in degrees
 direction = ""
 weather = ""
 weatherCode = 0
@@ -53,6 +58,76 @@ phase = None
 icon = ""
 isDay = True
 
+# Set when showing saved data that's older than the refresh time
+stale = False
+# Set when showing saved data because the weather service is failing
+degraded = False
+
+# Names of the extracted items above
+FIELDS = ("city", "dt", "localtime", "lastupdate", "sunr", "sunrise", "suns", "sunset",
+          "temp", "hpa", "inHg", "mmHg", "humidity", "uvi", "clouds", "speed", "dir", "direction",
+          "weather", "weatherCode", "precip", "moonrise", "moonset", "phase", "icon", "isDay",
+          "stale", "degraded")
+
+# Initial values of the extracted items
+DEFAULTS = tuple(globals()[name] for name in FIELDS)
+
+###############################################################################
+# One weather observation, holding the items above as attributes.
+# Slots keep it small; toTuple()/fromTuple() are the cheapest way to store
+# and load it (e.g. with marshal or pickle).
+
+class WeatherObservation:
+    """Weather data extracted from a weather source"""
+
+    __slots__ = FIELDS
+
+    def __init__(self, **items):
+        for name, value in zip(FIELDS, DEFAULTS):
+            setattr(self, name, value)
+        for name, value in items.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "WeatherObservation(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in FIELDS) + ")"
+
+    def toTuple(self):
+        """Return the items as a tuple, in FIELDS order"""
+        return tuple(getattr(self, name) for name in FIELDS)
+
+    @classmethod
+    def fromTuple(cls, values):
+        """Create an observation from a tuple made by toTuple()"""
+        obs = cls.__new__(cls)
+        for name, value in zip(FIELDS, values):
+            setattr(obs, name, value)
+        return obs
+
+    def toDict(self):
+        """Return the items as a dictionary"""
+        return {name: getattr(self, name) for name in FIELDS}
+
+    @classmethod
+    def fromDict(cls, items):
+        """Create an observation from a dictionary (missing items get their defaults)"""
+        return cls(**{name: items[name] for name in FIELDS if name in items})
+
+###############################################################################
+# Compatibility shim: copy an observation to/from the module-level items.
+
+def publish(obs):
+    """Set the module-level items from an observation"""
+
+    module = globals()
+    for name in FIELDS:
+        module[name] = getattr(obs, name)
+
+def current():
+    """Return the module-level items as an observation"""
+
+    module = globals()
+    return WeatherObservation.fromTuple(tuple(module[name] for name in FIELDS))
+
 # For debugging, print a few parameters
 def printWeatherData():
     print("City: " + city)
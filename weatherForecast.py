@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Hourly and daily forecasts
+#
+# A Forecast holds its hours and days as columns: one array per item (time,
+# temperature, ...) instead of one dictionary per hour. Conversions and
+# statistics then work on a whole column at once (see the *_batch functions
+# in weatherConversions). Columns are NumPy arrays when NumPy is installed,
+# otherwise lists. Missing numbers are NaN.
+###############################################################################
+
+import math
+
+from weatherConversions import *
+
+###############################################################################
+
+# Forecast horizon
+HOURS = 48  # Hourly forecast, in hours
+DAYS = 8    # Daily forecast, in days
+
+# How long saved forecast data stays fresh, in seconds. Providers update
+# their forecasts about once an hour.
+FORECAST_TTL = 60 * 60
+
+# Hourly and daily columns. weather and icon hold text; the others numbers.
+#   dt          : Unix time of the hour, or of midday (UTC)
+#   temp        : temperature (F)
+#   tempMin/Max : lowest/highest temperature of the day (F)
+#   humidity    : relative humidity (%)
+#   hpa         : pressure (hPa)
+#   speed       : wind speed (mph)
+#   dir         : wind direction (degrees)
+#   pop         : chance of precipitation (%)
+#   precip      : precipitation (inches)
+#   weatherCode : provider's condition code
+#   isDay       : 1 in daylight, 0 at night
+HOURLY_COLUMNS = ("dt", "temp", "humidity", "hpa", "speed", "dir", "pop", "precip",
+                  "weatherCode", "isDay", "weather", "icon")
+DAILY_COLUMNS = ("dt", "tempMin", "tempMax", "humidity", "hpa", "speed", "dir", "pop", "precip",
+                 "weatherCode", "weather", "icon")
+TEXT_COLUMNS = ("weather", "icon")
+
+###############################################################################
+# Make columns from lists of values.
+
+def column(values):
+    """Return a number column (missing values become NaN)"""
+    numpy = loadNumpy()
+    if numpy is None:
+        return [math.nan if v is None else float(v) for v in values]
+    return numpy.array([math.nan if v is None else v for v in values], dtype=numpy.float64)
+
+def textColumn(values):
+    """Return a text column"""
+    numpy = loadNumpy()
+    if numpy is None:
+        return list(values)
+    return numpy.array(values, dtype=str)
+
+def MapCodes(codes, isDay, lookup):
+    """Look up a value (e.g. an icon) for each condition code, once per
+    distinct (code, isDay) pair"""
+
+    found = {}
+    values = []
+    for key in zip(codes, isDay):
+        if key not in found:
+            found[key] = lookup(key[0], bool(key[1]))
+        values.append(found[key])
+    return values
+
+###############################################################################
+# Forecast for one location.
+
+class Forecast:
+    """Hourly and daily forecast, stored as columns"""
+
+    __slots__ = ("city", "hourly", "daily")
+
+    def __init__(self, city=None):
+        self.city = city
+        self.hourly = {name: column([]) for name in HOURLY_COLUMNS}
+        self.daily = {name: column([]) for name in DAILY_COLUMNS}
+
+    def setHourly(self, **columns):
+        """Set hourly columns from lists of values"""
+        for name, values in columns.items():
+            self.hourly[name] = textColumn(values) if name in TEXT_COLUMNS else column(values)
+
+    def setDaily(self, **columns):
+        """Set daily columns from lists of values"""
+        for name, values in columns.items():
+            self.daily[name] = textColumn(values) if name in TEXT_COLUMNS else column(values)
+
+    def hours(self):
+        """Number of forecast hours"""
+        return len(self.hourly["dt"])
+
+    def days(self):
+        """Number of forecast days"""
+        return len(self.daily["dt"])
+
+###############################################################################
+# Column helpers that work with or without NumPy.
+
+def every(values, step):
+    """Every step'th item of a column"""
+    return values[::step]
+
+def present(values):
+    """The items of a number column that aren't NaN"""
+    numpy = loadNumpy()
+    if numpy is None:
+        return [v for v in values if not math.isnan(v)]
+    return values[~numpy.isnan(values)]
+
+def largest(values):
+    """Index of the largest item of a number column that isn't NaN, or
+    None if there's none"""
+    numpy = loadNumpy()
+    if numpy is None:
+        indexes = [i for i, v in enumerate(values) if not math.isnan(v)]
+        return max(indexes, key=lambda i: values[i]) if indexes else None
+    if numpy.isnan(values).all():
+        return None
+    return int(numpy.nanargmax(values))
+
+def compass(values):
+    """Compass points for a column of directions ("" where missing)"""
+    numpy = loadNumpy()
+    if numpy is None:
+        return ["" if math.isnan(v) else degToCompass(v) for v in values]
+    missing = numpy.isnan(values)
+    points = degToCompass_batch(numpy.where(missing, 0.0, values))
+    return numpy.where(missing, "", points)
+
+###############################################################################
+# Statistics over the whole hourly forecast.
+# Returns a dictionary, or None if there are no hours:
+#   tempMin, tempMax, tempMean : temperature range and mean (F)
+#   freezingHours              : hours at or below 32F
+#   popMax, popMaxTime         : highest chance of precipitation, and when
+#   precipTotal                : total precipitation (inches)
+#   speedMax, speedMaxDir      : strongest wind (mph) and its compass point
+#   pressureTrend              : pressure change over the forecast (inHg)
+# Statistics of an item that's missing from every hour are None.
+
+def ForecastStats(fc):
+    """Return statistics over the hourly forecast"""
+
+    hourly = fc.hourly
+    if fc.hours() == 0:
+        return None
+
+    temp = present(hourly["temp"])
+    hpa = present(hourly["hpa"])
+    stats = dict.fromkeys(("tempMin", "tempMax", "tempMean", "popMax", "popMaxTime", "speedMax", "speedMaxDir"))
+
+    numpy = loadNumpy()
+    if numpy is None:
+        stats["freezingHours"] = sum(1 for t in temp if t <= 32.0)
+        stats["precipTotal"] = sum(present(hourly["precip"]))
+        if temp:
+            stats["tempMin"] = min(temp)
+            stats["tempMax"] = max(temp)
+            stats["tempMean"] = sum(temp) / len(temp)
+    else:
+        stats["freezingHours"] = int(numpy.count_nonzero(temp <= 32.0))
+        stats["precipTotal"] = float(present(hourly["precip"]).sum())
+        if len(temp):
+            stats["tempMin"] = float(temp.min())
+            stats["tempMax"] = float(temp.max())
+            stats["tempMean"] = float(temp.mean())
+
+    popMax = largest(hourly["pop"])
+    if popMax is not None:
+        stats["popMax"] = float(hourly["pop"][popMax])
+        stats["popMaxTime"] = int(hourly["dt"][popMax])
+    speedMax = largest(hourly["speed"])
+    if speedMax is not None:
+        stats["speedMax"] = float(hourly["speed"][speedMax])
+        stats["speedMaxDir"] = str(compass(hourly["dir"][speedMax:speedMax + 1])[0])
+    stats["pressureTrend"] = 0.0
+    if len(hpa) > 1:
+        inHg = hPa_to_inHg_batch([hpa[0], hpa[-1]])
+        stats["pressureTrend"] = float(inHg[1] - inHg[0])
+
+    return stats
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Shared HTTP transport for the weather service modules
+#
+# All requests go through one pooled session, so connections (and their
+# TLS handshakes) are reused by later requests in the same process: the
+# WeatherAPI current + astronomy pair, multi-location sweeps and any
+# long-running mode. Every request has connect/read deadlines, asks for a
+# compressed response, and the bytes received are counted. Requests to a
+# service are counted against its quota first (weatherQuota), and their
+# response times are recorded for hedging (weatherHedge); the reply to a
+# hedged request that lost is dropped (RequestAbandoned). Error replies raise
+# ServiceError, and failures are counted by the service's circuit breaker
+# (weatherBreaker), which stops requests to a failing service for a while.
+# Given the ETag or Last-Modified time of saved data, a request is made
+# conditional, and a "304 Not Modified" reply raises NotModified.
+###############################################################################
+
+import json
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from weatherTimings import Phase, AddBytes
+from weatherMetrics import ObserveFetch
+from weatherQuota import Spend
+from weatherHedge import RecordLatency, Abandoned, KeepReply, RequestAbandoned
+from weatherBreaker import Allow, RecordSuccess, RecordFailure
+from weatherCache import NotModified
+
+###############################################################################
+
+# Seconds allowed to open a connection, and to wait for data once connected.
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10.0
+
+# Maximum number of pooled connections per host. This should be at least
+# the number of concurrent requests (see MAX_WORKERS in weatherMulti.py).
+POOL_SIZE = 16
+
+HEADERS = {
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "conWeather",
+}
+
+# Transfer statistics for this process
+requestCount = 0
+bytesReceived = 0   # Response bodies, as received (i.e. compressed)
+bytesDecoded = 0    # Response bodies, after decompression
+
+session = None
+lock = threading.Lock()
+
+###############################################################################
+
+class ServiceError(Exception):
+    """A service replied with an error"""
+
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+###############################################################################
+# Get the message of an error reply, as sent by the services:
+#   OpenWeatherMap : {"cod": 401, "message": "..."}
+#   WeatherAPI     : {"error": {"code": 1006, "message": "..."}}
+#   Open-Meteo     : {"error": true, "reason": "..."}
+# Returns None if the data isn't an error reply.
+
+def errorMessage(data):
+    """Return the message of an error reply, or None"""
+
+    if not isinstance(data, dict):
+        return None
+    error = data.get("error")
+    if isinstance(error, dict):
+        return str(error.get("message", error))
+    if error:
+        return str(data.get("reason", error))
+    if "cod" in data and str(data["cod"]) != "200":
+        return str(data.get("message", data["cod"]))
+    return None
+
+###############################################################################
+# Request headers asking for a reply only if the data changed, and the
+# validators of a reply (see weatherCache.VALIDATORS).
+
+def conditionalHeaders(validators):
+    """Return the headers of a conditional request"""
+
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified"):
+            headers["If-Modified-Since"] = validators["modified"]
+    return headers
+
+def updateValidators(validators, response):
+    """Save the ETag and Last-Modified headers of a reply"""
+
+    for name, header in (("etag", "ETag"), ("modified", "Last-Modified")):
+        value = response.headers.get(header)
+        if value:
+            validators[name] = value
+        else:
+            validators.pop(name, None)
+
+###############################################################################
+# Get the shared session, creating it on first use.
+
+def GetSession():
+    """Return the pooled HTTP session"""
+
+    global session
+
+    with lock:
+        if session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return session
+
+###############################################################################
+# Requests not made for a service are counted as "other", under the last
+# part of the URL's path.
+
+def defaultSource(url):
+    return ("other", url.split("?", 1)[0].rsplit("/", 1)[-1])
+
+###############################################################################
+# Issue a GET request.
+#   timeout : (connect, read) seconds, defaults to CONNECT_TIMEOUT/READ_TIMEOUT
+#   source  : (provider, endpoint) the request is counted under in the
+#             metrics (weatherMetrics), the quota (weatherQuota) and the
+#             circuit breaker (weatherBreaker)
+#   validators : the saved data's validators, to make a conditional request
+#                (the reply's status is then 304 if the data hasn't changed)
+# Raises requests.RequestException (e.g. requests.Timeout) on failure,
+# ServiceError on an error reply (HTTP status 400 and up), and
+# weatherBreaker.CircuitOpen or weatherQuota.QuotaExceeded if no request
+# should be made to the provider, and weatherHedge.RequestAbandoned if it's
+# a hedged request that lost (see HedgedFetch). Failures are counted by the
+# circuit breaker; a success isn't, until the caller has checked the reply
+# (see HttpGetJSON).
+
+def HttpGet(url, timeout=None, source=None, validators=None):
+    """GET a URL using the shared session"""
+
+    global requestCount
+    global bytesReceived
+    global bytesDecoded
+
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    if source is None:
+        source = defaultSource(url)
+
+    if Abandoned():
+        raise RequestAbandoned(url)
+
+    with Phase("quota", source[0]):
+        Allow(source[0])
+        Spend(source[0])
+
+    with Phase("http", url):
+        start = time.monotonic()
+        try:
+            response = GetSession().get(url, timeout=timeout, headers=conditionalHeaders(validators))
+        except Exception as err:
+            seconds = time.monotonic() - start
+            ObserveFetch(source, seconds, None)
+            RecordLatency(source[0], seconds)
+            if not KeepReply():
+                raise RequestAbandoned(url) from err
+            RecordFailure(source[0], err)
+            raise
+        seconds = time.monotonic() - start
+        ObserveFetch(source, seconds, response.status_code)
+        RecordLatency(source[0], seconds)
+        if not KeepReply():
+            response.close()
+            raise RequestAbandoned(url)
+
+        decoded = len(response.content)
+        received = decoded
+        # urllib3 counts the bytes read from the connection, before decoding
+        raw = getattr(response, "raw", None)
+        if raw is not None and hasattr(raw, "tell"):
+            try:
+                received = raw.tell() or decoded
+            except (OSError, ValueError):
+                pass
+        AddBytes(received)
+
+    with lock:
+        requestCount += 1
+        bytesReceived += received
+        bytesDecoded += decoded
+
+    if response.status_code >= 400:
+        try:
+            message = errorMessage(json.loads(response.text))
+        except ValueError:
+            message = None
+        err = ServiceError("{p}: HTTP {s}: {m}".format(p=source[0], s=response.status_code,
+                                                      m=message or response.reason), response.status_code)
+        RecordFailure(source[0], err, response.status_code)
+        raise err
+
+    return response
+
+def HttpGetJSON(url, timeout=None, source=None, validators=None):
+    """GET a URL and return the JSON data received.
+    validators are updated from the reply, or NotModified is raised.
+    Raises ServiceError if it isn't JSON, or is an error reply."""
+
+    if source is None:
+        source = defaultSource(url)
+
+    response = HttpGet(url, timeout, source, validators)
+    if response.status_code == 304:
+        RecordSuccess(source[0])
+        raise NotModified(url)
+    if validators is not None:
+        updateValidators(validators, response)
+
+    with Phase("json"):
+        try:
+            data = json.loads(response.text)
+        except ValueError as err:
+            err = ServiceError("{p}: invalid JSON reply: {e}".format(p=source[0], e=err), response.status_code)
+            RecordFailure(source[0], err)
+            raise err
+
+    message = errorMessage(data)
+    if message is not None:
+        err = ServiceError(source[0] + ": " + message, response.status_code)
+        RecordFailure(source[0], err)
+        raise err
+
+    RecordSuccess(source[0])
+    return data
+
+###############################################################################
+# Get the transfer statistics for this process.
+
+def GetStats():
+    """Return the number of requests and bytes transferred"""
+
+    with lock:
+        return {"requests": requestCount, "received": bytesReceived, "decoded": bytesDecoded}
+
+def printStats():
+    """Print the transfer statistics (for debugging)"""
+
+    stats = GetStats()
+    print("HTTP: {r} request(s), {b} bytes received ({d} bytes decoded)".format(
+        r=stats["requests"], b=stats["received"], d=stats["decoded"]))
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Hedged requests (weather.py -a NAME)
+#
+# The services return the same core items, so when the selected service is
+# slow the other one can answer instead. HedgedFetch() asks the primary
+# service; if it hasn't answered within its usual (95th percentile)
+# response time, it also asks the alternate, and uses whichever answers
+# first. The other request is abandoned: it runs on in a daemon thread,
+# but once the answer is used its reply is dropped (RequestAbandoned), so
+# it doesn't save any data or count for the service's circuit breaker. If
+# it already got its reply, HedgedFetch() waits until it's saved. A
+# primary service whose circuit breaker is open (weatherBreaker) isn't
+# asked at all.
+#
+# While hedging, the response times of the requests are kept per service in
+# LATENCY_FILE, shared by all processes, so the hedge delay follows each
+# service's recent behavior. They're saved once, when the process ends
+# (SaveLatencies).
+###############################################################################
+
+import os
+import json
+import math
+import fcntl
+import queue
+import threading
+
+import weatherBreaker
+from weatherCache import WriteCacheFile
+
+###############################################################################
+
+# Response time file, and its lock file
+LATENCY_DIR = "/tmp/conweather"
+LATENCY_FILE = os.path.join(LATENCY_DIR, "latency.json")
+LATENCY_LOCK = os.path.join(LATENCY_DIR, "latency.lock")
+
+# Response times kept per service (the most recent ones)
+SAMPLES = 64
+
+# Percentile of the response times to wait before asking the alternate
+HEDGE_PERCENTILE = 95
+
+# Hedge delay (seconds) until there are MIN_SAMPLES response times, and its
+# limits
+DEFAULT_DELAY = 0.5
+MIN_SAMPLES = 5
+MIN_DELAY = 0.05
+MAX_DELAY = 3.0
+
+# Response times of this process, not saved yet: provider -> [seconds, ...]
+recorded = {}
+recording = False
+lock = threading.Lock()
+
+# The hedged request of the current thread, if any
+current = threading.local()
+
+###############################################################################
+
+class RequestAbandoned(Exception):
+    """The reply to a hedged request came after the other service's"""
+
+###############################################################################
+# Response times. They're only recorded when hedging (EnableRecording).
+
+def readLatencies():
+    """Read the saved response times: provider -> [seconds, ...]"""
+
+    try:
+        with open(LATENCY_FILE) as latency_file:
+            return json.load(latency_file)
+    except (OSError, ValueError):
+        return {}
+
+def EnableRecording():
+    """Start recording response times"""
+
+    global recording
+
+    recording = True
+
+def RecordLatency(provider, seconds):
+    """Record the response time of a request to a service"""
+
+    if recording:
+        with lock:
+            recorded.setdefault(provider, []).append(round(seconds, 4))
+
+def SaveLatencies():
+    """Add the recorded response times to the saved ones"""
+
+    with lock:
+        if not recorded:
+            return
+        try:
+            os.makedirs(LATENCY_DIR, exist_ok=True)
+            with open(LATENCY_LOCK, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                latencies = readLatencies()
+                for provider, samples in recorded.items():
+                    latencies[provider] = (latencies.get(provider, []) + samples)[-SAMPLES:]
+                # Only used to tune hedging: not worth flushing to disk
+                WriteCacheFile(LATENCY_FILE, json.dumps(latencies), sync=False)
+            recorded.clear()
+        except OSError:
+            # Only used to tune hedging: never fail a request over it
+            pass
+
+def HedgeDelay(provider):
+    """Time to wait for a service before asking the alternate, in seconds"""
+
+    with lock:
+        samples = readLatencies().get(provider, []) + recorded.get(provider, [])
+    samples = sorted(samples[-SAMPLES:])
+    if len(samples) < MIN_SAMPLES:
+        return DEFAULT_DELAY
+    index = max(int(math.ceil(len(samples) * HEDGE_PERCENTILE / 100.0)) - 1, 0)
+    return min(max(samples[index], MIN_DELAY), MAX_DELAY)
+
+###############################################################################
+# Abandoning the request that lost. HttpGet() checks Abandoned() before
+# making a request, and KeepReply() once the request is done: from then on
+# the reply is kept, and abandon() waits until its thread is done with it.
+
+class hedgedRequest:
+    """A request of HedgedFetch(), to one service"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.abandoned = False
+        self.kept = False
+
+def Abandoned():
+    """Return True if the current thread's hedged request was abandoned"""
+
+    request = getattr(current, "request", None)
+    return request is not None and request.abandoned
+
+def KeepReply():
+    """Keep the reply to the current thread's request, unless it was
+    abandoned. Returns False if the reply must be dropped."""
+
+    request = getattr(current, "request", None)
+    if request is None or request.kept:
+        return True
+    request.lock.acquire()
+    if request.abandoned:
+        request.lock.release()
+        return False
+    request.kept = True
+    return True
+
+def abandon(request):
+    """Drop the reply to a request, or wait until it's saved"""
+
+    with request.lock:
+        request.abandoned = True
+
+###############################################################################
+# Get the weather for a location (an entry like those of LOCATIONS) from the
+# first of two services to answer.
+#   primary, alternate : service modules (see weatherProviders)
+# Returns (module that answered, WeatherObservation). If both fail, the
+# last error is raised.
+
+def HedgedFetch(primary, alternate, location, DEBUG=False, useSaved=True):
+    """Get weather info from the primary service, or the alternate if it's faster"""
+
+    answers = queue.Queue()
+    requests = {}
+
+    def ask(module, request):
+        current.request = request
+        try:
+            obs = module.ExtractLocationWeather(module.FetchLocationWeather(location, DEBUG, useSaved), location)
+            if obs.city is None:
+                obs.city = location["name"]
+            answers.put((module, obs, None))
+        except Exception as err:
+            answers.put((module, None, err))
+        finally:
+            if request.kept:
+                request.lock.release()
+
+    def start(module):
+        requests[module] = hedgedRequest()
+        threading.Thread(target=ask, args=(module, requests[module]), daemon=True).start()
+
+    def answer(module, obs):
+        # The other request's reply isn't used
+        for other, request in requests.items():
+            if other is not module:
+                abandon(request)
+        return module, obs
+
+    if weatherBreaker.IsOpen(primary.PROVIDER) and not weatherBreaker.IsOpen(alternate.PROVIDER):
+        # Don't wait on a service that keeps failing
+        primary, alternate = alternate, None
+
+    start(primary)
+    waiting = 1
+    if alternate is not None:
+        delay = HedgeDelay(primary.PROVIDER)
+        try:
+            module, obs, err = answers.get(timeout=delay)
+            if err is None:
+                return answer(module, obs)
+            waiting = 0
+        except queue.Empty:
+            pass
+
+        if DEBUG: # @DEBUG
+            print("Hedge: no answer from {p} after {d:.3f}s, asking {a}".format(
+                p=primary.PROVIDER, d=delay, a=alternate.PROVIDER))
+        start(alternate)
+        waiting += 1
+
+    while waiting > 0:
+        module, obs, err = answers.get()
+        waiting -= 1
+        if err is None:
+            return answer(module, obs)
+    raise err
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Observation history (opt-in)
+#
+# Each refreshed observation is appended to a binary file as a fixed-width
+# record, one directory per location and one file per month (UTC), e.g.
+#   HISTORY_DIR/42.5048_-71.1956/2024-10.bin
+# Records are kept in time order, so a time range is found by binary
+# search over the memory-mapped file, and the records are unpacked
+# straight from it with no JSON parsing. A year of 5-minute observations
+# takes under 4 MB per location.
+###############################################################################
+
+import os
+import mmap
+import math
+import fcntl
+import struct
+import datetime
+
+###############################################################################
+
+# Record observations (also enabled by weather.py -H)
+HISTORY_ENABLED = False
+
+# Directory holding the history files
+HISTORY_DIR = os.path.expanduser("~/.local/share/conweather/history")
+
+# Record layout (little-endian, 36 bytes):
+#   dt          int64   Unix time of the observation
+#   temp        float32
+#   hpa         float32
+#   humidity    uint8   percent
+#   clouds      uint8   percent
+#   speed       float32
+#   dir         int16   wind direction in degrees, -1 if unknown
+#   uvi         float32
+#   precip      float32 NaN if unknown
+#   weatherCode uint16  0xFFFF if unknown
+#   isDay       uint8
+RECORD = struct.Struct("<qffBBfhffHBx")
+RECORD_FIELDS = ("dt", "temp", "hpa", "humidity", "clouds", "speed", "dir",
+                 "uvi", "precip", "weatherCode", "isDay")
+
+###############################################################################
+# History file names.
+
+def locationDir(lat, lon):
+    """Return the directory holding a location's history"""
+    return os.path.join(HISTORY_DIR, "{lat:.4f}_{lon:.4f}".format(lat=float(lat), lon=float(lon)))
+
+def monthFile(lat, lon, dt):
+    """Return the history file for the month containing a Unix time"""
+    month = datetime.datetime.fromtimestamp(dt, datetime.timezone.utc).strftime("%Y-%m")
+    return os.path.join(locationDir(lat, lon), month + ".bin")
+
+###############################################################################
+# Pack an observation into a record.
+
+def toNumber(value, missing):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return missing
+
+def PackObservation(obs):
+    """Pack a WeatherObservation into a history record"""
+
+    direction = toNumber(obs.dir, -1.0)
+    return RECORD.pack(
+        int(obs.dt),
+        toNumber(obs.temp, math.nan),
+        toNumber(obs.hpa, math.nan),
+        min(max(int(toNumber(obs.humidity, 0)), 0), 255),
+        min(max(int(toNumber(obs.clouds, 0)), 0), 255),
+        toNumber(obs.speed, math.nan),
+        int(round(direction)) % 360 if direction >= 0 else -1,
+        toNumber(obs.uvi, math.nan),
+        toNumber(obs.precip, math.nan),
+        int(toNumber(obs.weatherCode, 0xFFFF)) & 0xFFFF,
+        1 if obs.isDay else 0)
+
+###############################################################################
+# Append an observation to a location's history.
+# Observations that aren't newer than the last one recorded (e.g. the same
+# saved data seen again) are skipped. Returns True if appended.
+
+def AppendObservation(obs, lat, lon):
+    """Append an observation to the history"""
+
+    if not obs.dt:
+        return False
+
+    path = monthFile(lat, lon, obs.dt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "a+b") as history_file:
+        # Several processes may refresh at once (e.g. -m and the daemon):
+        # check the last record and append under the same lock
+        fcntl.flock(history_file, fcntl.LOCK_EX)
+        size = history_file.seek(0, os.SEEK_END)
+        # Drop any partial record left by an interrupted write
+        size -= size % RECORD.size
+        if size:
+            history_file.seek(size - RECORD.size)
+            last = RECORD.unpack(history_file.read(RECORD.size))
+            if obs.dt <= last[0]:
+                return False
+        history_file.truncate(size)
+        history_file.seek(size)
+        history_file.write(PackObservation(obs))
+    return True
+
+###############################################################################
+# Read records in a time range.
+
+def findRecord(buf, count, dt):
+    """Index of the first record at or after a Unix time (binary search)"""
+
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if struct.unpack_from("<q", buf, mid * RECORD.size)[0] < dt:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def monthsBetween(start, end):
+    """Yield a Unix time in every UTC month from start to end"""
+
+    day = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0)
+    last = datetime.datetime.fromtimestamp(end, datetime.timezone.utc)
+    while day <= last:
+        yield day.timestamp()
+        day = (day + datetime.timedelta(days=32)).replace(day=1)
+
+def ReadHistory(lat, lon, start, end):
+    """Yield history records (tuples in RECORD_FIELDS order) with start <= dt < end"""
+
+    for month in monthsBetween(start, end):
+        path = monthFile(lat, lon, month)
+        try:
+            history_file = open(path, "rb")
+        except OSError:
+            continue
+        with history_file:
+            size = os.fstat(history_file.fileno()).st_size
+            count = size // RECORD.size
+            if count == 0:
+                continue
+            with mmap.mmap(history_file.fileno(), count * RECORD.size, access=mmap.ACCESS_READ) as buf:
+                first = findRecord(buf, count, start)
+                stop = findRecord(buf, count, end)
+                if first < stop:
+                    view = memoryview(buf)
+                    try:
+                        yield from RECORD.iter_unpack(view[first * RECORD.size:stop * RECORD.size])
+                    finally:
+                        view.release()
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
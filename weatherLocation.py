@@ -32,6 +32,13 @@ LON="-71.19561000"
 ZIP="01803"
 ALT="46" # altitude, in meters
 
+# Locations used in multi-location mode (weather.py -m).
+# Each entry holds the same items as above, for one site.
+LOCATIONS = [
+    {"name": LOCN, "lat": LAT, "lon": LON, "zip": ZIP, "alt": ALT},
+    # {"name": "Boston", "lat": "42.36008000", "lon": "-71.05888000", "zip": "02108", "alt": "43"},
+]
+
 ###############################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# OpenMetrics (Prometheus) exporter (weather.py -E PORT)
+#
+# The exporter runs with the refresh daemon and serves, at
+# http://METRICS_ADDRESS:PORT/metrics:
+#   - fetch latency histograms and error counts, per provider and endpoint
+#   - saved data (cache) lookups: hits, misses and stale data served
+#   - refresh lock contention: refreshes coalesced with another process's,
+#     and the time spent waiting
+#   - requests made today, and each provider's daily limit
+#   - the latest observation: temperature, humidity, pressure, wind
+#
+# Other processes (foreground weather.py runs, the weatherPrompt.py fast
+# path) record the same events and, while an exporter is running, append
+# them to SPOOL_FILE when they finish. The exporter adds them up when it's
+# scraped, so the counts cover every invocation on the host.
+###############################################################################
+
+import os
+import datetime
+import threading
+
+###############################################################################
+
+# This process is the exporter (set by StartExporter())
+ENABLED = False
+
+# Address the exporter listens on. Use "" for every interface.
+METRICS_ADDRESS = "127.0.0.1"
+
+# Exporter files: the port it's serving on (present while it runs), and
+# the events spooled by other processes
+METRICS_DIR = "/tmp/conweather"
+EXPORTER_FILE = os.path.join(METRICS_DIR, "metrics.port")
+SPOOL_FILE = os.path.join(METRICS_DIR, "metrics.spool")
+
+# The spool isn't appended to beyond this size (e.g. if the exporter was
+# killed without removing EXPORTER_FILE)
+MAX_SPOOL_BYTES = 1024 * 1024
+
+# Fetch latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Events not yet spooled (other processes)
+pending = []
+
+# Metrics (exporter)
+fetches = {}        # (provider, endpoint) -> [bucket counts..., count, sum]
+fetchErrors = {}    # (provider, endpoint, status) -> count
+cacheLookups = {}   # (provider, endpoint, result) -> count
+refreshLocks = {}   # (provider, endpoint, result) -> [count, seconds waited]
+requestsToday = {}  # provider -> count
+callLimits = {}     # provider -> daily call limit
+observations = {}   # (provider, location) -> {gauge name: value}
+today = None
+
+lock = threading.Lock()
+
+###############################################################################
+# Record events. These are cheap: the exporter updates its metrics, other
+# processes keep the event for Flush().
+
+def ObserveFetch(source, seconds, status):
+    """Record a request to a server.
+      source : (provider, endpoint)
+      status : HTTP status, or None if the request failed"""
+
+    event = ("fetch", source[0], source[1], seconds, status)
+    if ENABLED:
+        apply(event)
+    else:
+        pending.append(event)
+
+def CountCache(key, result):
+    """Record a cache lookup of a key (see weatherCache.CacheKey).
+      result : "hit", "miss" or "stale" (old data used)"""
+
+    # Keys are provider_..._endpoint
+    parts = key.split("_")
+    CountLookup(parts[0], parts[-1], result)
+
+def CountLookup(provider, endpoint, result):
+    """Record a lookup of saved data"""
+
+    event = ("cache", provider, endpoint, result)
+    if ENABLED:
+        apply(event)
+    else:
+        pending.append(event)
+
+def CountRefreshLock(key, result, seconds):
+    """Record an attempt to refresh a cache entry (see weatherCache.AcquireRefresh).
+      result  : "acquired", "takeover", "coalesced" or "timeout"
+      seconds : time spent waiting for the lock"""
+
+    parts = key.split("_")
+    event = ("lock", parts[0], parts[-1], result, seconds)
+    if ENABLED:
+        apply(event)
+    else:
+        pending.append(event)
+
+def SetCallLimit(provider, limit):
+    """Record a provider's daily call limit"""
+    if limit is not None:
+        with lock:
+            callLimits[provider] = limit
+
+def SetObservation(provider, location, obs):
+    """Record the latest observation for a location"""
+
+    gauges = {
+        "temperature_fahrenheit": obs.temp,
+        "humidity_percent": obs.humidity,
+        "pressure_hpa": obs.hpa,
+        "wind_speed_mph": obs.speed,
+        "wind_direction_degrees": obs.dir,
+        "uv_index": obs.uvi,
+        "clouds_percent": obs.clouds,
+        "observation_timestamp_seconds": obs.dt,
+        "observation_stale": 1 if obs.stale else 0,
+    }
+    with lock:
+        observations[(provider, location)] = gauges
+
+###############################################################################
+# Update the metrics with an event.
+
+def apply(event):
+    """Add an event to the metrics"""
+
+    global today
+
+    with lock:
+        if event[0] == "fetch":
+            kind, provider, endpoint, seconds, status = event
+            counts = fetches.setdefault((provider, endpoint), [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += seconds
+            if status is None or status >= 400:
+                key = (provider, endpoint, "network" if status is None else str(status))
+                fetchErrors[key] = fetchErrors.get(key, 0) + 1
+
+            date = datetime.date.today()
+            if date != today:
+                today = date
+                requestsToday.clear()
+            requestsToday[provider] = requestsToday.get(provider, 0) + 1
+        elif event[0] == "cache":
+            key = event[1:]
+            cacheLookups[key] = cacheLookups.get(key, 0) + 1
+        elif event[0] == "lock":
+            counts = refreshLocks.setdefault(event[1:4], [0, 0.0])
+            counts[0] += 1
+            counts[1] += event[4]
+
+###############################################################################
+# Spool file: one event per line, as space-separated fields.
+
+def Flush():
+    """Append this process's events to the spool, if an exporter is running"""
+
+    global pending
+
+    events, pending = pending, []
+    if ENABLED or not events or not os.path.exists(EXPORTER_FILE):
+        return
+
+    lines = []
+    for event in events:
+        if event[0] == "fetch":
+            lines.append("fetch {p} {e} {s:.6f} {c}\n".format(p=event[1], e=event[2], s=event[3],
+                                                             c="-" if event[4] is None else event[4]))
+        elif event[0] == "lock":
+            lines.append("lock {p} {e} {r} {s:.6f}\n".format(p=event[1], e=event[2], r=event[3], s=event[4]))
+        else:
+            lines.append("cache {p} {e} {r}\n".format(p=event[1], e=event[2], r=event[3]))
+    try:
+        if os.path.getsize(SPOOL_FILE) > MAX_SPOOL_BYTES:
+            return
+    except OSError:
+        pass
+    try:
+        # One write in append mode, so lines from different processes don't mix
+        fd = os.open(SPOOL_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, "".join(lines).encode())
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def readSpool():
+    """Add the spooled events to the metrics, and empty the spool"""
+
+    reading = SPOOL_FILE + ".reading"
+    try:
+        # Processes appending after the rename start a new spool
+        os.replace(SPOOL_FILE, reading)
+    except OSError:
+        return
+    try:
+        with open(reading) as spool_file:
+            for line in spool_file:
+                fields = line.split()
+                try:
+                    if fields[0] == "fetch" and len(fields) == 5:
+                        status = None if fields[4] == "-" else int(fields[4])
+                        apply(("fetch", fields[1], fields[2], float(fields[3]), status))
+                    elif fields[0] == "cache" and len(fields) == 4:
+                        apply(("cache", fields[1], fields[2], fields[3]))
+                    elif fields[0] == "lock" and len(fields) == 5:
+                        apply(("lock", fields[1], fields[2], fields[3], float(fields[4])))
+                except (ValueError, IndexError):
+                    pass
+        os.unlink(reading)
+    except OSError:
+        pass
+
+###############################################################################
+# OpenMetrics text exposition.
+
+def labels(**items):
+    """Format a label set"""
+    return "{" + ",".join(name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                          for name, value in items.items()) + "}"
+
+def Render():
+    """Return the metrics in the OpenMetrics text format"""
+
+    readSpool()
+
+    out = []
+    with lock:
+        out.append("# TYPE conweather_fetch_duration_seconds histogram\n")
+        out.append("# UNIT conweather_fetch_duration_seconds seconds\n")
+        out.append("# HELP conweather_fetch_duration_seconds Time taken by requests to the weather service.\n")
+        for (provider, endpoint), counts in sorted(fetches.items()):
+            for bound, count in zip(BUCKETS + ("+Inf",), counts[:len(BUCKETS)] + [counts[-2]]):
+                out.append("conweather_fetch_duration_seconds_bucket" + labels(provider=provider, endpoint=endpoint, le=bound)
+                           + " " + str(count) + "\n")
+            out.append("conweather_fetch_duration_seconds_count" + labels(provider=provider, endpoint=endpoint)
+                       + " " + str(counts[-2]) + "\n")
+            out.append("conweather_fetch_duration_seconds_sum" + labels(provider=provider, endpoint=endpoint)
+                       + " " + repr(counts[-1]) + "\n")
+
+        out.append("# TYPE conweather_fetch_errors counter\n")
+        out.append("# HELP conweather_fetch_errors Failed requests, by HTTP status (or network).\n")
+        for (provider, endpoint, status), count in sorted(fetchErrors.items()):
+            out.append("conweather_fetch_errors_total" + labels(provider=provider, endpoint=endpoint, status=status)
+                       + " " + str(count) + "\n")
+
+        out.append("# TYPE conweather_cache_lookups counter\n")
+        out.append("# HELP conweather_cache_lookups Lookups of saved data: hit, miss, or stale data used.\n")
+        for (provider, endpoint, result), count in sorted(cacheLookups.items()):
+            out.append("conweather_cache_lookups_total" + labels(provider=provider, endpoint=endpoint, result=result)
+                       + " " + str(count) + "\n")
+
+        out.append("# TYPE conweather_refresh_locks counter\n")
+        out.append("# HELP conweather_refresh_locks Refreshes of saved data: acquired, takeover, coalesced (another process refreshed it) or timeout.\n")
+        for (provider, endpoint, result), counts in sorted(refreshLocks.items()):
+            out.append("conweather_refresh_locks_total" + labels(provider=provider, endpoint=endpoint, result=result)
+                       + " " + str(counts[0]) + "\n")
+        out.append("# TYPE conweather_refresh_lock_wait_seconds counter\n")
+        out.append("# UNIT conweather_refresh_lock_wait_seconds seconds\n")
+        out.append("# HELP conweather_refresh_lock_wait_seconds Time spent waiting for another process's refresh.\n")
+        for (provider, endpoint, result), counts in sorted(refreshLocks.items()):
+            out.append("conweather_refresh_lock_wait_seconds_total" + labels(provider=provider, endpoint=endpoint, result=result)
+                       + " " + repr(counts[1]) + "\n")
+
+        out.append("# TYPE conweather_requests_today gauge\n")
+        out.append("# HELP conweather_requests_today Requests made today (local time).\n")
+        for provider, count in sorted(requestsToday.items()):
+            out.append("conweather_requests_today" + labels(provider=provider) + " " + str(count) + "\n")
+
+        out.append("# TYPE conweather_daily_call_limit gauge\n")
+        out.append("# HELP conweather_daily_call_limit API calls allowed per day.\n")
+        for provider, limit in sorted(callLimits.items()):
+            out.append("conweather_daily_call_limit" + labels(provider=provider) + " " + str(limit) + "\n")
+
+        names = sorted({name for gauges in observations.values() for name in gauges})
+        for name in names:
+            out.append("# TYPE conweather_" + name + " gauge\n")
+            for (provider, location), gauges in sorted(observations.items()):
+                value = gauges.get(name)
+                if value is None:
+                    continue
+                out.append("conweather_" + name + labels(provider=provider, location=location)
+                           + " " + str(float(value)) + "\n")
+
+    out.append("# EOF\n")
+    return "".join(out)
+
+###############################################################################
+# HTTP server for scrapes. http.server is only imported by the exporter:
+# it would slow down every other invocation (e.g. the prompt fast path).
+
+def makeServer(port):
+    """Return an HTTP server for /metrics"""
+
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Serve /metrics"""
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = Render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((METRICS_ADDRESS, port), MetricsHandler)
+    server.daemon_threads = True
+    return server
+
+def stopExporter(server):
+    """Stop serving and remove the exporter file"""
+
+    server.shutdown()
+    server.server_close()
+    try:
+        os.unlink(EXPORTER_FILE)
+    except OSError:
+        pass
+
+def StartExporter(port):
+    """Start serving metrics on a background thread. Returns the server
+    (stop it with stopExporter())."""
+
+    global ENABLED
+
+    ENABLED = True
+    server = makeServer(port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(EXPORTER_FILE, "w") as port_file:
+        port_file.write(str(server.server_address[1]) + "\n")
+    return server
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Fetch weather for several locations at once (multi-location mode)
+#
+# The network round trips run concurrently on a bounded thread pool, so a
+# sweep of many sites takes about as long as the slowest single request.
+# Services that can ask for many locations in one request (Open-Meteo)
+# provide a batch fetch function instead, and no threads are needed.
+# Each location's data is extracted into its own WeatherObservation. Saved
+# data shown because the service was skipped (quota, circuit breaker, a
+# failed batch) is marked as degraded.
+###############################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+
+from weatherLocation import *
+from weatherCache import SavedDataUsed
+
+###############################################################################
+
+# Maximum number of requests in flight at the same time
+MAX_WORKERS = 8
+
+###############################################################################
+# Get weather data for every location.
+#   fetch   : provider function taking (location, DEBUG, useSaved) and
+#             returning the saved or received data
+#   extract : provider function taking (data, location) and returning a
+#             WeatherObservation
+#   batch   : optional provider function taking (locations, DEBUG, useSaved)
+#             and returning the data of every location (or an exception,
+#             for a location that failed); used instead of fetch when given
+# Returns one result per location, in the same order as the locations:
+#   {"location": <entry>, "data": <WeatherObservation>, "error": None}
+# "data" is None and "error" holds a message if that location failed.
+
+def extractLocation(extract, location, payload):
+    """Extract weather info for one location"""
+
+    obs = extract(payload, location)
+    # Providers that don't report a city name get the configured one
+    if obs.city is None:
+        obs.city = location["name"]
+    return obs
+
+def fetchLocation(fetch, extract, location, DEBUG, useSaved):
+    """Get and extract weather info for one location"""
+
+    try:
+        return extractLocation(extract, location, fetch(location, DEBUG, useSaved))
+    except SavedDataUsed as err:
+        return degraded(extract, location, err.data)
+
+def degraded(extract, location, payload):
+    """Extract saved data used because the service was skipped"""
+
+    obs = extractLocation(extract, location, payload)
+    obs.degraded = True
+    return obs
+
+def fetchBatch(batch, extract, locations, DEBUG, useSaved):
+    """Get weather info for several locations with one batch fetch"""
+
+    results = [{"location": location, "data": None, "error": None} for location in locations]
+    try:
+        payloads = batch(locations, DEBUG, useSaved)
+    except Exception as err:
+        for result in results:
+            result["error"] = str(err)
+        return results
+
+    for result, payload in zip(results, payloads):
+        if isinstance(payload, SavedDataUsed):
+            try:
+                result["data"] = degraded(extract, result["location"], payload.data)
+            except Exception as err:
+                result["error"] = str(err)
+            continue
+        if isinstance(payload, Exception):
+            result["error"] = str(payload)
+            continue
+        try:
+            result["data"] = extractLocation(extract, result["location"], payload)
+        except Exception as err:
+            result["error"] = str(err)
+    return results
+
+def FetchAllLocations(fetch, extract, locations=LOCATIONS, DEBUG=False, useSaved=True, max_workers=MAX_WORKERS,
+                      batch=None):
+    """Get weather info for several locations concurrently"""
+
+    results = []
+    if not locations:
+        return results
+
+    if batch is not None:
+        return fetchBatch(batch, extract, locations, DEBUG, useSaved)
+
+    workers = max(1, min(max_workers, len(locations)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetchLocation, fetch, extract, location, DEBUG, useSaved)
+                   for location in locations]
+
+        for location, future in zip(locations, futures):
+            result = {"location": location, "data": None, "error": None}
+            try:
+                result["data"] = future.result()
+            except Exception as err:
+                result["error"] = str(err)
+            results.append(result)
+
+    return results
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
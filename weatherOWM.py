@@ -25,12 +25,13 @@
 # Use OpenWeatherMap API to get weather for current location
 ###############################################################################
 
-import os
-import json
-import requests
-
 import weatherData
 
+from weatherCache import CacheKey, CachePath, CacheGet, RefreshEntry, RevalidateEntry, DEFAULT_TTL
+# weatherHTTP (with requests, slow to import) is only imported to make a request
+from weatherAstro import GetAstroStrings
+from weatherForecast import Forecast, MapCodes, HOURS, DAYS, FORECAST_TTL
+
 from weatherLocation import *
 from weatherIcons import *
 from weatherConversions import *
@@ -41,9 +42,23 @@ from weatherConversions import *
 # Generic OpenWeatherMap API 2.5 key
 API_KEY=None #"85a4e3c55b73909f42c6a23ec35b7147"
 
+# Server address; the benchmarks (bench/) point this at a local stub server
+BASE_URL="https://api.openweathermap.org/data/3.0/"
+
 UNITS="imperial" # standard (Kelvin, default), metric (Celcius), imperial (Fahrenheit)
 
-OUT_DATA_FILE="/tmp/owm_weather.json"
+# Name of this service, used in cache keys
+PROVIDER="owm"
+
+# Saved data for the current location
+OUT_DATA_KEY=CacheKey(PROVIDER, LAT, LON, UNITS, "onecall")
+OUT_DATA_FILE=CachePath(OUT_DATA_KEY)
+
+# How long each kind of saved data stays fresh
+FRESHNESS = {"onecall": DEFAULT_TTL, "forecast": FORECAST_TTL}
+
+# API calls allowed per day (free One Call 3.0 plan), used by the refresh daemon
+DAILY_CALL_LIMIT=1000
 
 # JSON object to hold server response
 jsonWeather = None
@@ -128,13 +143,46 @@ def displayConditions():
         print("id=" + str(c) + " [" + info["group"] + "]", end=" ")
         print(info["text"])
 
-def get_icon_from_code(code):
+def get_icon_from_code(code, isDay=None):
+    if isDay is None:
+        isDay = weatherData.isDay
     condition = conditions[code]
     group = condition["group"]
-    return get_icon(group, weatherData.isDay)
+    return get_icon(group, isDay)
+
+###############################################################################
+# Build the request line for the given coordinates.
+
+def BuildRequest(lat, lon):
+    """Build the OneCall request line for a location"""
+    # https://api.openweathermap.org/data/3.0/onecall?lat=42.5560134&lon=-71.1092244&appid=d97c18ac18688c519a13f72a398e41e7&units=imperial&exclude=minutely,hourly,daily,alerts
+    return BASE_URL + "onecall?" \
+        + "lat=" + lat \
+        + "&lon=" + lon \
+        + "&appid=" + API_KEY \
+        + "&units=" + UNITS \
+        + "&exclude=minutely,hourly,daily,alerts"
+
+def BuildForecastRequest(lat, lon):
+    """Build the OneCall request line for a location's hourly and daily forecast"""
+    return BASE_URL + "onecall?" \
+        + "lat=" + lat \
+        + "&lon=" + lon \
+        + "&appid=" + API_KEY \
+        + "&units=" + UNITS \
+        + "&exclude=current,minutely,alerts"
+
+###############################################################################
+# Time of the observation in a reply, to tell if it changed since the
+# saved one (see weatherCache.RefreshEntry).
+
+def currentStamp(payload):
+    return payload.get("current", {}).get("dt")
 
 ###############################################################################
 # Get the current location's current weather data from the server.
+# Returns True if the server's data was the saved data (which is then only
+# read when needed, see savedWeather()).
 
 def GetWeatherInfo(isRecent, DEBUG):
     """Get weather info from server"""
@@ -147,86 +195,209 @@ def GetWeatherInfo(isRecent, DEBUG):
     # Check if data is recent enough to re-use
     if isRecent:
         # Use saved data
-        with open(OUT_DATA_FILE) as text_file:
-            jsonWeather = json.load(text_file)
+        jsonWeather = CacheGet(OUT_DATA_KEY, -1)
         if DEBUG: # @DEBUG
             print(80 * "-")
             print(jsonWeather)
-        return
+        return False
 
     # Build command line
-    # https://api.openweathermap.org/data/3.0/onecall?lat=42.5560134&lon=-71.1092244&appid=d97c18ac18688c519a13f72a398e41e7&units=imperial&exclude=minutely,hourly,daily,alerts
-    REQ_LINE = "https://api.openweathermap.org/data/3.0/onecall?" \
-        + "lat=" + LAT \
-        + "&lon=" + LON \
-        + "&appid=" + API_KEY \
-        + "&units=" + UNITS \
-        + "&exclude=minutely,hourly,daily,alerts"
-    
+    REQ_LINE = BuildRequest(LAT, LON)
+
     if DEBUG: # @DEBUG
         print(80 * "-")
         print("> " + REQ_LINE)
 
-    response = requests.get(REQ_LINE)
-    jsonWeather = json.loads(response.text)
-
-    # Write JSON response to file to format it for reading
-    with open(OUT_DATA_FILE + ".raw", "w") as text_file:
-        text_file.write(response.text)
-    os.system("jq < " + OUT_DATA_FILE + ".raw > " + OUT_DATA_FILE)
-    # Remove the unformatted output file
-    os.system("rm -f " + OUT_DATA_FILE + ".raw")
+    # Save JSON response to file, formatted for reading. If another process
+    # is already refreshing it, use its data instead.
+    from weatherHTTP import HttpGetJSON
+    jsonWeather, unchanged = RevalidateEntry(OUT_DATA_KEY,
+                                             lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, "onecall"), validators=validators),
+                                             FRESHNESS["onecall"], currentStamp)
 
     if DEBUG: # @DEBUG
         print(80 * "-")
-        print(jsonWeather)
+        print(savedWeather())
+    return unchanged
+
+def savedWeather():
+    """Return the received data, reading the saved data if it wasn't read"""
+
+    global jsonWeather
+
+    if jsonWeather is None:
+        jsonWeather = CacheGet(OUT_DATA_KEY, -1)
+    return jsonWeather
+
+###############################################################################
+# Get weather data for one entry of LOCATIONS (multi-location mode).
+# This does not touch the module's globals, so it is safe to call from
+# several threads at once.
+
+def FetchLocationWeather(location, DEBUG=False, useSaved=True):
+    """Get weather info for one location from the cache or server"""
+
+    key = CacheKey(PROVIDER, location["lat"], location["lon"], UNITS, "onecall")
+    if useSaved:
+        payload = CacheGet(key, FRESHNESS["onecall"])
+        if payload is not None:
+            return payload
+
+    REQ_LINE = BuildRequest(location["lat"], location["lon"])
+
+    if DEBUG: # @DEBUG
+        print("> " + REQ_LINE)
+
+    from weatherHTTP import HttpGetJSON
+    return RefreshEntry(key, lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, "onecall"), validators=validators),
+                        FRESHNESS["onecall"], currentStamp, fallback=False)
+
+def ExtractLocationWeather(payload, location):
+    """Extract weather data received by FetchLocationWeather()"""
+
+    # City is unknown: weatherMulti uses the location's name
+    return ParseWeatherData(payload, location.get("alt", ALT))
 
 ###############################################################################
 # Extract current weather data from the received data file.
 
 def ExtractWeatherData():
+    """Extract the saved/received data for the current location"""
+
+    obs = ParseWeatherData(savedWeather())
+    obs.city = LOCN
+    # Keep the module-level weatherData items up to date
+    weatherData.publish(obs)
+    return obs
+
+###############################################################################
+# Parse received data into a new observation.
+
+def ParseWeatherData(payload, alt=ALT):
+    """Parse OneCall data into a WeatherObservation"""
+
     # ---------------------------------
     # Parse data for weather items
 
+    obs = weatherData.WeatherObservation(city=None)
+    current = payload["current"]
+
     # Date/time
-    weatherData.dt = jsonWeather["current"]["dt"]
-    weatherData.localtime = seconds_to_local(weatherData.dt)
-    weatherData.lastupdate = weatherData.localtime
+    obs.dt = current["dt"]
+    obs.localtime = seconds_to_local(obs.dt)
+    obs.lastupdate = obs.localtime
     # Sunrise & sunset
-    weatherData.sunr = jsonWeather["current"]["sunrise"]
-    weatherData.sunrise = seconds_to_time(weatherData.sunr)
-    weatherData.suns = jsonWeather["current"]["sunset"]
-    weatherData.sunset = seconds_to_time(weatherData.suns)
+    obs.sunr = current["sunrise"]
+    obs.sunrise = seconds_to_time(obs.sunr)
+    obs.suns = current["sunset"]
+    obs.sunset = seconds_to_time(obs.suns)
+    obs.isDay = obs.sunr <= obs.dt < obs.suns
+    # Moon data isn't in the response, so compute it locally
+    astro = GetAstroStrings(payload.get("lat", LAT), payload.get("lon", LON), alt, obs.dt)
+    obs.moonrise = astro["moonrise"]
+    obs.moonset = astro["moonset"]
+    obs.phase = astro["phase"]
     # Temperature
-    weatherData.temp = jsonWeather["current"]["temp"]
+    obs.temp = current["temp"]
     # Pressure
-    weatherData.hpa = jsonWeather["current"]["pressure"]
-    weatherData.inHg = hPa_to_inHg(weatherData.hpa)
-    weatherData.mmHg = inHg_to_mmHg(weatherData.inHg)
+    obs.hpa = current["pressure"]
+    obs.inHg = hPa_to_inHg(obs.hpa)
+    obs.mmHg = inHg_to_mmHg(obs.inHg)
     # Humidity
-    weatherData.humidity = jsonWeather["current"]["humidity"]
+    obs.humidity = current["humidity"]
     # Ultraviolet index
-    weatherData.uvi = jsonWeather["current"]["uvi"]
+    obs.uvi = current["uvi"]
     # Cloud cover (percentage)
-    weatherData.clouds = jsonWeather["current"]["clouds"]
+    obs.clouds = current["clouds"]
     # Wind speed and direction
-    weatherData.speed = jsonWeather["current"]["wind_speed"]
-    weatherData.dir = jsonWeather["current"]["wind_deg"]
-    if (weatherData.direction is None):
-        weatherData.direction = ""
+    obs.speed = current["wind_speed"]
+    obs.dir = current.get("wind_deg")
+    if obs.dir is None:
+        obs.direction = ""
     else:
-        weatherData.direction = degToCompass(weatherData.dir)
+        obs.direction = degToCompass(obs.dir)
     # Current conditions
-    weatherData.weather = jsonWeather["current"]["weather"][0]["main"]
-    weatherData.weatherCode = jsonWeather["current"]["weather"][0]["id"]
+    obs.weather = current["weather"][0]["main"]
+    obs.weatherCode = current["weather"][0]["id"]
     # Precipitation - Not reliable. Not always in the data.
-    # weatherData.precipitation = jsonWeather["current"]["rain"]["1h"]
-    # if (weatherData.precipitation is None):
-    #     weatherData.precip = "None"
-    weatherData.precip = None
+    # obs.precipitation = current["rain"]["1h"]
+    # if (obs.precipitation is None):
+    #     obs.precip = "None"
+    obs.precip = None
 
     # icon = get_icon(weather)
-    icon = get_icon_from_code(weatherData.weatherCode)
+    obs.icon = get_icon_from_code(obs.weatherCode, obs.isDay)
+
+    return obs
+
+###############################################################################
+# Get the hourly and daily forecast for a location (an entry like those of
+# LOCATIONS). Like FetchLocationWeather(), this doesn't touch the globals.
+
+def FetchForecast(location, DEBUG=False, useSaved=True):
+    """Get forecast info for one location from the cache or server"""
+
+    key = CacheKey(PROVIDER, location["lat"], location["lon"], UNITS, "forecast")
+    if useSaved:
+        payload = CacheGet(key, FRESHNESS["forecast"])
+        if payload is not None:
+            return payload
+
+    REQ_LINE = BuildForecastRequest(location["lat"], location["lon"])
+
+    if DEBUG: # @DEBUG
+        print("> " + REQ_LINE)
+
+    from weatherHTTP import HttpGetJSON
+    return RefreshEntry(key, lambda validators: HttpGetJSON(REQ_LINE, source=(PROVIDER, "forecast"), validators=validators),
+                        FRESHNESS["forecast"])
+
+###############################################################################
+# Parse received forecast data into columns.
+
+def ParseForecast(payload):
+    """Parse OneCall forecast data into a Forecast"""
+
+    # City is unknown: the caller uses the location's name
+    fc = Forecast()
+
+    hours = payload.get("hourly", [])[:HOURS]
+    codes = [h["weather"][0]["id"] for h in hours]
+    isDay = [h["weather"][0]["icon"].endswith("d") for h in hours]
+    fc.setHourly(
+        dt=[h["dt"] for h in hours],
+        temp=[h["temp"] for h in hours],
+        humidity=[h["humidity"] for h in hours],
+        hpa=[h["pressure"] for h in hours],
+        speed=[h["wind_speed"] for h in hours],
+        dir=[h.get("wind_deg") for h in hours],
+        pop=[h.get("pop", 0) * 100 for h in hours],
+        # Rain and snow are always in mm
+        precip=mm_to_in_batch([h.get("rain", {}).get("1h", 0) + h.get("snow", {}).get("1h", 0) for h in hours]),
+        weatherCode=codes,
+        isDay=isDay,
+        weather=[h["weather"][0]["main"] for h in hours],
+        icon=MapCodes(codes, isDay, get_icon_from_code),
+    )
+
+    days = payload.get("daily", [])[:DAYS]
+    codes = [d["weather"][0]["id"] for d in days]
+    fc.setDaily(
+        dt=[d["dt"] for d in days],
+        tempMin=[d["temp"]["min"] for d in days],
+        tempMax=[d["temp"]["max"] for d in days],
+        humidity=[d["humidity"] for d in days],
+        hpa=[d["pressure"] for d in days],
+        speed=[d["wind_speed"] for d in days],
+        dir=[d.get("wind_deg") for d in days],
+        pop=[d.get("pop", 0) * 100 for d in days],
+        precip=mm_to_in_batch([d.get("rain", 0) + d.get("snow", 0) for d in days]),
+        weatherCode=codes,
+        weather=[d["weather"][0]["main"] for d in days],
+        icon=MapCodes(codes, [True] * len(codes), get_icon_from_code),
+    )
+
+    return fc
 
 ###############################################################################
 
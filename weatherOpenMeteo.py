@@ -0,0 +1,471 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Use Open-Meteo to get weather for current location
+#
+# Open-Meteo needs no API key, and one request can ask for many locations
+# (comma-separated latitudes and longitudes). The multi-location modes use
+# that: FetchLocationsWeather() and FetchForecasts() get every location
+# that has no fresh saved data in one request, and split the response into
+# one saved entry per location.
+###############################################################################
+
+import weatherData
+
+from weatherCache import CacheKey, CachePath, CacheGet, CacheRenew, RefreshEntry, RevalidateEntry, SavedDataUsed, DEFAULT_TTL
+# weatherHTTP (with requests, slow to import) is only imported to make a request
+from weatherAstro import GetAstroStrings
+from weatherForecast import Forecast, MapCodes, HOURS, DAYS, FORECAST_TTL
+
+from weatherLocation import *
+from weatherIcons import *
+from weatherConversions import *
+
+###############################################################################
+
+# Server address; the benchmarks (bench/) point this at a local stub server
+BASE_URL="https://api.open-meteo.com/v1/"
+
+# Units of the received data, as used by the other services (imperial)
+UNITS="imperial"
+UNITS_PARAMS="&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
+
+# Name of this service, used in cache keys
+PROVIDER="meteo"
+
+# Saved data for the current location
+OUT_DATA_KEY=CacheKey(PROVIDER, LAT, LON, UNITS, "current")
+OUT_DATA_FILE=CachePath(OUT_DATA_KEY)
+
+# How long each kind of saved data stays fresh
+FRESHNESS = {"current": DEFAULT_TTL, "forecast": FORECAST_TTL}
+
+# API calls allowed per day (free, non-commercial use), used by the refresh daemon
+DAILY_CALL_LIMIT=10000
+
+# Most locations asked for in one request
+BATCH_SIZE=100
+
+# Items requested
+CURRENT_ITEMS = ["temperature_2m", "relative_humidity_2m", "is_day", "precipitation", "weather_code",
+                 "cloud_cover", "pressure_msl", "wind_speed_10m", "wind_direction_10m", "uv_index"]
+HOURLY_ITEMS = ["temperature_2m", "relative_humidity_2m", "pressure_msl", "wind_speed_10m",
+                "wind_direction_10m", "precipitation_probability", "precipitation", "weather_code", "is_day"]
+DAILY_ITEMS = ["weather_code", "temperature_2m_min", "temperature_2m_max", "relative_humidity_2m_mean",
+               "pressure_msl_mean", "wind_speed_10m_max", "wind_direction_10m_dominant",
+               "precipitation_probability_max", "precipitation_sum"]
+
+# JSON object to hold server response
+jsonWeather = None
+
+###############################################################################
+
+# WMO weather interpretation codes. Drizzle has no icon of its own: it's
+# shown as rain.
+conditions = {
+    0: {"group": "Clear", "text": "Clear sky"},
+    1: {"group": "Clear", "text": "Mainly clear"},
+    2: {"group": "Clouds", "text": "Partly cloudy"},
+    3: {"group": "Clouds", "text": "Overcast"},
+
+    45: {"group": "Fog", "text": "Fog"},
+    48: {"group": "Fog", "text": "Depositing rime fog"},
+
+    51: {"group": "Rain", "text": "Light drizzle"},
+    53: {"group": "Rain", "text": "Moderate drizzle"},
+    55: {"group": "Rain", "text": "Dense drizzle"},
+    56: {"group": "Rain", "text": "Light freezing drizzle"},
+    57: {"group": "Rain", "text": "Dense freezing drizzle"},
+
+    61: {"group": "Rain", "text": "Slight rain"},
+    63: {"group": "Rain", "text": "Moderate rain"},
+    65: {"group": "Rain", "text": "Heavy rain"},
+    66: {"group": "Rain", "text": "Light freezing rain"},
+    67: {"group": "Rain", "text": "Heavy freezing rain"},
+
+    71: {"group": "Snow", "text": "Slight snow fall"},
+    73: {"group": "Snow", "text": "Moderate snow fall"},
+    75: {"group": "Snow", "text": "Heavy snow fall"},
+    77: {"group": "Snow", "text": "Snow grains"},
+
+    80: {"group": "Rain", "text": "Slight rain showers"},
+    81: {"group": "Rain", "text": "Moderate rain showers"},
+    82: {"group": "Rain", "text": "Violent rain showers"},
+
+    85: {"group": "Snow", "text": "Slight snow showers"},
+    86: {"group": "Snow", "text": "Heavy snow showers"},
+
+    95: {"group": "Thunderstorm", "text": "Thunderstorm"},
+    96: {"group": "Thunderstorm", "text": "Thunderstorm with slight hail"},
+    99: {"group": "Thunderstorm", "text": "Thunderstorm with heavy hail"},
+}
+
+# Condition of a missing (null) or unknown code: no icon
+UNKNOWN = {"group": None, "text": "Unknown"}
+
+def displayConditions():
+    print("\nWeather conditions:")
+    for c in conditions:
+        info = conditions[c]
+        print("id=" + str(c) + " [" + info["group"] + "]", end=" ")
+        print(info["text"])
+
+def get_icon_from_code(code, isDay=None):
+    if isDay is None:
+        isDay = weatherData.isDay
+    group = conditions.get(code, UNKNOWN)["group"]
+    if group is None:
+        return ""
+    return get_icon(group, isDay)
+
+###############################################################################
+# Build the request line for one or more locations (entries like those of
+# LOCATIONS).
+
+def coordinates(locations):
+    return "latitude=" + ",".join(location["lat"] for location in locations) \
+        + "&longitude=" + ",".join(location["lon"] for location in locations)
+
+def BuildRequest(locations):
+    """Build the current conditions request line for some locations"""
+    # https://api.open-meteo.com/v1/forecast?latitude=42.5048,42.3601&longitude=-71.1956,-71.0589&current=temperature_2m,...
+    return BASE_URL + "forecast?" \
+        + coordinates(locations) \
+        + "&current=" + ",".join(CURRENT_ITEMS) \
+        + "&daily=sunrise,sunset&forecast_days=1" \
+        + UNITS_PARAMS \
+        + "&timeformat=unixtime&timezone=auto"
+
+def BuildForecastRequest(locations):
+    """Build the hourly and daily forecast request line for some locations"""
+    return BASE_URL + "forecast?" \
+        + coordinates(locations) \
+        + "&hourly=" + ",".join(HOURLY_ITEMS) \
+        + "&forecast_hours=" + str(HOURS) \
+        + "&daily=" + ",".join(DAILY_ITEMS) \
+        + "&forecast_days=" + str(DAYS) \
+        + UNITS_PARAMS \
+        + "&timeformat=unixtime&timezone=auto"
+
+###############################################################################
+# Split a response into one entry per location. A request for one location
+# gets an object, a request for several a list of them, in request order.
+# Raises ValueError if the server returned an error.
+
+def SplitResponse(payload, count):
+    """Return the data for each location of a request"""
+
+    if isinstance(payload, dict):
+        if payload.get("error"):
+            raise ValueError("Open-Meteo: " + str(payload.get("reason", "request failed")))
+        payload = [payload]
+    if len(payload) != count:
+        raise ValueError("Open-Meteo: got {n} location(s), expected {c}".format(n=len(payload), c=count))
+    return payload
+
+def fetchOne(REQ_LINE, endpoint, validators=None):
+    from weatherHTTP import HttpGetJSON
+    return SplitResponse(HttpGetJSON(REQ_LINE, source=(PROVIDER, endpoint), validators=validators), 1)[0]
+
+# Time of the observation in a location's data, to tell if it changed since
+# the saved one (see weatherCache.RefreshEntry).
+
+def currentStamp(payload):
+    return payload.get("current", {}).get("time")
+
+###############################################################################
+# Get the current location's current weather data from the server.
+# Returns True if the server's data was the saved data (which is then only
+# read when needed, see savedWeather()).
+
+def GetWeatherInfo(isRecent, DEBUG):
+    """Get weather info from server"""
+
+    global jsonWeather
+
+    # Check if data is recent enough to re-use
+    if isRecent:
+        # Use saved data
+        jsonWeather = CacheGet(OUT_DATA_KEY, -1)
+        if DEBUG: # @DEBUG
+            print(80 * "-")
+            print(jsonWeather)
+        return False
+
+    # Build command line
+    REQ_LINE = BuildRequest([{"lat": LAT, "lon": LON}])
+
+    if DEBUG: # @DEBUG
+        print(80 * "-")
+        print("> " + REQ_LINE)
+
+    # Save JSON response to file, formatted for reading. If another process
+    # is already refreshing it, use its data instead.
+    jsonWeather, unchanged = RevalidateEntry(OUT_DATA_KEY, lambda validators: fetchOne(REQ_LINE, "current", validators),
+                                             FRESHNESS["current"], currentStamp)
+
+    if DEBUG: # @DEBUG
+        print(80 * "-")
+        print(savedWeather())
+    return unchanged
+
+def savedWeather():
+    """Return the received data, reading the saved data if it wasn't read"""
+
+    global jsonWeather
+
+    if jsonWeather is None:
+        jsonWeather = CacheGet(OUT_DATA_KEY, -1)
+    return jsonWeather
+
+###############################################################################
+# Get data for several locations, in as few requests as possible.
+# Saved data is used where it's fresh (unless useSaved is False); the other
+# locations are requested BATCH_SIZE at a time and each one's data is saved
+# (unless the observation didn't change). When a request fails (or the
+# quota or circuit breaker doesn't allow it), the old data of its locations
+# is used.
+# Returns one payload per location, in the same order as the locations: the
+# exception instead, for a location of a failed request with no old data.
+
+def fetchBatch(locations, endpoint, build, DEBUG, useSaved):
+    """Get the saved or received data of an endpoint for several locations"""
+
+    keys = [CacheKey(PROVIDER, location["lat"], location["lon"], UNITS, endpoint) for location in locations]
+    payloads = [None] * len(locations)
+    if useSaved:
+        payloads = [CacheGet(key, FRESHNESS[endpoint]) for key in keys]
+
+    missing = [i for i, payload in enumerate(payloads) if payload is None]
+    for start in range(0, len(missing), BATCH_SIZE):
+        batch = missing[start:start + BATCH_SIZE]
+        REQ_LINE = build([locations[i] for i in batch])
+
+        if DEBUG: # @DEBUG
+            print("> " + REQ_LINE)
+
+        from weatherHTTP import HttpGetJSON
+        try:
+            received = SplitResponse(HttpGetJSON(REQ_LINE, source=(PROVIDER, endpoint)), len(batch))
+        except Exception as err:
+            received = [CacheGet(keys[i], -1) for i in batch]
+            received = [err if payload is None else SavedDataUsed(err, payload) for payload in received]
+        else:
+            for i, payload in zip(batch, received):
+                validators = {"stamp": currentStamp(payload)} if endpoint == "current" else None
+                CacheRenew(keys[i], payload, FRESHNESS[endpoint], validators)
+        for i, payload in zip(batch, received):
+            payloads[i] = payload
+
+    return payloads
+
+###############################################################################
+# Get weather data for one entry of LOCATIONS (multi-location mode).
+# This does not touch the module's globals, so it is safe to call from
+# several threads at once.
+
+def FetchLocationWeather(location, DEBUG=False, useSaved=True):
+    """Get weather info for one location from the cache or server"""
+
+    key = CacheKey(PROVIDER, location["lat"], location["lon"], UNITS, "current")
+    if useSaved:
+        payload = CacheGet(key, FRESHNESS["current"])
+        if payload is not None:
+            return payload
+
+    REQ_LINE = BuildRequest([location])
+
+    if DEBUG: # @DEBUG
+        print("> " + REQ_LINE)
+
+    return RefreshEntry(key, lambda validators: fetchOne(REQ_LINE, "current", validators),
+                        FRESHNESS["current"], currentStamp, fallback=False)
+
+def FetchLocationsWeather(locations, DEBUG=False, useSaved=True):
+    """Get weather info for several locations, batching the requests"""
+    return fetchBatch(locations, "current", BuildRequest, DEBUG, useSaved)
+
+def ExtractLocationWeather(payload, location):
+    """Extract weather data received by FetchLocationWeather()"""
+
+    # City is unknown: weatherMulti uses the location's name
+    return ParseWeatherData(payload, location.get("alt", ALT))
+
+###############################################################################
+# Extract current weather data from the received data file.
+
+def ExtractWeatherData():
+    """Extract the saved/received data for the current location"""
+
+    obs = ParseWeatherData(savedWeather())
+    obs.city = LOCN
+    # Keep the module-level weatherData items up to date
+    weatherData.publish(obs)
+    return obs
+
+###############################################################################
+# Parse received data into a new observation.
+
+def ParseWeatherData(payload, alt=ALT):
+    """Parse current conditions data into a WeatherObservation"""
+
+    # ---------------------------------
+    # Parse data for weather items
+
+    obs = weatherData.WeatherObservation(city=None)
+    current = payload["current"]
+
+    # Date/time
+    obs.dt = current["time"]
+    obs.localtime = seconds_to_local(obs.dt)
+    obs.lastupdate = obs.localtime
+    # Sunrise & sunset (today's)
+    obs.sunr = payload["daily"]["sunrise"][0]
+    obs.sunrise = seconds_to_time(obs.sunr)
+    obs.suns = payload["daily"]["sunset"][0]
+    obs.sunset = seconds_to_time(obs.suns)
+    obs.isDay = bool(current["is_day"])
+    # Moon data isn't in the response, so compute it locally
+    astro = GetAstroStrings(payload.get("latitude", LAT), payload.get("longitude", LON), alt, obs.dt)
+    obs.moonrise = astro["moonrise"]
+    obs.moonset = astro["moonset"]
+    obs.phase = astro["phase"]
+    # Temperature
+    obs.temp = current["temperature_2m"]
+    # Pressure (at sea level, like the other services)
+    obs.hpa = current["pressure_msl"]
+    obs.inHg = hPa_to_inHg(obs.hpa)
+    obs.mmHg = inHg_to_mmHg(obs.inHg)
+    # Humidity
+    obs.humidity = current["relative_humidity_2m"]
+    # Ultraviolet index
+    obs.uvi = current.get("uv_index", 0.0)
+    # Cloud cover (percentage)
+    obs.clouds = current["cloud_cover"]
+    # Wind speed and direction
+    obs.speed = current["wind_speed_10m"]
+    obs.dir = current.get("wind_direction_10m")
+    if obs.dir is None:
+        obs.direction = ""
+    else:
+        obs.direction = degToCompass(obs.dir)
+    # Current conditions
+    obs.weatherCode = current.get("weather_code")
+    obs.weather = conditions.get(obs.weatherCode, UNKNOWN)["text"]
+    # Precipitation (inches)
+    obs.precip = current.get("precipitation")
+
+    # icon = get_icon(weather)
+    obs.icon = get_icon_from_code(obs.weatherCode, obs.isDay)
+
+    return obs
+
+###############################################################################
+# Get the hourly and daily forecast for a location (an entry like those of
+# LOCATIONS). Like FetchLocationWeather(), this doesn't touch the globals.
+
+def FetchForecast(location, DEBUG=False, useSaved=True):
+    """Get forecast info for one location from the cache or server"""
+
+    key = CacheKey(PROVIDER, location["lat"], location["lon"], UNITS, "forecast")
+    if useSaved:
+        payload = CacheGet(key, FRESHNESS["forecast"])
+        if payload is not None:
+            return payload
+
+    REQ_LINE = BuildForecastRequest([location])
+
+    if DEBUG: # @DEBUG
+        print("> " + REQ_LINE)
+
+    return RefreshEntry(key, lambda validators: fetchOne(REQ_LINE, "forecast", validators),
+                        FRESHNESS["forecast"])
+
+def FetchForecasts(locations, DEBUG=False, useSaved=True):
+    """Get forecast info for several locations, batching the requests"""
+    return fetchBatch(locations, "forecast", BuildForecastRequest, DEBUG, useSaved)
+
+###############################################################################
+# Parse received forecast data into columns.
+# The response holds one list per item; items the server didn't return
+# (e.g. a daily mean it doesn't have for a model) are left missing.
+
+def series(block, name, count):
+    """The first count values of an item, or None's if it's missing"""
+    return block.get(name, [None] * count)[:count]
+
+def ParseForecast(payload):
+    """Parse forecast data into a Forecast"""
+
+    # City is unknown: the caller uses the location's name
+    fc = Forecast()
+
+    hourly = payload.get("hourly", {})
+    count = min(len(hourly.get("time", [])), HOURS)
+
+    codes = series(hourly, "weather_code", count)
+    isDay = series(hourly, "is_day", count)
+    fc.setHourly(
+        dt=series(hourly, "time", count),
+        temp=series(hourly, "temperature_2m", count),
+        humidity=series(hourly, "relative_humidity_2m", count),
+        hpa=series(hourly, "pressure_msl", count),
+        speed=series(hourly, "wind_speed_10m", count),
+        dir=series(hourly, "wind_direction_10m", count),
+        pop=series(hourly, "precipitation_probability", count),
+        precip=series(hourly, "precipitation", count),
+        weatherCode=codes,
+        isDay=isDay,
+        weather=[conditions.get(c, UNKNOWN)["text"] for c in codes],
+        icon=MapCodes(codes, isDay, get_icon_from_code),
+    )
+
+    daily = payload.get("daily", {})
+    count = min(len(daily.get("time", [])), DAYS)
+
+    codes = series(daily, "weather_code", count)
+    fc.setDaily(
+        # Midday, like OneCall (time is local midnight)
+        dt=[t + 12 * 60 * 60 for t in series(daily, "time", count)],
+        tempMin=series(daily, "temperature_2m_min", count),
+        tempMax=series(daily, "temperature_2m_max", count),
+        humidity=series(daily, "relative_humidity_2m_mean", count),
+        hpa=series(daily, "pressure_msl_mean", count),
+        speed=series(daily, "wind_speed_10m_max", count),
+        dir=series(daily, "wind_direction_10m_dominant", count),
+        pop=series(daily, "precipitation_probability_max", count),
+        precip=series(daily, "precipitation_sum", count),
+        weatherCode=codes,
+        weather=[conditions.get(c, UNKNOWN)["text"] for c in codes],
+        icon=MapCodes(codes, [True] * len(codes), get_icon_from_code),
+    )
+
+    return fc
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
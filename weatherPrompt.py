@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# weatherPrompt.py
+#   Fast path for shell prompts and status lines.
+#   Takes the same options as weather.py. Every refresh in weather.py saves
+#   each output format already rendered; if the requested one is still
+#   fresh it's printed straight from that file, without importing the
+#   weather service, HTTP or color modules, or parsing any JSON. Otherwise
+#   (or for options other than the ones below) weather.py is run instead.
+#
+#   Usage: weatherPrompt.py [-p NAME] [-o] [-b MS] [-s | -t | -1]
+#
+#   e.g. PS1='$(~/conWeather/weatherPrompt.py -1 -b 30) \$ '
+###############################################################################
+
+import os
+import sys
+import time
+
+from weatherProviders import SelectedProvider
+from weatherMetrics import CountLookup, Flush
+
+###############################################################################
+
+# Directory holding the rendered output
+RENDER_DIR = "/tmp/conweather"
+
+# Output format options, and the name of each format
+FORMATS = {"-s": "short", "-t": "tiny", "-1": "oneline"}
+DEFAULT_FORMAT = "full"
+
+###############################################################################
+# Terminal capabilities the output is rendered for: ANSI colors, or plain
+# text when NO_COLOR is set or the terminal is dumb.
+
+def RenderCaps(environ=os.environ):
+    """Return the terminal capabilities key"""
+
+    if environ.get("NO_COLOR") or environ.get("TERM") == "dumb":
+        return "plain"
+    return "ansi"
+
+def RenderFile(provider, fmt, caps):
+    """Return the file holding one rendered output format"""
+    return os.path.join(RENDER_DIR, "render_" + provider + "_" + fmt + "_" + caps + ".txt")
+
+def RenewFile(provider):
+    """Return the file renewing every rendered output format"""
+    return os.path.join(RENDER_DIR, "render_" + provider + ".renew")
+
+###############################################################################
+# Rendered files start with a header line:
+#   conWeather <data version> <expiry Unix time>
+# When a refresh finds the data unchanged, only the renew file (holding
+# just that header) is written: it extends rendered files of the same
+# data version.
+
+def RenderHeader(version, expires):
+    """Build the header line of a rendered file"""
+    return "conWeather " + version.replace(" ", "_") + " " + str(int(expires)) + "\n"
+
+def ReadRendered(path, renewPath=None):
+    """Return the rendered output if it hasn't expired, or None"""
+
+    try:
+        with open(path) as text_file:
+            header = text_file.readline().split()
+            if len(header) != 3 or header[0] != "conWeather":
+                return None
+            if time.time() >= float(header[2]) and not isRenewed(header[1], renewPath):
+                return None
+            return text_file.read()
+    except (OSError, ValueError):
+        return None
+
+def RenderedVersion(path):
+    """Return the data version of a rendered file, or None"""
+
+    try:
+        with open(path) as text_file:
+            header = text_file.readline().split()
+    except OSError:
+        return None
+    if len(header) != 3 or header[0] != "conWeather":
+        return None
+    return header[1]
+
+def isRenewed(version, renewPath):
+    """Return True if the renew file extends a data version"""
+
+    if renewPath is None or RenderedVersion(renewPath) != version:
+        return False
+    try:
+        with open(renewPath) as text_file:
+            return time.time() < float(text_file.readline().split()[2])
+    except (OSError, ValueError):
+        return False
+
+###############################################################################
+# Print the rendered output, or run weather.py.
+
+def main(argv):
+    provider = SelectedProvider()
+    fmt = DEFAULT_FORMAT
+
+    fast = True
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in FORMATS:
+            fmt = FORMATS[arg]
+        elif arg == "-p" and i + 1 < len(argv):
+            i += 1
+            provider = argv[i]
+        elif arg == "-b" and i + 1 < len(argv):
+            # Only matters if the saved output is old
+            i += 1
+        elif arg != "-o":
+            fast = False
+            break
+        i += 1
+
+    if fast:
+        text = ReadRendered(RenderFile(provider, fmt, RenderCaps()), RenewFile(provider))
+        # Counted by the metrics exporter, if one is running
+        CountLookup(provider, "rendered", "miss" if text is None else "hit")
+        Flush()
+        if text is not None:
+            sys.stdout.write(text)
+            return
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather.py")
+    os.execv(sys.executable, [sys.executable, script] + argv)
+
+###############################################################################
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
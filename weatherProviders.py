@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Registry of weather service modules
+#
+# weather.py selects a service by name (-p NAME, the CONWEATHER_PROVIDER
+# environment variable, or DEFAULT_PROVIDER) and only that module is
+# imported, so other services cost nothing. To add a service, write a
+# module providing the names in INTERFACE and add it to PROVIDERS (or pass
+# its module name to -p).
+###############################################################################
+
+import os
+import importlib
+
+###############################################################################
+
+# Known weather services: name -> module
+PROVIDERS = {
+    "owm": "weatherOWM",    # OpenWeatherMap
+    "wapi": "weatherAPI",   # WeatherAPI
+    "meteo": "weatherOpenMeteo",    # Open-Meteo
+}
+
+# Service used when none is selected
+DEFAULT_PROVIDER = "owm"
+
+# Environment variable selecting the service
+PROVIDER_ENV = "CONWEATHER_PROVIDER"
+
+# Names every service module must define:
+#   PROVIDER               : service name, used in cache keys
+#   OUT_DATA_KEY           : cache key of the current location's data
+#   OUT_DATA_FILE          : saved data file for the current location
+#   DAILY_CALL_LIMIT       : API calls allowed per day (None if unlimited)
+#   GetWeatherInfo(isRecent, DEBUG) : fetch the current location's data;
+#                            True if it was unchanged (still the saved data)
+#   ExtractWeatherData()   : return a WeatherObservation from the received
+#                            data (also updating the weatherData items)
+#   FetchLocationWeather(location, DEBUG, useSaved)
+#   ExtractLocationWeather(payload, location) : return a WeatherObservation
+#   FetchForecast(location, DEBUG, useSaved)
+#   ParseForecast(payload) : return a weatherForecast.Forecast
+#   displayConditions()    : print the service's condition codes
+INTERFACE = ["PROVIDER", "OUT_DATA_KEY", "OUT_DATA_FILE", "DAILY_CALL_LIMIT",
+             "GetWeatherInfo", "ExtractWeatherData",
+             "FetchLocationWeather", "ExtractLocationWeather",
+             "FetchForecast", "ParseForecast",
+             "displayConditions"]
+
+# Names a service module may define, to get several locations' data with
+# fewer requests (used by multi-location mode when present):
+#   FetchLocationsWeather(locations, DEBUG, useSaved) : one payload per
+#                            location, for ExtractLocationWeather()
+#   FetchForecasts(locations, DEBUG, useSaved) : one payload per location,
+#                            for ParseForecast()
+# A location whose data couldn't be fetched gets the exception instead of
+# a payload.
+BATCH_INTERFACE = ["FetchLocationsWeather", "FetchForecasts"]
+
+# Requests a service makes per location in multi-location mode, unless it
+# defines CALLS_PER_LOCATION
+CALLS_PER_LOCATION = 1
+
+###############################################################################
+# Get the name of the selected service.
+
+def SelectedProvider(name=None):
+    """Return the given service name, or the configured one"""
+
+    if name:
+        return name
+    return os.environ.get(PROVIDER_ENV) or DEFAULT_PROVIDER
+
+###############################################################################
+# Import a service module on demand.
+#   name : a key of PROVIDERS, or the name of a module providing INTERFACE
+# Raises ValueError if the service is unknown or incomplete.
+
+def LoadProvider(name=None):
+    """Import and return the selected weather service module"""
+
+    name = SelectedProvider(name)
+    moduleName = PROVIDERS.get(name, name)
+
+    try:
+        module = importlib.import_module(moduleName)
+    except ImportError as err:
+        if err.name != moduleName:
+            # The module exists but one of its own imports failed
+            raise
+        raise ValueError("Unknown weather service: " + name
+                         + " (known: " + ", ".join(sorted(PROVIDERS)) + ")")
+
+    missing = [item for item in INTERFACE if not hasattr(module, item)]
+    if missing:
+        raise ValueError("Weather service " + name + " is missing: " + ", ".join(missing))
+
+    return module
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Shared API call quota
+#
+# The services' free plans allow a number of calls per day. Every request
+# to a service (see weatherHTTP.HttpGet) is counted here, in a state file
+# shared by all processes: foreground runs, background refreshes, the
+# refresh daemon and multi-location sweeps. Each service has:
+#   - a daily budget (its DAILY_CALL_LIMIT), reset at local midnight
+#   - a token bucket, refilled at the rate that spreads the budget over
+#     the day, so repeated forced refreshes (-f) can't use it up at once.
+#     It holds at least a multi-location sweep's requests.
+# A request beyond either raises QuotaExceeded, and the saved data is used
+# instead (see weatherCache.RefreshEntry). When the budget is being used
+# faster than the day goes by, Stretch() makes saved data stay fresh longer.
+###############################################################################
+
+import os
+import time
+import datetime
+
+import weatherCache
+
+###############################################################################
+
+# Set to False to make requests without counting them
+ENABLED = True
+
+# State file, and its lock file
+QUOTA_DIR = "/tmp/conweather"
+QUOTA_FILE = os.path.join(QUOTA_DIR, "quota.json")
+QUOTA_LOCK = os.path.join(QUOTA_DIR, "quota.lock")
+
+# Most requests that can be made back to back, unless a multi-location
+# sweep needs more (see SetDailyLimit())
+BUCKET_SIZE = 20
+
+# Longest stretch of the time saved data stays fresh
+MAX_STRETCH = 8.0
+
+# Daily call limit of each service in use: provider -> limit (None if
+# unlimited; requests are still counted)
+limits = {}
+
+# Bucket size of each service in use: provider -> requests
+buckets = {}
+
+###############################################################################
+
+class QuotaExceeded(Exception):
+    """A request would go beyond a service's quota"""
+
+###############################################################################
+# Register a service's daily call limit. Requests to services that aren't
+# registered aren't counted.
+#   sweep : requests a sweep of every location (-m) makes; the bucket holds
+#           at least that many (but no more than the daily limit), so a
+#           sweep started with a full bucket isn't cut short
+
+def SetDailyLimit(provider, limit, sweep=0):
+    """Set a service's daily call limit"""
+
+    size = max(BUCKET_SIZE, sweep)
+    if limit is not None:
+        size = min(size, limit)
+    limits[provider] = limit
+    buckets[provider] = size
+
+###############################################################################
+# State file handling. The file holds, per provider:
+#   {"day": "YYYY-MM-DD", "calls": <calls today>, "tokens": <bucket>, "time": <last update>}
+# (see weatherCache.UpdateStateFile)
+
+def readState():
+    """Read the shared quota state"""
+    return weatherCache.ReadStateFile(QUOTA_FILE)
+
+def current(entry, limit, now, size=BUCKET_SIZE):
+    """Bring a provider's entry up to date: reset the day, refill the bucket"""
+
+    day = time.strftime("%Y-%m-%d", time.localtime(now))
+    entry = dict(entry or {"day": day, "calls": 0, "tokens": size, "time": now})
+    if entry["day"] != day:
+        entry["day"] = day
+        entry["calls"] = 0
+    if limit is not None:
+        elapsed = max(now - entry["time"], 0.0)
+        entry["tokens"] = min(entry["tokens"] + elapsed * limit / 86400.0, size)
+    entry["time"] = now
+    return entry
+
+###############################################################################
+# Count requests to a service.
+# Raises QuotaExceeded, without counting them, if they would go beyond the
+# daily limit or there aren't enough tokens in the bucket.
+
+def Spend(provider, calls=1):
+    """Count calls to a service against its quota"""
+
+    if not ENABLED or provider not in limits:
+        return
+    limit = limits[provider]
+
+    def spend(state):
+        entry = current(state.get(provider), limit, time.time(), buckets.get(provider, BUCKET_SIZE))
+
+        if limit is not None:
+            if entry["calls"] + calls > limit:
+                raise QuotaExceeded("{p}: daily limit of {n} calls reached".format(p=provider, n=limit))
+            if entry["tokens"] < calls:
+                raise QuotaExceeded("{p}: too many calls, wait {s:.0f}s".format(
+                    p=provider, s=(calls - entry["tokens"]) * 86400.0 / limit))
+            entry["tokens"] -= calls
+        entry["calls"] += calls
+
+        state[provider] = entry
+
+    weatherCache.UpdateStateFile(QUOTA_FILE, QUOTA_LOCK, spend)
+
+###############################################################################
+# Read a service's quota use (any process's).
+
+def CallsToday(provider):
+    """Number of calls made to a service today"""
+
+    entry = current(readState().get(provider), None, time.time())
+    return entry["calls"]
+
+def CallsLeft(provider):
+    """Number of calls left in a service's daily budget (None if unlimited)"""
+
+    limit = limits.get(provider)
+    if limit is None:
+        return None
+    return max(limit - CallsToday(provider), 0)
+
+###############################################################################
+# How much longer saved data should stay fresh, to make the rest of the
+# budget last until midnight: 1.0 while calls are made no faster than the
+# day goes by, up to MAX_STRETCH.
+
+def Stretch(provider):
+    """Factor to apply to a service's refresh intervals"""
+
+    if not ENABLED or limits.get(provider) is None:
+        return 1.0
+    limit = limits[provider]
+
+    now = datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    dayLeft = (midnight - now).total_seconds() / 86400.0
+    budgetLeft = max(limit - CallsToday(provider), 0) / float(limit)
+
+    if budgetLeft >= dayLeft:
+        return 1.0
+    return min(dayLeft / max(budgetLeft, 1.0 / limit), MAX_STRETCH)
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+###############################################################################
+# MIT License
+#
+# Copyright (c) 2024 Nuncio Bitis
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+# Timings of each phase of a run (weather.py -T)
+#
+# Code to be timed runs in a phase:
+#     with Phase("extract"):
+#         ...
+# Each phase records when it started and how long it took (monotonic
+# clock), and the bytes received or read during it (see AddBytes()).
+# Phases may be nested. When timings are off, Phase() returns a shared
+# object that does nothing, so the hooks cost next to nothing.
+###############################################################################
+
+import sys
+import json
+import time
+import threading
+
+###############################################################################
+
+# Record timings (set by Enable())
+ENABLED = False
+
+# Time this module was imported: weather.py imports it first
+START = time.monotonic()
+
+# Recorded phases: (name, detail, start, seconds, bytes, depth), with start
+# relative to START
+records = []
+
+# Bytes received or read so far
+byteCount = 0
+
+lock = threading.Lock()
+local = threading.local()
+
+###############################################################################
+# Phases.
+
+class NullPhase:
+    """Phase used when timings are off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+class TimedPhase:
+    """Phase that records its timing"""
+
+    __slots__ = ("name", "detail", "start", "bytes", "depth")
+
+    def __init__(self, name, detail):
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.depth = getattr(local, "depth", 0)
+        local.depth = self.depth + 1
+        self.bytes = byteCount
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.monotonic()
+        local.depth = self.depth
+        # Bytes from other threads' concurrent phases are included
+        records.append((self.name, self.detail, self.start - START, end - self.start,
+                        byteCount - self.bytes, self.depth))
+        return False
+
+def Phase(name, detail=None):
+    """Return a context manager timing a phase (detail: e.g. a URL)"""
+    if not ENABLED:
+        return NULL_PHASE
+    return TimedPhase(name, detail)
+
+def Record(name, start, end, nbytes=0):
+    """Record a phase timed by the caller (monotonic start and end times)"""
+    if ENABLED:
+        records.append((name, None, start - START, end - start, nbytes, 0))
+
+def AddBytes(count):
+    """Count bytes received or read"""
+
+    global byteCount
+
+    if ENABLED:
+        with lock:
+            byteCount += count
+
+def Enable():
+    """Start recording timings"""
+
+    global ENABLED
+
+    ENABLED = True
+
+###############################################################################
+# Report the recorded timings, in the order the phases started. Phases run
+# on worker threads (e.g. multi-location mode) aren't indented.
+#   fmt : "text" for a table, "json" for one JSON object per line
+
+def describe(detail):
+    """Shorten a phase's detail: a URL to its last path item (without the
+    query, which holds the API key); other details are kept"""
+    if detail is None:
+        return ""
+    if "://" in detail:
+        return detail.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+    return detail
+
+def Report(fmt="text", out=None):
+    """Print the recorded timings"""
+
+    if out is None:
+        out = sys.stderr
+
+    total = time.monotonic() - START
+    phases = sorted(records, key=lambda record: (record[2], record[5]))
+
+    if fmt == "json":
+        for name, detail, start, seconds, nbytes, depth in phases:
+            out.write(json.dumps({"phase": name, "detail": describe(detail) or None,
+                                  "start_ms": round(start * 1000.0, 3), "ms": round(seconds * 1000.0, 3),
+                                  "bytes": nbytes, "depth": depth}) + "\n")
+        out.write(json.dumps({"phase": "total", "ms": round(total * 1000.0, 3), "bytes": byteCount}) + "\n")
+        return
+
+    out.write("Timings:\n")
+    for name, detail, start, seconds, nbytes, depth in phases:
+        # Cache keys end with the kind of data
+        label = ("  " * depth + name + " " + describe(detail).rsplit("_", 1)[-1]).rstrip()
+        line = "  {l:<28} {s:>9.3f} ms".format(l=label, s=seconds * 1000.0)
+        if nbytes:
+            line += " {b:>9d} bytes".format(b=nbytes)
+        out.write(line + "\n")
+    out.write("  {l:<28} {s:>9.3f} ms".format(l="total", s=total * 1000.0))
+    if byteCount:
+        out.write(" {b:>9d} bytes".format(b=byteCount))
+    out.write("\n")
+
+###############################################################################
+
+if __name__ == '__main__':
+    print()
+    print("This module is part of weather.py and is not meant to be executed alone.")
+    print()